@@ -1,28 +1,103 @@
 import argparse
+import concurrent.futures
+import contextlib
+import dataclasses
+import io
 import json
+import sqlite3
 import sys
 import os
 import logging
-from typing import List
+from typing import TYPE_CHECKING, Dict, List, Optional
 
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
+# Installed before any photo_selector import so the breakdown covers all of them
+from photo_selector.startup_timing import install_if_requested, active_timer
+install_if_requested(sys.argv)
+
+# Only what every command needs is imported here. Stage 1 (cv2, numpy, PIL),
+# grouping (torch) and the caches are imported inside the commands that use
+# them, so `write-xmp` starts without loading OpenCV.
 from photo_selector.config import default_config
-from photo_selector.pipeline.stage1_metrics import run_stage1
 from photo_selector.pipeline.stage2_xmp import run_stage2, load_results_from_csv
+from photo_selector.lr.xmp_manifest import MANIFEST_FILENAME
+from photo_selector.io.results_store import RESULTS_DB_FILENAME, SORT_COLUMNS, ResultsStore
 from photo_selector.pipeline.models import MetricsResult
-from photo_selector.io.results_writer import write_results
-from photo_selector.similarity.grouping import run_grouping
+
+if TYPE_CHECKING:
+    from photo_selector.io.cache_sqlite import CacheSQLite
+    from photo_selector.io.embedding_store import EmbeddingStore
 
 # Configure logging to stderr so stdout is clean for JSON
 logging.basicConfig(level=logging.INFO, stream=sys.stderr)
 logger = logging.getLogger("cli")
 
+# Set while `serve` runs a job: events get tagged with the job id
+_current_job_id: Optional[str] = None
+
 def print_json(data):
+    if _current_job_id is not None:
+        data = {**data, "job_id": _current_job_id}
     print(json.dumps(data), flush=True)
 
+class EngineSession:
+    """
+    State kept warm between jobs by `serve`: the Stage 1 process pool, the
+    metrics cache and one in-memory embedding cache per output dir.
+    Embedding models are memoized by the grouping module itself.
+    """
+
+    def __init__(self):
+        self._executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._executor_workers = 0
+        self._metrics_caches: Dict[str, "CacheSQLite"] = {}
+        self._embedding_caches: Dict[str, "EmbeddingStore"] = {}
+
+    def executor(self, workers: int) -> concurrent.futures.ProcessPoolExecutor:
+        workers = max(1, int(workers))
+        if self._executor is not None and self._executor_workers != workers:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+            self._executor_workers = workers
+        return self._executor
+
+    def metrics_cache(self) -> "CacheSQLite":
+        from photo_selector.io.cache_sqlite import CacheSQLite
+        from photo_selector.io.content_key import metrics_cache_path
+
+        # Jobs may point at different cache dirs
+        path = os.path.abspath(metrics_cache_path())
+        if path not in self._metrics_caches:
+            self._metrics_caches[path] = CacheSQLite(path)
+        return self._metrics_caches[path]
+
+    def embedding_cache(self, output_dir: str) -> "EmbeddingStore":
+        from photo_selector.similarity.grouping import embedding_store_dir, embedding_store_for
+
+        path = os.path.abspath(embedding_store_dir(output_dir))
+        if path not in self._embedding_caches:
+            self._embedding_caches[path] = embedding_store_for(output_dir)
+        return self._embedding_caches[path]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        for cache in self._metrics_caches.values():
+            cache.close()
+        self._metrics_caches.clear()
+        for store in self._embedding_caches.values():
+            store.close()
+        self._embedding_caches.clear()
+
+# Only set inside `serve`
+_session: Optional[EngineSession] = None
+
 def apply_config(config_path):
     if not config_path or not os.path.exists(config_path):
         return
@@ -47,6 +122,20 @@ def apply_config(config_path):
             if 'low_light' in t: default_config.LOW_LIGHT_THRESHOLD = float(t['low_light'])
             # Add others as needed
 
+        cache = config.get("cache")
+        if isinstance(cache, dict):
+            if "dir" in cache:
+                default_config.CACHE_DIR = str(cache["dir"] or "")
+            if "key_mode" in cache:
+                default_config.CACHE_KEY_MODE = str(cache["key_mode"])
+
+        inference = config.get("inference")
+        if isinstance(inference, dict):
+            if "backend" in inference:
+                default_config.INFERENCE_BACKEND = str(inference["backend"])
+            if "torch_threads" in inference:
+                default_config.TORCH_THREADS = int(inference["torch_threads"])
+
         grouping = config.get("grouping")
         if isinstance(grouping, dict):
             xmp = grouping.get("xmp")
@@ -63,12 +152,35 @@ def apply_config(config_path):
                     default_config.GROUP_ADD_KEYWORDS = bool(xmp["group_add_keywords"])
                 if "group_similar_but_worse_delta" in xmp:
                     default_config.GROUP_SIMILAR_BUT_WORSE_DELTA = float(xmp["group_similar_but_worse_delta"])
+
+        xmp_io = config.get("xmp_io")
+        if isinstance(xmp_io, dict):
+            if "min_concurrency" in xmp_io:
+                default_config.XMP_IO_MIN_CONCURRENCY = int(xmp_io["min_concurrency"])
+            if "max_concurrency" in xmp_io:
+                default_config.XMP_IO_MAX_CONCURRENCY = int(xmp_io["max_concurrency"])
             
         logger.info(f"Applied config from {config_path}")
     except Exception as e:
         logger.error(f"Failed to load config: {e}")
 
+def apply_cache_args(args):
+    """--cache-dir / --cache-key override the config file."""
+    if getattr(args, "cache_dir", None):
+        default_config.CACHE_DIR = args.cache_dir
+    if getattr(args, "cache_key", None):
+        default_config.CACHE_KEY_MODE = args.cache_key
+
+def apply_inference_args(args):
+    """--inference-backend / --torch-threads override the config file."""
+    if getattr(args, "inference_backend", None):
+        default_config.INFERENCE_BACKEND = args.inference_backend
+    if getattr(args, "torch_threads", None) is not None:
+        default_config.TORCH_THREADS = args.torch_threads
+
 def cmd_compute(args):
+    from photo_selector.pipeline.stage1_metrics import run_stage1
+
     # Profile logic
     if args.profile == "night":
         default_config.LOW_LIGHT_THRESHOLD = 20
@@ -80,6 +192,8 @@ def cmd_compute(args):
         # default_config.HIGHLIGHT_CLIPPING_THRESHOLD = ... (if exists)
 
     apply_config(args.config_json)
+    apply_cache_args(args)
+    apply_inference_args(args)
         
     def on_progress(done, total):
         print_json({"type": "progress", "done": done, "total": total})
@@ -88,21 +202,117 @@ def cmd_compute(args):
     output_dir = args.output_dir or args.input_dir
     os.makedirs(output_dir, exist_ok=True)
 
+    # Filled by run_stage1: decode factor counts of this run, summed over the workers
+    stats: dict = {}
     results = run_stage1(
         input_dir=args.input_dir,
-        output_csv=os.path.join(output_dir, "results.csv"),
+        output_csv=None if args.no_results_files else os.path.join(output_dir, "results.csv"),
         workers=args.workers,
+        executor=_session.executor(args.workers) if _session else None,
+        cache=_session.metrics_cache() if _session else None,
+        embed_cache=_session.embedding_cache(output_dir) if _session and args.embed_model else None,
         rebuild_cache=args.rebuild_cache,
-        progress_callback=on_progress
+        progress_callback=on_progress,
+        embed_model=args.embed_model,
+        thumb_long_edge=args.thumb_long_edge,
+        embedding_cache_dir=output_dir,
+        embed_batch_size=args.batch_size,
+        chunk_size=args.chunk_size,
+        stats=stats,
     )
     
-    results_data = [r.to_dict() for r in results]
-    
+    if args.no_results_files:
+        db_path = save_results(output_dir, results)
+        print_json({"type": "complete", "result_file": db_path, "results_db": db_path, **stats})
+        return
+
     json_path = os.path.join(output_dir, "results.json")
-    with open(json_path, 'w') as f:
-        json.dump(results_data, f, indent=2)
+    write_results_json(json_path, results)
+    db_path = save_results(output_dir, results)
         
-    print_json({"type": "complete", "result_file": json_path})
+    print_json({"type": "complete", "result_file": json_path, "results_db": db_path, **stats})
+
+def _results_files(output_dir: str) -> List[str]:
+    return [os.path.join(output_dir, name) for name in ("results.json", "results.csv")]
+
+def _newer_results_files(output_dir: str) -> List[str]:
+    """
+    results.json / results.csv changed since results.db last matched them
+    (all of them without a results.db), newest first. main.py and older
+    versions only write the files, and their results must not be shadowed
+    by the store.
+    """
+    db_path = os.path.join(output_dir, RESULTS_DB_FILENAME)
+    if not os.path.exists(db_path):
+        files = [p for p in _results_files(output_dir) if os.path.exists(p)]
+        return sorted(files, key=os.path.getmtime, reverse=True)
+    store = ResultsStore(db_path)
+    try:
+        return store.changed_sources(_results_files(output_dir))
+    finally:
+        store.close()
+
+def _read_results_file(path: str) -> List[MetricsResult]:
+    if path.endswith(".csv"):
+        return load_results_from_csv(path)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            raw = json.load(f)
+        if isinstance(raw, list):
+            return [MetricsResult.from_dict(r) for r in raw if isinstance(r, dict)]
+    except Exception as e:
+        logger.error(f"Failed to read results.json: {e}")
+    return []
+
+def load_results(output_dir: str) -> Optional[List[MetricsResult]]:
+    """
+    Results of a compute run from results.db, unless results.json /
+    results.csv is newer (then that file is read and imported into
+    results.db); None when none exists.
+    """
+    db_path = os.path.join(output_dir, RESULTS_DB_FILENAME)
+    files = _newer_results_files(output_dir)
+    if not files:
+        if not os.path.exists(db_path):
+            return None
+        store = ResultsStore(db_path)
+        try:
+            return store.load()
+        finally:
+            store.close()
+
+    results = []
+    for path in files:
+        results = _read_results_file(path)
+        if results:
+            break
+    if results:
+        try:
+            save_results(output_dir, results)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not import results into {RESULTS_DB_FILENAME}: {e}")
+    return results
+
+def save_results(output_dir: str, results: List[MetricsResult]) -> str:
+    """
+    Upserts the rows of results.db (only new or changed rows are written);
+    returns its path. Call it after writing results.json / results.csv:
+    the store records them as matching it.
+    """
+    db_path = os.path.join(output_dir, RESULTS_DB_FILENAME)
+    store = ResultsStore(db_path)
+    try:
+        store.replace_all(results)
+        store.mark_sources(_results_files(output_dir))
+    finally:
+        store.close()
+    return db_path
+
+def write_results_json(json_path: str, results: List[MetricsResult]) -> None:
+    # Compact, and dumps + one write: json.dump to a file goes through the pure-Python encoder
+    payload = json.dumps([r.to_dict() for r in results], separators=(",", ":"))
+    with open(json_path, "w", encoding="utf-8") as f:
+        f.write(payload)
 
 def cmd_write_xmp(args):
     apply_config(args.config_json)
@@ -115,56 +325,114 @@ def cmd_write_xmp(args):
         with open(args.selection_file, 'r') as f:
             selected_files = set(json.load(f))
             
-    json_path = os.path.join(output_dir, "results.json")
-    csv_path = os.path.join(output_dir, "results.csv")
-    
-    results = []
-    if os.path.exists(json_path):
-        try:
-            with open(json_path, 'r', encoding='utf-8') as f:
-                raw = json.load(f)
-            if isinstance(raw, list):
-                results = [MetricsResult.from_dict(r) for r in raw if isinstance(r, dict)]
-        except Exception as e:
-            logger.error(f"Failed to read results.json: {e}")
-            results = []
-
-    if not results:
-        if not os.path.exists(csv_path):
-            print_json({"type": "error", "msg": "results.json/results.csv not found"})
-            return
-        results = load_results_from_csv(csv_path)
+    results = load_results(output_dir)
+    if results is None:
+        print_json({"type": "error", "msg": "results.json/results.csv not found"})
+        return
     
     if args.only_selected and selected_files is not None:
         results = [r for r in results if r.filename in selected_files]
         
-    run_stage2(results, workers=4)
+    counts = run_stage2(
+        results,
+        workers=args.workers,
+        manifest_path=os.path.join(output_dir, MANIFEST_FILENAME),
+        processes=args.processes,
+    )
     
-    print_json({"type": "complete", "count": len(results)})
+    print_json({"type": "complete", "count": len(results), **counts})
+
+def cmd_scan_xmp(args):
+    from photo_selector.io.content_key import metrics_cache_path
+    from photo_selector.io.xmp_index import XmpIndex
+    from photo_selector.lr.xmp_scan import scan_sidecars
+
+    apply_config(args.config_json)
+    apply_cache_args(args)
+    output_dir = args.output_dir or args.input_dir
+
+    results = load_results(output_dir)
+    if results is None:
+        print_json({"type": "error", "msg": "results.json/results.csv not found"})
+        return
+    # Same resolution as grouping: as stored, else relative to the input dir
+    image_paths = []
+    for r in results:
+        fp = os.path.normpath(str(r.filename))
+        if not os.path.exists(fp) and os.path.exists(os.path.join(args.input_dir, fp)):
+            fp = os.path.join(args.input_dir, fp)
+        image_paths.append(fp)
+
+    def on_progress(done: int, total: int):
+        print_json({"type": "progress", "done": done, "total": total})
+
+    index_path = os.path.abspath(metrics_cache_path())
+    index = XmpIndex(index_path)
+    try:
+        counts = scan_sidecars(
+            image_paths,
+            index,
+            workers=args.workers,
+            rebuild=args.rebuild,
+            progress_callback=on_progress,
+        )
+    finally:
+        index.close()
+
+    print_json({"type": "complete", "count": len(image_paths), "index_path": index_path, **counts})
+
+def cmd_query(args):
+    output_dir = args.output_dir or args.input_dir
+    db_path = os.path.join(output_dir, RESULTS_DB_FILENAME)
+    if _newer_results_files(output_dir):
+        load_results(output_dir)  # imports them into results.db
+    if not os.path.exists(db_path):
+        print_json({"type": "error", "msg": "results.db/results.json/results.csv not found"})
+        return
+
+    def flag(value: Optional[str]) -> Optional[bool]:
+        return None if value is None else value == "yes"
+
+    store = ResultsStore(db_path)
+    try:
+        if args.groups:
+            total, items = store.groups(offset=args.offset, limit=args.limit)
+        else:
+            total, items = store.query(
+                min_score=args.min_score,
+                max_score=args.max_score,
+                group_id=args.group_id,
+                group_best=True if args.group_best else None,
+                grouped=flag(args.grouped),
+                unusable=flag(args.unusable),
+                blurry=flag(args.blurry),
+                name=args.name,
+                sort=args.sort,
+                descending=args.desc,
+                offset=args.offset,
+                limit=args.limit,
+            )
+    finally:
+        store.close()
+
+    print_json({"type": "complete", "total": total, "offset": args.offset, "limit": args.limit, "items": items})
 
 def cmd_group(args):
+    from photo_selector.io.results_writer import write_results
+    from photo_selector.similarity.grouping import run_grouping
+
+    apply_cache_args(args)
+    apply_inference_args(args)
     output_dir = args.output_dir or args.input_dir
     os.makedirs(output_dir, exist_ok=True)
 
     json_path = os.path.join(output_dir, "results.json")
     csv_path = os.path.join(output_dir, "results.csv")
 
-    results: List[MetricsResult] = []
-    if os.path.exists(json_path):
-        try:
-            with open(json_path, "r", encoding="utf-8") as f:
-                raw = json.load(f)
-            if isinstance(raw, list):
-                results = [MetricsResult.from_dict(r) for r in raw if isinstance(r, dict)]
-        except Exception as e:
-            logger.error(f"Failed to read results.json: {e}")
-            results = []
-
-    if not results:
-        if not os.path.exists(csv_path):
-            print_json({"type": "error", "msg": "results.json/results.csv not found"})
-            return
-        results = load_results_from_csv(csv_path)
+    results = load_results(output_dir)
+    if results is None:
+        print_json({"type": "error", "msg": "results.json/results.csv not found"})
+        return
 
     def on_progress(evt: dict):
         print_json(evt)
@@ -184,28 +452,265 @@ def cmd_group(args):
         workers=args.workers,
         batch_size=args.batch_size,
         progress_callback=on_progress,
+        thumb_source=args.thumb_source,
+        neighbor_mode=args.neighbor_mode,
+        cache=_session.embedding_cache(output_dir) if _session else None,
+        executor=_session.executor(args.workers) if _session else None,
+        incremental=not args.rebuild_groups,
     )
 
-    write_results(grouped_results, csv_path)
-    results_data = [r.to_dict() for r in grouped_results]
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(results_data, f, indent=2)
-
-    print_json(
-        {
-            "type": "complete",
-            "groups_file": groups_path,
-            "results_json": json_path,
-            "results_csv": csv_path,
-        }
+    complete = {"type": "complete", "groups_file": groups_path}
+    if not args.no_results_files:
+        write_results(grouped_results, csv_path)
+        write_results_json(json_path, grouped_results)
+        complete.update({"results_json": json_path, "results_csv": csv_path})
+
+    # After the files: the store records them as matching it, so load_results keeps reading the store
+    db_path = os.path.join(output_dir, RESULTS_DB_FILENAME)
+    store = ResultsStore(db_path)
+    try:
+        updated = store.update_groups(grouped_results)
+        store.mark_sources(_results_files(output_dir))
+    finally:
+        store.close()
+    complete.update({"results_db": db_path, "results_updated": updated})
+    print_json(complete)
+
+def _open_ann_index(args, on_progress):
+    """Loads the ANN index for find-similar / dedup, building it from the embedding cache(s) if needed."""
+    from photo_selector.io.content_key import content_memo
+    from photo_selector.similarity.ann_index import ANN_INDEX_DIRNAME, IvfIndex
+    from photo_selector.similarity.grouping import embedding_key_model, embedding_store_dir, embedding_store_for
+
+    cache_paths = args.embedding_cache
+    if not cache_paths:
+        # Creates the store (and imports a legacy SQLite cache) if needed
+        embedding_store_for(args.output_dir).close()
+        cache_paths = [embedding_store_dir(args.output_dir)]
+    index_dir = args.index_dir or os.path.join(args.output_dir, ANN_INDEX_DIRNAME)
+    if IvfIndex.exists(index_dir) and not args.rebuild_index:
+        index = IvfIndex.load(index_dir)
+        if not (
+            index.meta.get("embed_model") == args.embed_model
+            and int(index.meta.get("thumb_long_edge", 0)) == args.thumb_long_edge
+            and index.meta.get("thumb_source") == args.thumb_source
+            and index.meta.get("model_key") == embedding_key_model(args.embed_model, args.thumb_source)
+        ):
+            logger.info("ANN index was built for different embedding settings, rebuilding")
+        elif not index.is_current(cache_paths):
+            logger.info("Embedding cache changed since the ANN index was built, rebuilding")
+        else:
+            return index, cache_paths
+
+    def on_build(phase: str, done: int, total: int):
+        on_progress({"type": "index", "phase": phase, "done": done, "total": total})
+
+    index = IvfIndex.build(
+        cache_paths,
+        index_dir,
+        embed_model=args.embed_model,
+        thumb_long_edge=args.thumb_long_edge,
+        thumb_source=args.thumb_source,
+        nlist=args.nlist,
+        progress_callback=on_build,
+        path_resolver=content_memo().path_for_hash,
     )
+    return index, cache_paths
 
-def main():
-    parser = argparse.ArgumentParser()
+def cmd_find_similar(args):
+    from photo_selector.io.embedding_store import open_embedding_cache
+    from photo_selector.similarity.grouping import compute_embeddings
+
+    apply_cache_args(args)
+    apply_inference_args(args)
+    photo = os.path.normpath(os.path.abspath(args.photo))
+    if not os.path.isfile(photo):
+        print_json({"type": "error", "msg": f"Photo not found: {args.photo}"})
+        return
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    try:
+        index, cache_paths = _open_ann_index(args, print_json)
+    except (OSError, ValueError) as e:
+        print_json({"type": "error", "msg": f"Could not open the ANN index: {e}"})
+        return
+    query = index.vector_for(photo)
+    if query is None:
+        # Not indexed yet: embed it through the (first) embedding cache
+        readable = [False]
+        embs, _ = compute_embeddings(
+            [photo],
+            embed_model=args.embed_model,
+            thumb_long_edge=args.thumb_long_edge,
+            cache=open_embedding_cache(cache_paths[0]),
+            thumb_source=args.thumb_source,
+            readable=readable,
+        )
+        query = embs[0]
+        if not readable[0]:
+            print_json({"type": "error", "msg": f"Could not read photo: {args.photo}"})
+            return
+
+    matches = [
+        {"filename": path, "similarity": sim}
+        for path, sim in index.search(query, k=args.topk + 1, nprobe=args.nprobe)
+        if os.path.normpath(os.path.abspath(path)) != photo and sim >= args.min_similarity
+    ][: args.topk]
+    print_json({"type": "complete", "photo": photo, "results": matches, "indexed": index.size})
+
+def cmd_dedup(args):
+    from photo_selector.similarity.ann_index import run_library_dedup
+
+    apply_cache_args(args)
+    apply_inference_args(args)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # Technical scores of the compute run in this output dir pick the best photo of each group
+    scores = {}
+    for r in load_results(args.output_dir) or []:
+        fp = os.path.normpath(str(r.filename))
+        if not os.path.isabs(fp) and not os.path.exists(fp):
+            fp = os.path.join(args.output_dir, fp)
+        scores[fp] = float(r.technical_score)
+
+    try:
+        index, _ = _open_ann_index(args, print_json)
+        groups_path = run_library_dedup(
+            index,
+            output_path=os.path.join(args.output_dir, "duplicates.json"),
+            eps=args.eps,
+            min_samples=args.min_samples,
+            nprobe=args.nprobe,
+            topk=args.topk,
+            scores=scores,
+            progress_callback=print_json,
+        )
+    except (OSError, ValueError) as e:
+        print_json({"type": "error", "msg": f"Dedup failed: {e}"})
+        return
+    print_json({"type": "complete", "groups_file": groups_path, "indexed": index.size})
+
+def _job_argv(command: str, job_args) -> List[str]:
+    """Turns {"input_dir": "x", "rebuild_cache": true} into CLI flags for `command`."""
+    if isinstance(job_args, list):
+        return [command, *[str(a) for a in job_args]]
+    argv = [command]
+    for key, value in (job_args or {}).items():
+        flag = "--" + str(key).replace("_", "-")
+        if value is True:
+            argv.append(flag)
+        elif value is False or value is None:
+            continue
+        else:
+            argv.extend([flag, str(value)])
+    return argv
+
+def cmd_serve(args):
+    """
+    Long-lived engine. Reads one JSON job per line from stdin, e.g.
+      {"id": "7", "command": "group", "args": {"input_dir": "D:/shoot", "eps": 0.1}}
+    and answers with the usual JSON-lines events, each tagged with "job_id",
+    followed by {"type": "job_done", "job_id": ...}. Jobs run one after another;
+    the process pool, caches and embedding models stay warm between them.
+    {"command": "shutdown"} (or EOF) ends the session.
+    """
+    global _session, _current_job_id
+
+    parser = build_parser()
+    _session = EngineSession()
+    print_json({"type": "ready", "pid": os.getpid()})
+    try:
+        for line in sys.stdin:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                job = json.loads(line)
+            except json.JSONDecodeError as e:
+                print_json({"type": "error", "msg": f"Invalid job: {e}"})
+                continue
+
+            command = str(job.get("command", ""))
+            _current_job_id = str(job.get("id", "")) or None
+            try:
+                if command == "shutdown":
+                    break
+                if command == "ping":
+                    print_json({"type": "pong"})
+                    continue
+                if command not in COMMANDS or command == "serve":
+                    print_json({"type": "error", "msg": f"Unknown command: {command}"})
+                    continue
+
+                # argparse prints usage / errors itself; keep them off the JSON-lines stream
+                captured = io.StringIO()
+                try:
+                    with contextlib.redirect_stdout(captured), contextlib.redirect_stderr(captured):
+                        job_ns = parser.parse_args(_job_argv(command, job.get("args")))
+                except SystemExit as e:
+                    text = captured.getvalue().strip()
+                    if e.code == 0:
+                        print_json({"type": "usage", "command": command, "text": text})
+                    else:
+                        detail = text.splitlines()[-1] if text else ""
+                        print_json({"type": "error", "msg": f"Invalid arguments for {command}: {detail}".rstrip(": ")})
+                    continue
+
+                # Profiles and config files mutate default_config; keep jobs independent
+                saved_config = dataclasses.asdict(default_config)
+                try:
+                    COMMANDS[command](job_ns)
+                except Exception as e:
+                    logger.exception(f"Job {_current_job_id} failed")
+                    print_json({"type": "error", "msg": str(e)})
+                finally:
+                    for k, v in saved_config.items():
+                        setattr(default_config, k, v)
+            finally:
+                if command not in ("shutdown", "ping"):
+                    print_json({"type": "job_done", "command": command})
+                _current_job_id = None
+    finally:
+        _session.close()
+        _session = None
+
+COMMANDS = {
+    "compute": cmd_compute,
+    "write-xmp": cmd_write_xmp,
+    "scan-xmp": cmd_scan_xmp,
+    "query": cmd_query,
+    "group": cmd_group,
+    "find-similar": cmd_find_similar,
+    "dedup": cmd_dedup,
+    "serve": cmd_serve,
+}
+
+def build_parser() -> argparse.ArgumentParser:
+    # Accepted before or after the subcommand. The flag itself is read from
+    # sys.argv at import time; argparse only has to tolerate it.
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        "--startup-timing",
+        action="store_true",
+        default=argparse.SUPPRESS,
+        help="Print a JSON import-time breakdown when the command finishes",
+    )
+
+    # Cache location / keying for the commands that read the caches
+    caching = argparse.ArgumentParser(add_help=False)
+    caching.add_argument("--cache-dir", help="Shared cache directory (metrics, embeddings, content keys)")
+    caching.add_argument("--cache-key", choices=["path", "content"])
+
+    # Torch embedding inference; --batch-size 0 / no --torch-threads use the autotuned values
+    inference = argparse.ArgumentParser(add_help=False)
+    inference.add_argument("--inference-backend", choices=["fp32", "channels_last", "bf16", "int8"])
+    inference.add_argument("--torch-threads", type=int)
+
+    parser = argparse.ArgumentParser(parents=[common])
     subparsers = parser.add_subparsers(dest="command")
     
     # Compute
-    p_compute = subparsers.add_parser("compute")
+    p_compute = subparsers.add_parser("compute", parents=[common, caching, inference])
     p_compute.add_argument("--input-dir", required=True)
     p_compute.add_argument("--output-dir")
     p_compute.add_argument("--profile", default="daylight")
@@ -213,17 +718,38 @@ def main():
     p_compute.add_argument("--max-long-edge", type=int, default=1024)
     p_compute.add_argument("--config-json")
     p_compute.add_argument("--rebuild-cache", action="store_true")
+    p_compute.add_argument("--chunk-size", type=int, default=8)
+    # Fused analysis: also fill the embedding cache for a later `group` run
+    p_compute.add_argument("--embed-model")
+    p_compute.add_argument("--thumb-long-edge", type=int, default=256)
+    p_compute.add_argument("--batch-size", type=int, default=0)
+    # results.db only: skip the results.json / results.csv exports
+    p_compute.add_argument("--no-results-files", action="store_true")
     
     # Write XMP
-    p_write = subparsers.add_parser("write-xmp")
+    p_write = subparsers.add_parser("write-xmp", parents=[common])
     p_write.add_argument("--input-dir", required=True)
     p_write.add_argument("--output-dir")
     p_write.add_argument("--only-selected", action="store_true")
     p_write.add_argument("--selection-file")
     p_write.add_argument("--config-json")
+    # 0: sidecar reads/writes in flight adapt to storage latency (XMP_IO_*_CONCURRENCY)
+    p_write.add_argument("--workers", type=int, default=0)
+    # Sidecar updates in worker processes instead of threads
+    p_write.add_argument("--processes", action="store_true")
+
+    # Scan XMP: index rating / label / keywords of the sidecars in the metrics cache
+    p_scan = subparsers.add_parser("scan-xmp", parents=[common, caching])
+    p_scan.add_argument("--input-dir", required=True)
+    p_scan.add_argument("--output-dir")
+    p_scan.add_argument("--config-json")
+    # 0: reads in flight adapt to storage latency (XMP_IO_*_CONCURRENCY)
+    p_scan.add_argument("--workers", type=int, default=0)
+    # Re-read every sidecar instead of only those whose size / mtime changed
+    p_scan.add_argument("--rebuild", action="store_true")
 
     # Group
-    p_group = subparsers.add_parser("group")
+    p_group = subparsers.add_parser("group", parents=[common, caching, inference])
     p_group.add_argument("--input-dir", required=True)
     p_group.add_argument("--output-dir")
     p_group.add_argument("--embed-model", default="mobilenet_v3_small")
@@ -231,22 +757,83 @@ def main():
     p_group.add_argument("--eps", type=float, default=0.12)
     p_group.add_argument("--min-samples", type=int, default=2)
     p_group.add_argument("--neighbor-window", type=int, default=80)
+    # "time": candidates come from the time window; --neighbor-window then only caps it (<= 0: no cap)
+    p_group.add_argument("--neighbor-mode", default="index", choices=["index", "time"])
     p_group.add_argument("--time-window-secs", type=float, default=6.0)
     p_group.add_argument("--time-source", default="auto", choices=["auto", "exif", "mtime"])
     p_group.add_argument("--topk", type=int, default=2)
     p_group.add_argument("--workers", type=int, default=4)
-    p_group.add_argument("--batch-size", type=int, default=32)
-    
+    p_group.add_argument("--batch-size", type=int, default=0)
+    p_group.add_argument("--thumb-source", default="decode", choices=["decode", "embedded"])
+    # Ignore group_state.* from the previous run and cluster everything again
+    p_group.add_argument("--rebuild-groups", action="store_true")
+    p_group.add_argument("--no-results-files", action="store_true")
+
+    # Query: one page of results.db, filtered and sorted
+    p_query = subparsers.add_parser("query", parents=[common])
+    p_query.add_argument("--input-dir", required=True)
+    p_query.add_argument("--output-dir")
+    p_query.add_argument("--min-score", type=float)
+    p_query.add_argument("--max-score", type=float)
+    p_query.add_argument("--group-id", type=int)
+    p_query.add_argument("--group-best", action="store_true", help="Only the best photo of each group")
+    p_query.add_argument("--grouped", choices=["yes", "no"])
+    p_query.add_argument("--unusable", choices=["yes", "no"])
+    p_query.add_argument("--blurry", choices=["yes", "no"])
+    p_query.add_argument("--name", help="Substring of the filename")
+    p_query.add_argument("--sort", default="filename", choices=list(SORT_COLUMNS))
+    p_query.add_argument("--desc", action="store_true")
+    p_query.add_argument("--offset", type=int, default=0)
+    p_query.add_argument("--limit", type=int, default=100)
+    # List groups (largest first) instead of photos; only --offset / --limit apply
+    p_query.add_argument("--groups", action="store_true")
+
+    # Library-wide similarity search over an ANN index built from embedding caches
+    ann = argparse.ArgumentParser(add_help=False)
+    ann.add_argument("--output-dir", required=True)
+    ann.add_argument(
+        "--embedding-cache", action="append", help="Embedding store dir or legacy .db to index (repeatable)"
+    )
+    ann.add_argument("--index-dir")
+    ann.add_argument("--rebuild-index", action="store_true")
+    ann.add_argument("--embed-model", default="mobilenet_v3_small")
+    ann.add_argument("--thumb-long-edge", type=int, default=256)
+    ann.add_argument("--thumb-source", default="decode", choices=["decode", "embedded"])
+    ann.add_argument("--nlist", type=int)
+    ann.add_argument("--nprobe", type=int, default=8)
+
+    p_similar = subparsers.add_parser("find-similar", parents=[common, caching, inference, ann])
+    p_similar.add_argument("--photo", required=True)
+    p_similar.add_argument("--topk", type=int, default=20)
+    p_similar.add_argument("--min-similarity", type=float, default=0.0)
+
+    p_dedup = subparsers.add_parser("dedup", parents=[common, caching, inference, ann])
+    p_dedup.add_argument("--eps", type=float, default=0.05)
+    p_dedup.add_argument("--min-samples", type=int, default=2)
+    p_dedup.add_argument("--topk", type=int, default=1)
+
+    # Serve: JSON-lines job loop on stdin/stdout
+    subparsers.add_parser("serve", parents=[common])
+
+    return parser
+
+def main():
+    parser = build_parser()
     args = parser.parse_args()
-    
-    if args.command == "compute":
-        cmd_compute(args)
-    elif args.command == "write-xmp":
-        cmd_write_xmp(args)
-    elif args.command == "group":
-        cmd_group(args)
-    else:
+
+    handler = COMMANDS.get(args.command)
+    if handler is None:
         parser.print_help()
+        return
+
+    timer = active_timer()
+    time_to_command_ms = timer.elapsed_ms() if timer else 0.0
+    try:
+        handler(args)
+    finally:
+        if timer is not None:
+            # Includes the imports the command pulled in lazily
+            print_json({**timer.report(), "command": args.command, "time_to_command_ms": time_to_command_ms})
 
 if __name__ == "__main__":
     # Fix for multiprocessing on Windows
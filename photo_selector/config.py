@@ -3,12 +3,32 @@ from dataclasses import dataclass, field
 from typing import Dict, List, Optional
 
 # Version for cache invalidation
-CACHE_SCHEMA_VERSION = "1.0.0"
+# 2.0.0: vectorized grid sharpness kernel and reduced-factor JPEG decode change the measured values
+CACHE_SCHEMA_VERSION = "2.0.0"
 
 @dataclass
 class Config:
     # Decoding
     DEFAULT_LONG_EDGE: int = 1024
+    # Metrics-only runs decode just the luma plane (IMREAD_REDUCED_GRAYSCALE_*)
+    LUMA_ONLY_DECODE: bool = True
+
+    # Caches
+    # CACHE_DIR: one shared location for the metrics cache, the embedding store
+    # and the content-key memo ("" = cache.db in the working directory and an
+    # embedding store per output dir).
+    # CACHE_KEY_MODE: "path" keys on path + size + mtime; "content" keys on a
+    # partial hash of the file bytes + size, so moved or copied folders hit the cache.
+    CACHE_DIR: str = ""
+    CACHE_KEY_MODE: str = "path"
+
+    # Embedding inference (torch models)
+    # INFERENCE_BACKEND: "fp32", "channels_last", "bf16" (channels_last +
+    # bfloat16 autocast) or "int8" (torchvision's quantized weights;
+    # mobilenet_v3_large / resnet50). bf16 / int8 vectors are cached separately.
+    # TORCH_THREADS: intra-op threads, 0 = autotuned per model and machine.
+    INFERENCE_BACKEND: str = "fp32"
+    TORCH_THREADS: int = 0
     
     # Thresholds
     # With grid-based detection, we focus on the sharpest 25% of the image.
@@ -27,12 +47,24 @@ class Config:
     # Actually, for 1024px resized images, variance drops significantly compared to 6000px images.
     # 100.0 is a reasonable cutoff for 1024px width.
     SHARPNESS_THRESHOLD: float = 100.0
+
+    # Sharpness grid: rows x cols blocks, optionally enlarged by TILE_OVERLAP
+    # (fraction of a block added around it), score = mean of the sharpest TOP_FRACTION blocks.
+    SHARPNESS_GRID_ROWS: int = 4
+    SHARPNESS_GRID_COLS: int = 4
+    SHARPNESS_TILE_OVERLAP: float = 0.0
+    SHARPNESS_TOP_FRACTION: float = 0.25
     
     # Exposure thresholds (percentiles)
     # If p50 < LOW_LIGHT_THRESHOLD -> underexposed
     # If p50 > HIGH_LIGHT_THRESHOLD -> overexposed
     LOW_LIGHT_THRESHOLD: int = 40
     HIGH_LIGHT_THRESHOLD: int = 220
+
+    # Luminance levels counted as clipped highlights (>=) / crushed shadows (<=).
+    # Re-evaluated from the cached histogram, so changing them needs no re-decode.
+    EXPOSURE_WHITE_LEVEL: int = 250
+    EXPOSURE_BLACK_LEVEL: int = 5
     
     # Weights for Technical Score
     WEIGHT_SHARPNESS: float = 0.6
@@ -40,6 +72,10 @@ class Config:
     
     # XMP
     XMP_NAMESPACE_URI: str = "http://ns.adobe.com/xap/1.0/"
+    # Sidecar I/O in flight during Stage 2 when no fixed worker count is
+    # given: adapted to the measured per-file latency within these bounds.
+    XMP_IO_MIN_CONCURRENCY: int = 2
+    XMP_IO_MAX_CONCURRENCY: int = 32
 
     GROUP_BEST_MIN_RATING: int = 4
     GROUP_TOP1_RATING: int = 5
@@ -1,21 +1,113 @@
-
 import sqlite3
 import os
 import json
+import struct
 import logging
-from typing import Optional, Dict, Any
+import queue
+import threading
+import zlib
+from typing import Optional, Dict, Any, Iterable, List, Tuple
+
+import numpy as np
+
 from photo_selector.config import CACHE_SCHEMA_VERSION
 
 logger = logging.getLogger(__name__)
 
+# Binary record layout (little endian):
+#   version, flags, capture_ts, sharpness, p1, p5, p50, p95, p99, white_ratio, black_ratio, dynamic_range
+# followed, when _FLAG_HAS_HISTOGRAM is set, by the zlib-compressed 256 x uint32 luminance histogram.
+_RECORD_V1 = struct.Struct("<BBdd5BddH")
+_RECORD_VERSION = 1
+_FLAG_HAS_METRICS = 0x01
+_FLAG_HAS_HISTOGRAM = 0x02
+
+# SQLite limits the number of host parameters per statement
+_SQL_BATCH = 500
+
+def encode_record(data: Dict[str, Any]) -> bytes:
+    """
+    Packs the measurement fields of MetricsResult.to_dict() into a compact record.
+    An optional "exp_histogram" entry (256 bins) is stored too.
+    Derived fields (scores, flags, reasons) are not stored: cache hits are always rescored.
+    """
+    capture_ts = float(data.get("capture_ts", 0.0) or 0.0)
+    if "sharpness_score" not in data or "exposure_score" not in data:
+        return _RECORD_V1.pack(_RECORD_VERSION, 0, capture_ts, 0.0, 0, 0, 0, 0, 0, 0.0, 0.0, 0)
+    flags = _FLAG_HAS_METRICS
+    tail = b""
+    hist = data.get("exp_histogram")
+    if hist is not None:
+        flags |= _FLAG_HAS_HISTOGRAM
+        tail = zlib.compress(np.asarray(hist, dtype="<u4").tobytes(), 1)
+    return _RECORD_V1.pack(
+        _RECORD_VERSION,
+        flags,
+        capture_ts,
+        float(data["sharpness_score"]),
+        *(max(0, min(255, int(data.get(k, 0)))) for k in ("exp_p1", "exp_p5", "exp_p50", "exp_p95", "exp_p99")),
+        float(data.get("white_ratio", 0.0)),
+        float(data.get("black_ratio", 0.0)),
+        max(0, int(data.get("dynamic_range", 0))),
+    ) + tail
+
+def decode_record(blob) -> Dict[str, Any]:
+    """Inverse of encode_record; returns a dict MetricsResult.from_dict understands."""
+    if isinstance(blob, str):
+        # Rows written before the binary format
+        return json.loads(blob)
+    (version, flags, capture_ts, sharp, p1, p5, p50, p95, p99, white, black, dr) = _RECORD_V1.unpack_from(blob)
+    if version != _RECORD_VERSION:
+        raise ValueError(f"Unknown cache record version {version}")
+    data: Dict[str, Any] = {"capture_ts": capture_ts}
+    if flags & _FLAG_HAS_METRICS:
+        data.update({
+            "sharpness_score": sharp,
+            "exposure_score": 0.0,
+            "exp_p1": p1,
+            "exp_p5": p5,
+            "exp_p50": p50,
+            "exp_p95": p95,
+            "exp_p99": p99,
+            "white_ratio": white,
+            "black_ratio": black,
+            "dynamic_range": dr,
+        })
+    if flags & _FLAG_HAS_HISTOGRAM:
+        raw = zlib.decompress(bytes(blob[_RECORD_V1.size:]))
+        data["exp_histogram"] = np.frombuffer(raw, dtype="<u4").astype(np.int64)
+    return data
+
 class CacheSQLite:
-    def __init__(self, db_path: str = "cache.db"):
+    """
+    Metrics cache. Reads go straight to SQLite (in bulk via get_many); writes are
+    queued and committed in batches by a background thread (write-behind) so the
+    result loop never waits for an fsync. Pending writes are visible to get().
+    """
+
+    def __init__(self, db_path: str = "cache.db", batch_size: int = 256, flush_interval: float = 0.5):
         self.db_path = db_path
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = float(flush_interval)
         self._conn = None
+        self._lock = threading.Lock()
+        self._pending: Dict[str, bytes] = {}
+        self._queue: "queue.Queue[Optional[Tuple[str, bytes]]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
         self._init_db()
 
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        except sqlite3.DatabaseError as e:
+            # e.g. network filesystems without shared memory support
+            logger.warning(f"WAL not available for {self.db_path}: {e}")
+        return conn
+
     def _init_db(self):
-        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn = self._connect()
         self._conn.row_factory = sqlite3.Row
         with self._conn:
             self._conn.execute("""
@@ -26,44 +118,155 @@ class CacheSQLite:
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             """)
-            
+
     def close(self):
+        self.flush()
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
         if self._conn:
             self._conn.close()
+            self._conn = None
 
     def get(self, signature: str) -> Optional[Dict[str, Any]]:
+        return self.get_many([signature]).get(signature)
+
+    def get_many(self, signatures: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Looks up many signatures with one query per 500 keys. Misses are omitted."""
+        out: Dict[str, Dict[str, Any]] = {}
+        todo: List[str] = []
+        with self._lock:
+            for sig in signatures:
+                if not sig:
+                    continue
+                blob = self._pending.get(sig)
+                if blob is not None:
+                    out[sig] = decode_record(blob)
+                else:
+                    todo.append(sig)
         try:
-            cursor = self._conn.execute(
-                "SELECT data FROM metrics_cache WHERE signature = ? AND schema_version = ?",
-                (signature, CACHE_SCHEMA_VERSION)
-            )
-            row = cursor.fetchone()
-            if row:
-                return json.loads(row['data'])
+            for i in range(0, len(todo), _SQL_BATCH):
+                part = todo[i:i + _SQL_BATCH]
+                placeholders = ",".join("?" * len(part))
+                with self._lock:
+                    rows = self._conn.execute(
+                        f"SELECT signature, data FROM metrics_cache "
+                        f"WHERE schema_version = ? AND signature IN ({placeholders})",
+                        (CACHE_SCHEMA_VERSION, *part),
+                    ).fetchall()
+                for row in rows:
+                    try:
+                        out[row['signature']] = decode_record(row['data'])
+                    except Exception as e:
+                        logger.warning(f"Cache record unreadable: {e}")
         except Exception as e:
             logger.error(f"Cache read error: {e}")
-        return None
+        return out
 
     def put(self, signature: str, data: Dict[str, Any]):
+        """Queues a write; it is committed by the writer thread in the next batch."""
         try:
-            json_data = json.dumps(data)
-            with self._conn:
-                self._conn.execute(
+            blob = encode_record(data)
+        except Exception as e:
+            logger.error(f"Cache write error: {e}")
+            return
+        with self._lock:
+            self._pending[signature] = blob
+        self._ensure_writer()
+        self._queue.put((signature, blob))
+
+    def put_many(self, items: Iterable[Tuple[str, Dict[str, Any]]]):
+        """Writes many rows in a single transaction (synchronously)."""
+        rows = []
+        for signature, data in items:
+            try:
+                rows.append((signature, CACHE_SCHEMA_VERSION, encode_record(data)))
+            except Exception as e:
+                logger.error(f"Cache write error: {e}")
+        with self._lock:
+            self._write_rows(self._conn, rows)
+
+    def flush(self):
+        """Blocks until every queued write has been committed."""
+        if self._writer is not None:
+            self._queue.join()
+
+    def _write_rows(self, conn: sqlite3.Connection, rows: List[Tuple[str, str, bytes]]):
+        if not rows:
+            return
+        try:
+            with conn:
+                conn.executemany(
                     """
                     INSERT OR REPLACE INTO metrics_cache (signature, schema_version, data)
                     VALUES (?, ?, ?)
                     """,
-                    (signature, CACHE_SCHEMA_VERSION, json_data)
+                    rows,
                 )
         except Exception as e:
             logger.error(f"Cache write error: {e}")
 
+    def _ensure_writer(self):
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._writer_loop, name="cache-writer", daemon=True)
+            self._writer.start()
+
+    def _writer_loop(self):
+        # Own connection: with WAL, readers on the main connection are not blocked by commits
+        conn = self._connect()
+        stop = False
+        while not stop:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = []
+            got = 1
+            if item is None:
+                stop = True
+            else:
+                batch.append(item)
+            # Drain whatever is already queued, up to one batch
+            while not stop and len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                got += 1
+                if item is None:
+                    stop = True
+                else:
+                    batch.append(item)
+
+            rows = [(sig, CACHE_SCHEMA_VERSION, sqlite3.Binary(blob)) for sig, blob in batch]
+            self._write_rows(conn, rows)
+            with self._lock:
+                for sig, blob in batch:
+                    if self._pending.get(sig) is blob:
+                        del self._pending[sig]
+            for _ in range(got):
+                self._queue.task_done()
+        conn.close()
+
     @staticmethod
-    def generate_signature(file_path: str, long_edge: int) -> str:
+    def generate_signature(
+        file_path: str,
+        long_edge: int,
+        content: Optional[Tuple[str, int]] = None,
+        params: str = "",
+    ) -> str:
+        """
+        params: the other settings the measured values depend on (see
+        stage1_metrics.measurement_params), so changing them misses the cache.
+        """
+        suffix = f"|{params}" if params else ""
+        if content is not None:
+            # Content-addressed: (partial hash, size) from io.content_key, independent of path and mtime
+            return f"content:{content[0]}|{content[1]}|{long_edge}{suffix}"
         try:
             stat = os.stat(file_path)
             # Signature includes file path, size, mtime, and processing parameters (long_edge)
-            return f"{file_path}|{stat.st_size}|{stat.st_mtime}|{long_edge}"
+            return f"{file_path}|{stat.st_size}|{stat.st_mtime}|{long_edge}{suffix}"
         except OSError:
             return ""
-
@@ -0,0 +1,149 @@
+import concurrent.futures
+import hashlib
+import logging
+import os
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+
+from photo_selector.config import default_config
+
+logger = logging.getLogger(__name__)
+
+CONTENT_MEMO_FILENAME = "content_keys.db"
+METRICS_CACHE_FILENAME = "cache.db"
+
+# Bytes hashed from each end of the file. The head covers the JPEG/EXIF
+# headers (capture time, camera serial), the tail the end of the entropy-coded data.
+_PARTIAL_BYTES = 64 * 1024
+_HASH_THREADS = 8
+
+
+def cache_dir() -> str:
+    """Shared cache directory from config; "" keeps the legacy per-location caches."""
+    return os.path.expanduser(str(default_config.CACHE_DIR or ""))
+
+
+def content_keys_enabled() -> bool:
+    return str(default_config.CACHE_KEY_MODE or "path").strip().lower() == "content"
+
+
+def metrics_cache_path() -> str:
+    """Metrics cache: inside the shared cache dir, else cache.db in the working directory."""
+    base = cache_dir()
+    if base:
+        os.makedirs(base, exist_ok=True)
+        return os.path.join(base, METRICS_CACHE_FILENAME)
+    return METRICS_CACHE_FILENAME
+
+
+def partial_content_hash(path: str, size: Optional[int] = None) -> str:
+    """blake2b over the file size plus its first and last 64 KB."""
+    if size is None:
+        size = os.path.getsize(path)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(int(size)).encode("ascii"))
+    with open(path, "rb") as f:
+        h.update(f.read(_PARTIAL_BYTES))
+        if size > 2 * _PARTIAL_BYTES:
+            f.seek(size - _PARTIAL_BYTES)
+            h.update(f.read(_PARTIAL_BYTES))
+        elif size > _PARTIAL_BYTES:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+class ContentKeyMemo:
+    """
+    Persistent path -> (size, mtime_ns, hash) memo, so a file is only hashed
+    again after it changed. Lives next to the metrics cache; used from the
+    main process only.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS content_keys (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                hash TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_content_keys_hash ON content_keys(hash)")
+        self._conn.commit()
+
+    def hash_many(self, paths: List[str]) -> List[Optional[Tuple[str, int]]]:
+        """(hash, size) for every path, None for unreadable files. Misses are hashed on a thread pool."""
+        norm = [os.path.normpath(os.path.abspath(p)) for p in paths]
+        known: Dict[str, Tuple[int, int, str]] = {}
+        unique = list(dict.fromkeys(norm))
+        for start in range(0, len(unique), 500):
+            chunk = unique[start:start + 500]
+            marks = ",".join("?" * len(chunk))
+            for path, size, mtime_ns, h in self._conn.execute(
+                f"SELECT path, size, mtime_ns, hash FROM content_keys WHERE path IN ({marks})", chunk
+            ):
+                known[path] = (int(size), int(mtime_ns), h)
+
+        out: List[Optional[Tuple[str, int]]] = [None] * len(paths)
+        todo: List[Tuple[int, str, int, int]] = []
+        for i, path in enumerate(norm):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            memo = known.get(path)
+            if memo is not None and memo[0] == st.st_size and memo[1] == st.st_mtime_ns:
+                out[i] = (memo[2], st.st_size)
+            else:
+                todo.append((i, path, st.st_size, st.st_mtime_ns))
+
+        if todo:
+            def work(item):
+                try:
+                    return partial_content_hash(item[1], item[2])
+                except OSError:
+                    return None
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=_HASH_THREADS) as pool:
+                hashes = list(pool.map(work, todo))
+            rows = []
+            for (i, path, size, mtime_ns), h in zip(todo, hashes):
+                if h is None:
+                    continue
+                out[i] = (h, size)
+                rows.append((path, size, mtime_ns, h))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO content_keys (path, size, mtime_ns, hash) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+        return out
+
+    def hash_for(self, path: str) -> Optional[Tuple[str, int]]:
+        return self.hash_many([path])[0]
+
+    def path_for_hash(self, content_hash: str) -> Optional[str]:
+        """Most recently recorded path with this content."""
+        row = self._conn.execute(
+            "SELECT path FROM content_keys WHERE hash = ? ORDER BY rowid DESC LIMIT 1", (content_hash,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+# One memo per database for the life of the process (kept warm by `cli.py serve`)
+_MEMOS: Dict[str, ContentKeyMemo] = {}
+
+
+def content_memo() -> ContentKeyMemo:
+    path = os.path.abspath(os.path.join(os.path.dirname(metrics_cache_path()), CONTENT_MEMO_FILENAME))
+    memo = _MEMOS.get(path)
+    if memo is None:
+        memo = _MEMOS[path] = ContentKeyMemo(path)
+    return memo
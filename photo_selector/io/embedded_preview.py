@@ -0,0 +1,193 @@
+import logging
+import struct
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from photo_selector.io.image_reader import decode_and_resize, parse_jpeg_size
+
+logger = logging.getLogger(__name__)
+
+# APP segments live at the start of the file; EXIF is capped at 64KB by the format
+_HEAD_BYTES = 128 * 1024
+
+# An embedded preview is used when its long edge is at least this fraction of the
+# requested thumbnail size (the usual 160px EXIF thumbnail qualifies for 256px).
+EMBEDDED_MIN_RATIO = 0.6
+
+
+def _iter_app_segments(head: bytes) -> Iterator[Tuple[int, int, int]]:
+    """Yields (marker, payload_offset, payload_length) for APPn segments before SOS."""
+    n = len(head)
+    if n < 4 or head[0] != 0xFF or head[1] != 0xD8:
+        return
+    pos = 2
+    while pos + 4 <= n:
+        if head[pos] != 0xFF:
+            return
+        marker = head[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        if marker in (0xDA, 0xD9):
+            return
+        seg_len = (head[pos + 2] << 8) | head[pos + 3]
+        if seg_len < 2:
+            return
+        if 0xE0 <= marker <= 0xEF:
+            yield marker, pos + 4, seg_len - 2
+        pos += 2 + seg_len
+
+
+class _Tiff:
+    """Minimal TIFF IFD reader over a byte slice (offsets are relative to `base`)."""
+
+    def __init__(self, data: bytes, base: int):
+        self.data = data
+        self.base = base
+        order = data[base:base + 2]
+        if order == b"II":
+            self.endian = "<"
+        elif order == b"MM":
+            self.endian = ">"
+        else:
+            raise ValueError("bad TIFF byte order")
+
+    def u16(self, off: int) -> int:
+        return struct.unpack_from(self.endian + "H", self.data, self.base + off)[0]
+
+    def u32(self, off: int) -> int:
+        return struct.unpack_from(self.endian + "I", self.data, self.base + off)[0]
+
+    def ifd(self, off: int) -> Tuple[dict, int]:
+        """Returns ({tag: (type, count, value_or_offset)}, next_ifd_offset)."""
+        count = self.u16(off)
+        entries = {}
+        for i in range(count):
+            e = off + 2 + i * 12
+            tag = self.u16(e)
+            typ = self.u16(e + 2)
+            cnt = self.u32(e + 4)
+            # SHORT values are left-aligned in the 4-byte field
+            val = self.u16(e + 8) if typ == 3 and cnt == 1 else self.u32(e + 8)
+            entries[tag] = (typ, cnt, val)
+        return entries, self.u32(off + 2 + count * 12)
+
+
+def _exif_thumbnail_span(head: bytes, off: int, length: int) -> Optional[Tuple[int, int]]:
+    if head[off:off + 6] != b"Exif\x00\x00":
+        return None
+    tiff = _Tiff(head, off + 6)
+    _ifd0, next_off = tiff.ifd(tiff.u32(4))
+    if not next_off:
+        return None
+    ifd1, _ = tiff.ifd(next_off)
+    if 0x0201 not in ifd1 or 0x0202 not in ifd1:
+        return None
+    thumb_off = ifd1[0x0201][2]
+    thumb_len = ifd1[0x0202][2]
+    if thumb_len <= 0 or thumb_off + thumb_len > length - 6:
+        return None
+    return off + 6 + thumb_off, thumb_len
+
+
+def _exif_orientation(head: bytes, off: int) -> Optional[int]:
+    """Orientation tag (0x0112) of IFD0, i.e. of the main image."""
+    if head[off:off + 6] != b"Exif\x00\x00":
+        return None
+    tiff = _Tiff(head, off + 6)
+    ifd0, _ = tiff.ifd(tiff.u32(4))
+    entry = ifd0.get(0x0112)
+    if entry is None or entry[0] != 3:
+        return None
+    return entry[2]
+
+
+def _mpf_preview_spans(head: bytes, off: int) -> List[Tuple[int, int]]:
+    """Secondary images (large previews) listed in the Multi-Picture Format index."""
+    if head[off:off + 4] != b"MPF\x00":
+        return []
+    tiff = _Tiff(head, off + 4)
+    index, _ = tiff.ifd(tiff.u32(4))
+    if 0xB002 not in index:
+        return []
+    _typ, size, entries_off = index[0xB002]
+    spans = []
+    for i in range(size // 16):
+        e = entries_off + i * 16
+        img_size = tiff.u32(e + 4)
+        img_off = tiff.u32(e + 8)
+        # Offset 0 is the primary image itself
+        if img_off and img_size:
+            spans.append((off + 4 + img_off, img_size))
+    return spans
+
+
+def _scan_previews(path: str) -> Tuple[List[bytes], int]:
+    """(JPEG bytes of every embedded preview, EXIF orientation of the main image)."""
+    out: List[bytes] = []
+    orientation = 1
+    try:
+        with open(path, "rb") as f:
+            head = f.read(_HEAD_BYTES)
+            spans: List[Tuple[int, int]] = []
+            for marker, off, length in _iter_app_segments(head):
+                try:
+                    if marker == 0xE1:
+                        orientation = _exif_orientation(head, off) or orientation
+                        span = _exif_thumbnail_span(head, off, length)
+                        if span:
+                            spans.append(span)
+                    elif marker == 0xE2:
+                        spans.extend(_mpf_preview_spans(head, off))
+                except (struct.error, ValueError):
+                    continue
+            for span_off, span_len in spans:
+                if span_off + span_len <= len(head):
+                    data = head[span_off:span_off + span_len]
+                else:
+                    f.seek(span_off)
+                    data = f.read(span_len)
+                if len(data) == span_len:
+                    out.append(data)
+    except OSError as e:
+        logger.debug(f"Cannot read embedded previews of {path}: {e}")
+    return out, orientation
+
+
+def find_embedded_previews(path: str) -> List[bytes]:
+    """
+    Returns the JPEG bytes of every embedded preview (EXIF IFD1 thumbnail and
+    MPF secondary images) without reading the main image data.
+    """
+    return _scan_previews(path)[0]
+
+
+def read_embedded_preview(path: str, target_long_edge: int) -> Optional[np.ndarray]:
+    """
+    Decodes the smallest embedded preview that is large enough for target_long_edge
+    (see EMBEDDED_MIN_RATIO), turned upright by the main image's EXIF orientation
+    like a full decode. Returns None when there is no usable preview.
+    """
+    min_long_edge = int(target_long_edge * EMBEDDED_MIN_RATIO)
+    best = None
+    best_edge = 0
+    previews, orientation = _scan_previews(path)
+    for data in previews:
+        size = parse_jpeg_size(data)
+        if size is None:
+            continue
+        edge = max(size)
+        if edge < min_long_edge:
+            continue
+        if best is None or edge < best_edge:
+            best = data
+            best_edge = edge
+    if best is None:
+        return None
+    return decode_and_resize(
+        np.frombuffer(best, dtype=np.uint8), target_long_edge, path=path, orientation=orientation
+    )
@@ -1,6 +1,8 @@
 import sqlite3
 import time
-from typing import Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
 
 
 class EmbeddingCacheSQLite:
@@ -57,3 +59,77 @@ class EmbeddingCacheSQLite:
         finally:
             conn.close()
 
+    def get_matrix(self, keys: List[str], dim: Optional[int] = None) -> Tuple[Optional[np.ndarray], np.ndarray]:
+        """Same contract as EmbeddingStore.get_matrix, using one connection for all keys."""
+        found_rows: Dict[str, Tuple[int, bytes]] = {}
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cur = conn.cursor()
+            unique = list(dict.fromkeys(keys))
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                marks = ",".join("?" * len(chunk))
+                cur.execute(f"SELECT key, dim, vec FROM embeddings WHERE key IN ({marks})", chunk)
+                for key, d, vec in cur.fetchall():
+                    found_rows[key] = (int(d), vec)
+        finally:
+            conn.close()
+
+        if dim is None:
+            dim = next((found_rows[k][0] for k in keys if k in found_rows), None)
+        found = np.array([k in found_rows and found_rows[k][0] == dim for k in keys], dtype=bool)
+        if dim is None or not found.any():
+            return None, found
+        out = np.zeros((len(keys), dim), dtype=np.float32)
+        for i in np.flatnonzero(found):
+            out[i] = np.frombuffer(found_rows[keys[i]][1], dtype=np.float32)
+        return out, found
+
+    def set_many(self, items: Iterable[Tuple[str, int, bytes]]) -> None:
+        rows = [(k, int(d), sqlite3.Binary(v), time.time()) for k, d, v in items]
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.executemany(
+                """
+                INSERT INTO embeddings (key, dim, vec, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    dim=excluded.dim,
+                    vec=excluded.vec,
+                    updated_at=excluded.updated_at
+                """,
+                rows,
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def flush(self) -> None:
+        """Writes are synchronous; present for parity with EmbeddingStore."""
+
+    def iter_prefix(self, prefix: str, with_vectors: bool = True) -> Iterator[Tuple[str, int, Optional[bytes]]]:
+        """
+        Yields (key, dim, vec) for every key starting with prefix, in key order.
+        Uses a range scan on the primary key; vec is None when with_vectors is False.
+        """
+        # Smallest string greater than every string with this prefix
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1) if prefix else None
+        cols = "key, dim, vec" if with_vectors else "key, dim, NULL"
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cur = conn.cursor()
+            if upper is None:
+                cur.execute(f"SELECT {cols} FROM embeddings ORDER BY key")
+            else:
+                cur.execute(
+                    f"SELECT {cols} FROM embeddings WHERE key >= ? AND key < ? ORDER BY key",
+                    (prefix, upper),
+                )
+            while True:
+                rows = cur.fetchmany(1024)
+                if not rows:
+                    break
+                for key, dim, vec in rows:
+                    yield key, int(dim), vec
+        finally:
+            conn.close()
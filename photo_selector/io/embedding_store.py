@@ -0,0 +1,283 @@
+import contextlib
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+
+from photo_selector.io.embedding_cache_sqlite import EmbeddingCacheSQLite
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_STORE_DIRNAME = "embedding_store"
+# Older releases kept one BLOB row per vector in this SQLite file
+LEGACY_SQLITE_FILENAME = "embedding_cache.db"
+
+_KEYS_FILENAME = "keys.tsv"
+# Held while appending, so processes sharing a store (serve, CLI runs, ANN builds) take turns
+_LOCK_FILENAME = "append.lock"
+# Pending vectors are written out once this many have been set
+_FLUSH_EVERY = 1024
+
+
+def _complete_lines_end(path: str, size: int) -> int:
+    """Offset just past the last newline among the first size bytes of path (0 if none)."""
+    with open(path, "rb") as f:
+        pos = size
+        while pos > 0:
+            step = min(pos, 4096)
+            f.seek(pos - step)
+            nl = f.read(step).rfind(b"\n")
+            if nl >= 0:
+                return pos - step + nl + 1
+            pos -= step
+    return 0
+
+
+class EmbeddingStore:
+    """
+    Append-only embedding cache: one raw float32 matrix file per vector
+    dimension (vectors_<dim>.f32) plus a key log (keys.tsv, one
+    "key<TAB>dim<TAB>row" line per vector, later lines win).
+
+    The key log is read once on open and the matrices are memory-mapped, so
+    lookups never touch a database. Vectors are appended in bulk; a folder
+    that was embedded in one run occupies a contiguous row range and
+    get_matrix returns it as a zero-copy slice of the mapping.
+
+    Several processes may open the same store (a shared CACHE_DIR). Appends
+    hold an exclusive lock on append.lock and take their row numbers from
+    the matrix file's size under that lock; opening never modifies the
+    files. Vectors are written before their key lines, so a crash can only
+    lose the tail of the last batch, and that torn tail is cut off by the
+    next append. Vectors appended by another process after this store was
+    opened are not seen until it is reopened.
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        self._index: Dict[str, Tuple[int, int]] = {}
+        self._rows: Dict[int, int] = {}
+        self._maps: Dict[int, Optional[np.memmap]] = {}
+        self._pending: Dict[str, Tuple[int, bytes]] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _matrix_path(self, dim: int) -> str:
+        return os.path.join(self.store_dir, f"vectors_{int(dim)}.f32")
+
+    def _load(self) -> None:
+        for name in os.listdir(self.store_dir):
+            if name.startswith("vectors_") and name.endswith(".f32"):
+                try:
+                    dim = int(name[len("vectors_"):-len(".f32")])
+                except ValueError:
+                    continue
+                # A partial last vector (an append in progress, or interrupted) is not a row yet
+                self._rows[dim] = os.path.getsize(os.path.join(self.store_dir, name)) // (4 * dim)
+
+        # Read after the matrix sizes: key lines for rows appended since are dropped below
+        keys_path = os.path.join(self.store_dir, _KEYS_FILENAME)
+        if not os.path.exists(keys_path):
+            return
+        with open(keys_path, "rb") as f:
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].decode("utf-8").split("\n")[:-1]:
+            parts = line.rsplit("\t", 2)
+            if len(parts) != 3:
+                continue
+            key, dim_s, row_s = parts
+            dim, row = int(dim_s), int(row_s)
+            if row < self._rows.get(dim, 0):
+                self._index[key] = (dim, row)
+
+    @contextlib.contextmanager
+    def _append_lock(self):
+        with open(os.path.join(self.store_dir, _LOCK_FILENAME), "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        time.sleep(0.01)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _map(self, dim: int) -> Optional[np.memmap]:
+        mm = self._maps.get(dim)
+        rows = self._rows.get(dim, 0)
+        if (mm is None or mm.shape[0] != rows) and rows > 0:
+            mm = np.memmap(self._matrix_path(dim), dtype=np.float32, mode="r", shape=(rows, dim))
+            self._maps[dim] = mm
+        return mm
+
+    def __len__(self) -> int:
+        return len(self._index) + sum(1 for k in self._pending if k not in self._index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._pending or key in self._index
+
+    def get(self, key: str) -> Optional[bytes]:
+        pending = self._pending.get(key)
+        if pending is not None:
+            return pending[1]
+        loc = self._index.get(key)
+        if loc is None:
+            return None
+        return self._map(loc[0])[loc[1]].tobytes()
+
+    def get_matrix(self, keys: List[str], dim: Optional[int] = None) -> Tuple[Optional[np.ndarray], np.ndarray]:
+        """
+        Vectors for keys as one (len(keys), dim) float32 matrix plus a found
+        mask. dim defaults to the dimension of the first cached key; keys
+        stored with another dimension count as missing. When every key is
+        found in one contiguous row range the matrix is a read-only view of
+        the mapped file; otherwise it is a fresh array with zero rows for
+        missing keys. Returns (None, mask) when nothing is found.
+        """
+        self.flush()
+        locs = [self._index.get(k) for k in keys]
+        if dim is None:
+            dim = next((loc[0] for loc in locs if loc is not None), None)
+        found = np.array([loc is not None and loc[0] == dim for loc in locs], dtype=bool)
+        if dim is None or not found.any():
+            return None, found
+
+        mm = self._map(dim)
+        rows = np.array([loc[1] if f else 0 for loc, f in zip(locs, found)], dtype=np.int64)
+        if found.all() and (rows.size == 1 or bool(np.all(np.diff(rows) == 1))):
+            return mm[rows[0]:rows[0] + rows.size], found
+        out = np.zeros((len(keys), dim), dtype=np.float32)
+        out[found] = mm[rows[found]]
+        return out, found
+
+    def set(self, key: str, dim: int, vec_bytes: bytes) -> None:
+        self.set_many([(key, dim, vec_bytes)])
+
+    def set_many(self, items: Iterable[Tuple[str, int, bytes]]) -> None:
+        for key, dim, vec_bytes in items:
+            if "\n" in key:
+                continue
+            self._pending[key] = (int(dim), bytes(vec_bytes))
+        if len(self._pending) >= _FLUSH_EVERY:
+            self.flush()
+
+    def flush(self) -> None:
+        """Appends pending vectors to the matrix files, then their key lines."""
+        with self._lock:
+            if not self._pending:
+                return
+            by_dim: Dict[int, List[Tuple[str, bytes]]] = {}
+            for key, (dim, vec_bytes) in self._pending.items():
+                if len(vec_bytes) == 4 * dim:
+                    by_dim.setdefault(dim, []).append((key, vec_bytes))
+
+            lines: List[str] = []
+            new_locs: Dict[str, Tuple[int, int]] = {}
+            with self._append_lock():
+                for dim, items in by_dim.items():
+                    with open(self._matrix_path(dim), "ab") as f:
+                        size = f.seek(0, os.SEEK_END)
+                        start = size // (4 * dim)
+                        if size % (4 * dim):
+                            # Partial vector from an interrupted append: keep later rows aligned
+                            f.truncate(start * 4 * dim)
+                        f.write(b"".join(v for _, v in items))
+                    for i, (key, _) in enumerate(items):
+                        new_locs[key] = (dim, start + i)
+                        lines.append(f"{key}\t{dim}\t{start + i}\n")
+                    # Rows other processes appended in between stay unmapped until reopening
+                    self._rows[dim] = start + len(items)
+
+                keys_path = os.path.join(self.store_dir, _KEYS_FILENAME)
+                with open(keys_path, "ab") as f:
+                    size = f.seek(0, os.SEEK_END)
+                    end = _complete_lines_end(keys_path, size)
+                    if end < size:
+                        # Torn write at the end: cut it off so the next line starts fresh
+                        f.truncate(end)
+                    f.write("".join(lines).encode("utf-8"))
+            self._index.update(new_locs)
+            self._pending.clear()
+
+    def close(self) -> None:
+        self.flush()
+        self._maps.clear()
+
+    def iter_prefix(self, prefix: str, with_vectors: bool = True) -> Iterator[Tuple[str, int, Optional[bytes]]]:
+        """Yields (key, dim, vec) for every key starting with prefix, in key order."""
+        self.flush()
+        for key in sorted(k for k in self._index if k.startswith(prefix)):
+            dim, row = self._index[key]
+            yield key, dim, (self._map(dim)[row].tobytes() if with_vectors else None)
+
+    def import_sqlite(self, db_path: str) -> int:
+        """Copies every vector from a legacy SQLite embedding cache."""
+        count = 0
+        for key, dim, vec in EmbeddingCacheSQLite(db_path).iter_prefix(""):
+            if key not in self:
+                self._pending[key] = (dim, bytes(vec))
+                count += 1
+                if len(self._pending) >= _FLUSH_EVERY:
+                    self.flush()
+        self.flush()
+        return count
+
+
+def open_embedding_store(store_dir: str, legacy_sqlite_path: Optional[str] = None) -> EmbeddingStore:
+    """
+    Opens (or creates) a store. A new, empty store first imports the
+    vectors of legacy_sqlite_path if that file exists.
+    """
+    store = EmbeddingStore(store_dir)
+    if legacy_sqlite_path and len(store) == 0 and os.path.exists(legacy_sqlite_path):
+        count = store.import_sqlite(legacy_sqlite_path)
+        logger.info(f"Imported {count} embeddings from {legacy_sqlite_path}")
+    return store
+
+
+def open_embedding_cache(path: str):
+    """An existing embedding cache: a store directory or a legacy SQLite file."""
+    if os.path.isdir(path):
+        return EmbeddingStore(path)
+    if os.path.isfile(path):
+        return EmbeddingCacheSQLite(path)
+    raise FileNotFoundError(f"Embedding cache not found: {path}")
+
+
+def embedding_cache_stamp(path: str) -> List[int]:
+    """
+    [size, mtime_ns] of the file every write to this cache changes (keys.tsv
+    of a store, the database plus its WAL for a legacy SQLite file); [0, 0]
+    when it does not exist.
+    """
+    files = [os.path.join(path, _KEYS_FILENAME)] if os.path.isdir(path) else [path, path + "-wal"]
+    size = mtime_ns = 0
+    for name in files:
+        try:
+            st = os.stat(name)
+        except OSError:
+            continue
+        size += st.st_size
+        mtime_ns = max(mtime_ns, st.st_mtime_ns)
+    return [size, mtime_ns]
@@ -1,58 +1,229 @@
-
 import cv2
 import numpy as np
 import logging
 import os
+from typing import Dict, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
-def read_and_resize(path: str, target_long_edge: int = 1024) -> np.ndarray:
+# DCT scale factors libjpeg can decode directly, largest first
+_REDUCED_COLOR_FLAGS = [
+    (factor, getattr(cv2, f"IMREAD_REDUCED_COLOR_{factor}"))
+    for factor in (8, 4, 2)
+    if hasattr(cv2, f"IMREAD_REDUCED_COLOR_{factor}")
+]
+# Luma-only variants: libjpeg decodes just the Y plane (no chroma upsampling / color conversion)
+_REDUCED_GRAY_FLAGS = [
+    (factor, getattr(cv2, f"IMREAD_REDUCED_GRAYSCALE_{factor}"))
+    for factor in (8, 4, 2)
+    if hasattr(cv2, f"IMREAD_REDUCED_GRAYSCALE_{factor}")
+]
+
+# SOF0..SOF15 except DHT (C4), JPG (C8) and DAC (CC)
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def parse_jpeg_size(buf) -> Optional[Tuple[int, int]]:
     """
-    Reads an image with optimized downsampling.
-    Prioritizes OpenCV's IMREAD_REDUCED_COLOR_* flags.
+    Returns (width, height) from the JPEG SOF header without decoding,
+    or None if buf is not a JPEG or the header could not be found.
+    """
+    if buf is None:
+        return None
+    data = memoryview(buf).cast("B") if not isinstance(buf, (bytes, bytearray)) else memoryview(buf)
+    n = len(data)
+    if n < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+
+    pos = 2
+    while pos + 4 <= n:
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # Fill bytes between segments
+            pos += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            # Standalone markers without a length field
+            pos += 2
+            continue
+        if marker == 0xDA or marker == 0xD9:
+            # Start of scan / end of image before any SOF
+            return None
+        seg_len = (data[pos + 2] << 8) | data[pos + 3]
+        if seg_len < 2:
+            return None
+        if marker in _SOF_MARKERS:
+            if pos + 9 > n:
+                return None
+            height = (data[pos + 5] << 8) | data[pos + 6]
+            width = (data[pos + 7] << 8) | data[pos + 8]
+            if width <= 0 or height <= 0:
+                return None
+            return int(width), int(height)
+        pos += 2 + seg_len
+    return None
+
+def choose_reduced_factor(src_long_edge: int, target_long_edge: int) -> int:
+    """
+    Picks the largest DCT scale (8, 4, 2) whose decoded long edge still covers
+    target_long_edge, so the remaining cv2.resize only ever shrinks. 1 = full decode.
+    """
+    for factor, _flag in _REDUCED_COLOR_FLAGS:
+        # libjpeg rounds scaled dimensions up
+        if -(-int(src_long_edge) // factor) >= int(target_long_edge):
+            return factor
+    return 1
+
+def tally_decode_factor(counts: Dict[int, int], stats: dict) -> None:
+    """
+    Adds the reduction factor a decode_and_resize call reported in stats to
+    counts (1 = full decode, 0 = header not parsed). Workers return their
+    counts with their results so a run can report them across processes.
+    """
+    if "factor" in stats:
+        factor = int(stats["factor"]) if stats.get("source_size") is not None else 0
+        counts[factor] = counts.get(factor, 0) + 1
+
+def read_image_bytes(path: str) -> Optional[np.ndarray]:
+    """
+    Reads the raw file bytes once so that several consumers (pixel decode,
+    EXIF parsing) can share them without touching the disk again.
     """
     if not os.path.exists(path):
         logger.error(f"File not found: {path}")
         return None
-
-    # Strategy: 
-    # For typical camera JPGs (20MP+), reduction /4 is safe and efficient.
-    # We can try to guess based on file size, but simply using /4 is a good heuristic for "large folders".
-    # However, if the user specifically wants 1024, /4 on a 24MP (6000px) img -> 1500px.
-    # /8 -> 750px.
-    # We will try /4 first.
-    
-    flags = cv2.IMREAD_COLOR
-    
-    # Check if OpenCV supports reduced reading (modern versions do)
-    # 1/4 size
-    if hasattr(cv2, 'IMREAD_REDUCED_COLOR_4'):
-        flags = cv2.IMREAD_REDUCED_COLOR_4
-    elif hasattr(cv2, 'IMREAD_REDUCED_COLOR_2'):
-        flags = cv2.IMREAD_REDUCED_COLOR_2
-        
     try:
-        img = cv2.imread(path, flags)
+        # np.fromfile also handles non-ASCII paths on Windows, unlike cv2.imread
+        return np.fromfile(path, dtype=np.uint8)
     except Exception as e:
         logger.error(f"Error reading {path}: {e}")
         return None
-        
-    if img is None:
-        # Fallback to normal read if reduced failed (though it shouldn't return None unless file bad)
-        # Or maybe the flag was invalid for this file type?
-        img = cv2.imread(path, cv2.IMREAD_COLOR)
-        
-    if img is None:
-        return None
-        
-    # Now check dimensions and resize if necessary
+
+def resize_long_edge(img: np.ndarray, target_long_edge: int) -> np.ndarray:
+    """Downscales img so that its long edge is at most target_long_edge."""
     h, w = img.shape[:2]
     long_edge = max(h, w)
-    
+
     if long_edge > target_long_edge:
         scale = target_long_edge / long_edge
         new_w = int(w * scale)
         new_h = int(h * scale)
         img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
-        
+
     return img
+
+def to_gray(img: np.ndarray) -> np.ndarray:
+    """Returns the luminance plane, converting BGR only when needed."""
+    if img is None or len(img.shape) == 2:
+        return img
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+def _legacy_reduced_flags(grayscale: bool = False):
+    # Header could not be parsed (not a JPEG?): keep the old fixed /4 heuristic.
+    # For typical camera JPGs (20MP+), reduction /4 is safe and efficient.
+    kind = "GRAYSCALE" if grayscale else "COLOR"
+    for factor in (4, 2):
+        flag = getattr(cv2, f"IMREAD_REDUCED_{kind}_{factor}", None)
+        if flag is not None:
+            return factor, flag
+    return 1, _full_flags(grayscale)
+
+def _full_flags(grayscale: bool) -> int:
+    return cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+
+def apply_exif_orientation(img: np.ndarray, orientation: int) -> np.ndarray:
+    """Turns an image stored with EXIF Orientation 1-8 upright (other values: unchanged)."""
+    if orientation == 2:
+        return cv2.flip(img, 1)
+    if orientation == 3:
+        return cv2.rotate(img, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(img, 0)
+    if orientation == 5:
+        return cv2.transpose(img)
+    if orientation == 6:
+        return cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.rotate(cv2.transpose(img), cv2.ROTATE_180)
+    if orientation == 8:
+        return cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return img
+
+def decode_and_resize(
+    buf: np.ndarray,
+    target_long_edge: int = 1024,
+    path: str = "",
+    stats: Optional[dict] = None,
+    grayscale: bool = False,
+    orientation: Optional[int] = None,
+) -> np.ndarray:
+    """
+    Decodes an in-memory image with optimized downsampling.
+    The JPEG SOF header is read first so that the largest IMREAD_REDUCED_COLOR_*
+    factor that still covers target_long_edge can be used.
+    With grayscale=True the IMREAD_REDUCED_GRAYSCALE_* variants are used and a
+    single-channel luma image is returned.
+    If `stats` is given it receives the source size and the chosen factor.
+    With `orientation` the EXIF orientation inside buf is ignored and this one
+    is applied instead (embedded previews are stored like the main image but
+    do not carry its orientation tag).
+    """
+    if buf is None or buf.size == 0:
+        return None
+    ignore = cv2.IMREAD_IGNORE_ORIENTATION if orientation is not None else 0
+
+    # Strategy:
+    # 6000px source, target 1024 -> /4 (1500px), /8 would undershoot (750px).
+    # 6000px source, target 256  -> /8 (750px).
+    # 1800px source, target 1024 -> full decode.
+    size = parse_jpeg_size(buf)
+    if size is not None:
+        factor = choose_reduced_factor(max(size), target_long_edge)
+        reduced = _REDUCED_GRAY_FLAGS if grayscale else _REDUCED_COLOR_FLAGS
+        flags = dict(reduced).get(factor)
+        if flags is None:
+            factor, flags = 1, _full_flags(grayscale)
+    else:
+        factor, flags = _legacy_reduced_flags(grayscale)
+
+    if stats is not None:
+        stats["source_size"] = size
+        stats["factor"] = factor
+
+    try:
+        img = cv2.imdecode(buf, flags | ignore)
+    except Exception as e:
+        logger.error(f"Error decoding {path}: {e}")
+        return None
+
+    if img is None and flags != _full_flags(grayscale):
+        # Fallback to normal read if reduced failed (though it shouldn't return None unless file bad)
+        # Or maybe the flag was invalid for this file type?
+        img = cv2.imdecode(buf, _full_flags(grayscale) | ignore)
+        if stats is not None:
+            stats["factor"] = 1
+
+    if img is None:
+        return None
+    if orientation is not None:
+        img = apply_exif_orientation(img, orientation)
+
+    # Now check dimensions and resize if necessary
+    return resize_long_edge(img, target_long_edge)
+
+def read_and_resize(
+    path: str,
+    target_long_edge: int = 1024,
+    stats: Optional[dict] = None,
+    grayscale: bool = False,
+) -> np.ndarray:
+    """
+    Reads an image with optimized downsampling.
+    Prioritizes OpenCV's IMREAD_REDUCED_COLOR_* flags (see decode_and_resize).
+    """
+    buf = read_image_bytes(path)
+    if buf is None:
+        return None
+    return decode_and_resize(buf, target_long_edge, path=path, stats=stats, grayscale=grayscale)
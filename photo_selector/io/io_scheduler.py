@@ -0,0 +1,143 @@
+import concurrent.futures
+import math
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+def _timed(fn: Callable, task) -> Tuple[object, float]:
+    t0 = time.perf_counter()
+    result = fn(task)
+    return result, time.perf_counter() - t0
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(math.ceil(q / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[idx]
+
+
+class AdaptiveIoScheduler:
+    """
+    Runs small per-file I/O tasks (stat / read / patch / write of a sidecar)
+    with a number of tasks in flight that follows their measured latency.
+
+    Every window of completions the median latency is compared with the
+    baseline: the best window median so far, re-measured whenever the limit
+    is at its minimum (so a slower link after a fast start is taken as
+    the new normal once backing off did not help). Near the baseline, more
+    tasks in flight are only buying throughput (a NAS answering each request
+    in 5-20 ms) and the limit grows by about sqrt(limit). Past twice the
+    baseline, requests are queueing behind each other (a local disk, or the
+    GIL, is saturated) and the limit shrinks in proportion; in between it
+    holds. The limit stays within [min_concurrency, max_concurrency];
+    adaptive=False keeps it at initial.
+    """
+
+    # baseline / window median above which the limit grows, and below which it shrinks
+    GROW_RATIO = 0.75
+    SHRINK_RATIO = 0.5
+
+    def __init__(
+        self,
+        min_concurrency: int = 2,
+        max_concurrency: int = 32,
+        initial: Optional[int] = None,
+        adaptive: bool = True,
+        processes: bool = False,
+    ):
+        self.min_concurrency = max(1, int(min_concurrency))
+        self.max_concurrency = max(self.min_concurrency, int(max_concurrency))
+        start = initial if initial and initial > 0 else min(4, self.max_concurrency)
+        self.limit = float(min(self.max_concurrency, max(self.min_concurrency, start)))
+        self.initial = int(self.limit)
+        self.adaptive = bool(adaptive)
+        self.processes = bool(processes)
+        self._window: List[float] = []
+        self._baseline: Optional[float] = None
+        self._latencies: List[float] = []
+        self._limit_min = self._limit_max = int(self.limit)
+        self._busy_time = 0.0
+        self._elapsed = 0.0
+        self._peak_in_flight = 0
+
+    def _observe(self, latency: float) -> None:
+        self._latencies.append(latency)
+        if not self.adaptive:
+            return
+        self._window.append(latency)
+        if len(self._window) < max(8, int(self.limit)):
+            return
+        self._window.sort()
+        short = self._window[len(self._window) // 2]
+        self._window = []
+        if self._baseline is None or short < self._baseline or self.limit <= self.min_concurrency:
+            self._baseline = short
+        ratio = self._baseline / max(short, 1e-9)
+        if ratio >= self.GROW_RATIO:
+            limit = self.limit + math.sqrt(self.limit)
+        elif ratio < self.SHRINK_RATIO:
+            limit = self.limit * max(0.5, ratio / self.SHRINK_RATIO)
+        else:
+            limit = self.limit
+        self.limit = min(float(self.max_concurrency), max(float(self.min_concurrency), limit))
+        self._limit_min = min(self._limit_min, int(self.limit))
+        self._limit_max = max(self._limit_max, int(self.limit))
+
+    def map(self, fn: Callable, tasks: Iterable) -> Iterator[Tuple[object, object]]:
+        """Yields (task, fn(task)) in completion order; fn must be picklable with processes=True."""
+        pool_size = self.max_concurrency if self.adaptive else self.initial
+        pool_cls = concurrent.futures.ProcessPoolExecutor if self.processes else concurrent.futures.ThreadPoolExecutor
+        it = iter(tasks)
+        exhausted = False
+        pending: Dict[concurrent.futures.Future, object] = {}
+        t_start = last = time.perf_counter()
+        with pool_cls(max_workers=pool_size) as executor:
+            while True:
+                while not exhausted and len(pending) < int(self.limit):
+                    try:
+                        task = next(it)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending[executor.submit(_timed, fn, task)] = task
+                if not pending:
+                    break
+                self._peak_in_flight = max(self._peak_in_flight, len(pending))
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                now = time.perf_counter()
+                self._busy_time += len(pending) * (now - last)
+                last = now
+                for fut in done:
+                    task = pending.pop(fut)
+                    result, latency = fut.result()
+                    self._observe(latency)
+                    yield task, result
+        self._elapsed = time.perf_counter() - t_start
+
+    def stats(self) -> Dict:
+        """Throughput, concurrency and latency percentiles of the last map()."""
+        done = len(self._latencies)
+        latencies = sorted(self._latencies)
+        elapsed = self._elapsed
+        return {
+            "files": done,
+            "elapsed_s": round(elapsed, 3),
+            "throughput_per_s": round(done / elapsed, 1) if elapsed > 0 else 0.0,
+            "concurrency": {
+                "adaptive": self.adaptive,
+                "processes": self.processes,
+                "initial": self.initial,
+                "final": int(self.limit),
+                "min": self._limit_min,
+                "max": self._limit_max,
+                "peak_in_flight": self._peak_in_flight,
+                "mean_in_flight": round(self._busy_time / elapsed, 2) if elapsed > 0 else 0.0,
+            },
+            "latency_ms": {
+                "p50": round(_percentile(latencies, 50) * 1e3, 3),
+                "p90": round(_percentile(latencies, 90) * 1e3, 3),
+                "p99": round(_percentile(latencies, 99) * 1e3, 3),
+                "max": round((latencies[-1] if latencies else 0.0) * 1e3, 3),
+            },
+        }
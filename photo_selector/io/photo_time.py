@@ -1,3 +1,4 @@
+import io
 import os
 import time
 from datetime import datetime
@@ -15,6 +16,42 @@ def _parse_exif_datetime(value: str) -> Optional[float]:
     return time.mktime(dt.timetuple())
 
 
+def _normalize_source(source: str) -> str:
+    src = (source or "auto").strip().lower()
+    if src not in ("auto", "exif", "mtime"):
+        src = "auto"
+    return src
+
+
+def _exif_timestamp(fp) -> Optional[float]:
+    """Reads the EXIF capture time from a path or file object (header only, no pixel decode)."""
+    try:
+        from PIL import Image, ExifTags
+
+        img = Image.open(fp)
+        exif = getattr(img, "_getexif", lambda: None)()
+        img.close()
+        if exif:
+            by_name = {}
+            for k, v in exif.items():
+                name = ExifTags.TAGS.get(k, k)
+                by_name[name] = v
+            for key in ("DateTimeOriginal", "DateTimeDigitized", "DateTime"):
+                ts = _parse_exif_datetime(by_name.get(key))
+                if ts is not None:
+                    return float(ts)
+    except Exception:
+        pass
+    return None
+
+
+def _mtime_timestamp(path: str) -> float:
+    try:
+        return float(os.stat(path).st_mtime)
+    except Exception:
+        return 0.0
+
+
 def get_capture_timestamp(path: str, source: str = "auto") -> float:
     """
     Returns capture timestamp (epoch seconds).
@@ -23,31 +60,26 @@ def get_capture_timestamp(path: str, source: str = "auto") -> float:
       - exif: EXIF only, fallback to mtime if unavailable
       - mtime: file modified time only
     """
-    src = (source or "auto").strip().lower()
-    if src not in ("auto", "exif", "mtime"):
-        src = "auto"
+    src = _normalize_source(source)
 
     if src in ("auto", "exif"):
-        try:
-            from PIL import Image, ExifTags
-
-            img = Image.open(path)
-            exif = getattr(img, "_getexif", lambda: None)()
-            img.close()
-            if exif:
-                by_name = {}
-                for k, v in exif.items():
-                    name = ExifTags.TAGS.get(k, k)
-                    by_name[name] = v
-                for key in ("DateTimeOriginal", "DateTimeDigitized", "DateTime"):
-                    ts = _parse_exif_datetime(by_name.get(key))
-                    if ts is not None:
-                        return float(ts)
-        except Exception:
-            pass
+        ts = _exif_timestamp(path)
+        if ts is not None:
+            return ts
 
-    try:
-        return float(os.stat(path).st_mtime)
-    except Exception:
-        return 0.0
+    return _mtime_timestamp(path)
+
+
+def get_capture_timestamp_from_bytes(data, path: str, source: str = "auto") -> float:
+    """
+    Same as get_capture_timestamp, but parses EXIF from file bytes that were
+    already read for decoding. `path` is only used for the mtime fallback.
+    """
+    src = _normalize_source(source)
+
+    if src in ("auto", "exif") and data is not None:
+        ts = _exif_timestamp(io.BytesIO(memoryview(data)))
+        if ts is not None:
+            return ts
 
+    return _mtime_timestamp(path)
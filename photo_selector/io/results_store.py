@@ -0,0 +1,419 @@
+import logging
+import os
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from photo_selector.pipeline.models import ExposureResult, MetricsResult, SharpnessResult
+
+logger = logging.getLogger(__name__)
+
+RESULTS_DB_FILENAME = "results.db"
+
+# Bumped when the results table changes shape; older stores are rebuilt from scratch
+_SCHEMA_VERSION = 1
+
+_COLUMNS = (
+    "filename",
+    "technical_score",
+    "is_unusable",
+    "reasons",
+    "capture_ts",
+    "group_id",
+    "group_size",
+    "rank_in_group",
+    "is_group_best",
+    "sharpness_score",
+    "is_blurry",
+    "exposure_score",
+    "exp_p1",
+    "exp_p5",
+    "exp_p50",
+    "exp_p95",
+    "exp_p99",
+    "white_ratio",
+    "black_ratio",
+    "dynamic_range",
+    "exposure_flags",
+)
+
+# name -> indexed columns of the results table
+_INDEXES = (
+    ("results_score", "technical_score"),
+    ("results_group", "group_id, rank_in_group"),
+    ("results_best", "is_group_best, technical_score"),
+    ("results_time", "capture_ts"),
+)
+
+_GROUP_COLUMNS = ("capture_ts", "group_id", "group_size", "rank_in_group", "is_group_best")
+
+# Columns query() may sort by; filename breaks ties so pages are stable
+SORT_COLUMNS = (
+    "filename",
+    "technical_score",
+    "capture_ts",
+    "group_id",
+    "group_size",
+    "rank_in_group",
+    "sharpness_score",
+    "exposure_score",
+)
+
+
+def _to_row(r: MetricsResult) -> tuple:
+    s, e = r.sharpness, r.exposure
+    return (
+        r.filename,
+        float(r.technical_score),
+        int(bool(r.is_unusable)),
+        ";".join(r.reasons),
+        float(r.capture_ts or 0.0),
+        int(r.group_id),
+        int(r.group_size),
+        int(r.rank_in_group),
+        int(bool(r.is_group_best)),
+        float(s.score) if s else None,
+        int(bool(s.is_blurry)) if s else None,
+        float(e.score) if e else None,
+        int(e.p1) if e else None,
+        int(e.p5) if e else None,
+        int(e.p50) if e else None,
+        int(e.p95) if e else None,
+        int(e.p99) if e else None,
+        float(e.white_ratio) if e else None,
+        float(e.black_ratio) if e else None,
+        int(e.dynamic_range) if e else None,
+        ";".join(e.flags) if e else None,
+    )
+
+
+def _from_row(row: tuple) -> MetricsResult:
+    r = MetricsResult(
+        filename=row[0],
+        technical_score=row[1],
+        is_unusable=bool(row[2]),
+        reasons=row[3].split(";") if row[3] else [],
+        capture_ts=row[4],
+        group_id=row[5],
+        group_size=row[6],
+        rank_in_group=row[7],
+        is_group_best=bool(row[8]),
+    )
+    if row[9] is not None:
+        r.sharpness = SharpnessResult(score=row[9], is_blurry=bool(row[10]))
+    if row[11] is not None:
+        r.exposure = ExposureResult(
+            score=row[11],
+            p1=row[12],
+            p5=row[13],
+            p50=row[14],
+            p95=row[15],
+            p99=row[16],
+            white_ratio=row[17],
+            black_ratio=row[18],
+            dynamic_range=row[19],
+            flags=row[20].split(";") if row[20] else [],
+        )
+    return r
+
+
+class ResultsStore:
+    """
+    Results of an output directory (results.db next to groups.json): one row
+    per photo with the fields of MetricsResult.to_dict(), indexed on score,
+    group and capture time, plus a groups table (size, best photo, time
+    span) derived from it. compute upserts the rows, group updates the
+    grouping columns in place (both only touch rows and groups that
+    changed), and query() pages through a filtered, sorted view without
+    loading the rest. A sources table remembers which results.json /
+    results.csv the rows match, so a rewrite by main.py is noticed.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path)
+        try:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        except sqlite3.DatabaseError as e:
+            logger.warning(f"WAL not available for {db_path}: {e}")
+        self._init_db()
+        self._track_groups()
+
+    def _init_db(self) -> None:
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        with self._conn:
+            if version != _SCHEMA_VERSION:
+                self._conn.execute("DROP TABLE IF EXISTS results")
+                self._conn.execute("DROP TABLE IF EXISTS groups")
+                self._conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    filename TEXT PRIMARY KEY,
+                    technical_score REAL NOT NULL,
+                    is_unusable INTEGER NOT NULL,
+                    reasons TEXT NOT NULL,
+                    capture_ts REAL NOT NULL,
+                    group_id INTEGER NOT NULL,
+                    group_size INTEGER NOT NULL,
+                    rank_in_group INTEGER NOT NULL,
+                    is_group_best INTEGER NOT NULL,
+                    sharpness_score REAL,
+                    is_blurry INTEGER,
+                    exposure_score REAL,
+                    exp_p1 INTEGER,
+                    exp_p5 INTEGER,
+                    exp_p50 INTEGER,
+                    exp_p95 INTEGER,
+                    exp_p99 INTEGER,
+                    white_ratio REAL,
+                    black_ratio REAL,
+                    dynamic_range INTEGER,
+                    exposure_flags TEXT
+                )
+            """)
+            self._create_indexes()
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS groups (
+                    group_id INTEGER PRIMARY KEY,
+                    group_size INTEGER NOT NULL,
+                    best_filename TEXT,
+                    best_score REAL,
+                    start_ts REAL NOT NULL,
+                    end_ts REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS groups_size ON groups (group_size)")
+            # results.json / results.csv as of the last time the store matched them
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS sources (
+                    name TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL
+                )
+            """)
+
+    def _create_indexes(self) -> None:
+        for name, columns in _INDEXES:
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON results ({columns})")
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def _track_groups(self) -> None:
+        # Per-connection (TEMP) triggers note every group a written row left or joined,
+        # so only those rows of the groups table are recomputed
+        # No key on dirty_groups: an upsert's conflict handling would override INSERT OR IGNORE in the trigger
+        self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS dirty_groups (group_id INTEGER)")
+        self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS run_files (filename TEXT PRIMARY KEY)")
+        for event, groups in (
+            ("INSERT", "(NEW.group_id)"),
+            ("UPDATE", "(OLD.group_id), (NEW.group_id)"),
+            ("DELETE", "(OLD.group_id)"),
+        ):
+            self._conn.execute(f"""
+                CREATE TEMP TRIGGER IF NOT EXISTS results_{event.lower()}_groups
+                AFTER {event} ON main.results
+                BEGIN INSERT INTO dirty_groups VALUES {groups}; END
+            """)
+
+    def _refresh_groups(self) -> None:
+        # INDEXED BY: left to itself the planner walks results_best (every best photo) once per group
+        dirty = "group_id IN (SELECT group_id FROM temp.dirty_groups)"
+        self._conn.execute(f"DELETE FROM groups WHERE {dirty}")
+        self._conn.execute(f"""
+            INSERT INTO groups (group_id, group_size, start_ts, end_ts)
+            SELECT group_id, COUNT(*), MIN(capture_ts), MAX(capture_ts)
+            FROM results WHERE group_id >= 0 AND {dirty} GROUP BY group_id
+        """)
+        self._conn.execute(f"""
+            UPDATE groups SET (best_filename, best_score) = (
+                SELECT filename, technical_score FROM results INDEXED BY results_group
+                WHERE results.group_id = groups.group_id AND is_group_best = 1
+                ORDER BY technical_score DESC, filename LIMIT 1
+            ) WHERE {dirty}
+        """)
+        self._conn.execute("DELETE FROM temp.dirty_groups")
+
+    def replace_all(self, results: Iterable[MetricsResult]) -> int:
+        """
+        Makes the table hold exactly these rows (a compute run), in one
+        transaction: new and changed rows are upserted, rows of photos not
+        in the run are deleted, and rows whose values did not change are
+        left untouched, as are the groups they belong to. Into an empty
+        table the secondary indexes are built once after the load instead of
+        row by row. Returns the number of rows inserted, updated or deleted.
+        """
+        placeholders = ",".join("?" * len(_COLUMNS))
+        assignments = ", ".join(f"{c} = excluded.{c}" for c in _COLUMNS[1:])
+        changed = " OR ".join(f"{c} IS NOT excluded.{c}" for c in _COLUMNS[1:])
+        filenames = []
+
+        def rows():
+            for r in results:
+                filenames.append((r.filename,))
+                yield _to_row(r)
+
+        with self._conn:
+            bulk = self._conn.execute("SELECT 1 FROM results LIMIT 1").fetchone() is None
+            if bulk:
+                for name, _ in _INDEXES:
+                    self._conn.execute(f"DROP INDEX IF EXISTS {name}")
+            # rowcount, not total_changes: that would also count the trigger writes
+            written = self._conn.executemany(
+                f"INSERT INTO results ({','.join(_COLUMNS)}) VALUES ({placeholders}) "
+                f"ON CONFLICT (filename) DO UPDATE SET {assignments} WHERE {changed}",
+                rows(),
+            ).rowcount
+            if bulk:
+                self._create_indexes()
+            else:
+                self._conn.execute("DELETE FROM temp.run_files")
+                self._conn.executemany("INSERT OR IGNORE INTO temp.run_files VALUES (?)", filenames)
+                written += self._conn.execute(
+                    "DELETE FROM results WHERE filename NOT IN (SELECT filename FROM temp.run_files)"
+                ).rowcount
+                self._conn.execute("DELETE FROM temp.run_files")
+            self._refresh_groups()
+        return written
+
+    def update_groups(self, results: Iterable[MetricsResult]) -> int:
+        """
+        Writes the grouping columns (and capture_ts) of these photos; rows
+        whose values did not change are left untouched. Returns the number
+        of rows updated.
+        """
+        rows = []
+        for r in results:
+            values = _to_row(r)
+            group_values = (values[4], values[5], values[6], values[7], values[8])
+            rows.append(group_values + (values[0],) + group_values)
+        assignments = ", ".join(f"{c} = ?" for c in _GROUP_COLUMNS)
+        changed = " OR ".join(f"{c} IS NOT ?" for c in _GROUP_COLUMNS)
+        with self._conn:
+            updated = self._conn.executemany(
+                f"UPDATE results SET {assignments} WHERE filename = ? AND ({changed})",
+                rows,
+            ).rowcount
+            self._refresh_groups()
+        return updated
+
+    def mark_sources(self, paths: Iterable[str]) -> None:
+        """
+        Records the size and mtime of these files (the results.json /
+        results.csv exports next to the store) as matching the store, so
+        changed_sources() only reports them once they are rewritten. Missing
+        files are skipped. Call it after every write or import, whether or
+        not a row changed.
+        """
+        stamps = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            stamps.append((os.path.basename(path), st.st_size, st.st_mtime_ns))
+        with self._conn:
+            self._conn.execute("DELETE FROM sources")
+            self._conn.executemany("INSERT INTO sources (name, size, mtime_ns) VALUES (?, ?, ?)", stamps)
+
+    def changed_sources(self, paths: Iterable[str]) -> List[str]:
+        """
+        Those of these files that exist and differ from what mark_sources()
+        recorded, newest first. A store without any record (written before
+        the sources table) compares their mtime with its own instead.
+        """
+        paths = [p for p in paths if os.path.exists(p)]
+        recorded = {
+            name: (size, mtime_ns)
+            for name, size, mtime_ns in self._conn.execute("SELECT name, size, mtime_ns FROM sources")
+        }
+        if recorded:
+            changed = []
+            for path in paths:
+                st = os.stat(path)
+                if recorded.get(os.path.basename(path)) != (st.st_size, st.st_mtime_ns):
+                    changed.append(path)
+        else:
+            # Writes land in the -wal file until it is checkpointed
+            db_mtime = max(os.path.getmtime(p) for p in (self.db_path, self.db_path + "-wal") if os.path.exists(p))
+            changed = [p for p in paths if os.path.getmtime(p) > db_mtime]
+        return sorted(changed, key=os.path.getmtime, reverse=True)
+
+    def load(self) -> List[MetricsResult]:
+        rows = self._conn.execute(f"SELECT {','.join(_COLUMNS)} FROM results ORDER BY filename")
+        return [_from_row(row) for row in rows]
+
+    def query(
+        self,
+        min_score: Optional[float] = None,
+        max_score: Optional[float] = None,
+        group_id: Optional[int] = None,
+        group_best: Optional[bool] = None,
+        grouped: Optional[bool] = None,
+        unusable: Optional[bool] = None,
+        blurry: Optional[bool] = None,
+        name: Optional[str] = None,
+        sort: str = "filename",
+        descending: bool = False,
+        offset: int = 0,
+        limit: int = 100,
+    ) -> Tuple[int, List[Dict]]:
+        """
+        (number of matching rows, one page of them as to_dict() rows).
+        Filters left at None are not applied; name matches a substring of
+        the filename. limit <= 0 returns every row from offset on.
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Cannot sort by {sort!r}; expected one of {', '.join(SORT_COLUMNS)}")
+        where: List[str] = []
+        params: List[object] = []
+        if min_score is not None:
+            where.append("technical_score >= ?")
+            params.append(float(min_score))
+        if max_score is not None:
+            where.append("technical_score <= ?")
+            params.append(float(max_score))
+        if group_id is not None:
+            where.append("group_id = ?")
+            params.append(int(group_id))
+        if group_best is not None:
+            where.append("is_group_best = ?")
+            params.append(int(group_best))
+        if grouped is not None:
+            where.append("group_id >= 0" if grouped else "group_id < 0")
+        if unusable is not None:
+            where.append("is_unusable = ?")
+            params.append(int(unusable))
+        if blurry is not None:
+            where.append("is_blurry = ?")
+            params.append(int(blurry))
+        if name:
+            where.append("instr(filename, ?) > 0")
+            params.append(name)
+        clause = f" WHERE {' AND '.join(where)}" if where else ""
+
+        total = self._conn.execute(f"SELECT COUNT(*) FROM results{clause}", params).fetchone()[0]
+        order = "DESC" if descending else "ASC"
+        tie = ", filename" if sort != "filename" else ""
+        rows = self._conn.execute(
+            f"SELECT {','.join(_COLUMNS)} FROM results{clause} "
+            f"ORDER BY {sort} {order}{tie} LIMIT ? OFFSET ?",
+            params + [int(limit) if limit > 0 else -1, max(0, int(offset))],
+        )
+        return total, [_from_row(row).to_dict() for row in rows]
+
+    def groups(self, offset: int = 0, limit: int = 100) -> Tuple[int, List[Dict]]:
+        """(number of groups, one page of them, largest first)."""
+        total = self._conn.execute("SELECT COUNT(*) FROM groups").fetchone()[0]
+        rows = self._conn.execute(
+            "SELECT group_id, group_size, best_filename, best_score, start_ts, end_ts FROM groups "
+            "ORDER BY group_size DESC, group_id LIMIT ? OFFSET ?",
+            (int(limit) if limit > 0 else -1, max(0, int(offset))),
+        )
+        keys = ("group_id", "group_size", "best_filename", "best_score", "start_ts", "end_ts")
+        return total, [dict(zip(keys, row)) for row in rows]
@@ -0,0 +1,93 @@
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from photo_selector.config import CACHE_SCHEMA_VERSION  # noqa: E402
+from photo_selector.io.cache_sqlite import CacheSQLite, decode_record, encode_record  # noqa: E402
+
+
+def _data(i: int) -> dict:
+    return {
+        "capture_ts": 1700000000.5 + i,
+        "sharpness_score": 120.25 + i,
+        "exposure_score": 80.0,
+        "exp_p1": 2,
+        "exp_p5": 10,
+        "exp_p50": 128,
+        "exp_p95": 240,
+        "exp_p99": 255,
+        "white_ratio": 0.015,
+        "black_ratio": 0.002,
+        "dynamic_range": 253,
+        "exp_histogram": np.arange(256) * (i + 1),
+    }
+
+
+def _assert_measurements(decoded: dict, data: dict):
+    for key in ("capture_ts", "sharpness_score", "exp_p1", "exp_p5", "exp_p50", "exp_p95", "exp_p99",
+                "white_ratio", "black_ratio", "dynamic_range"):
+        assert decoded[key] == data[key], key
+    np.testing.assert_array_equal(decoded["exp_histogram"], data["exp_histogram"])
+
+
+def test_record_round_trip():
+    data = _data(3)
+    _assert_measurements(decode_record(encode_record(data)), data)
+
+    # Results without metrics only keep the capture time
+    assert decode_record(encode_record({"capture_ts": 5.0})) == {"capture_ts": 5.0}
+
+
+def test_write_behind_get_many_and_legacy_rows():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "cache.db")
+        cache = CacheSQLite(db, batch_size=4, flush_interval=0.05)
+        for i in range(10):
+            cache.put(f"sig{i}", _data(i))
+        # Pending writes are visible before the writer thread commits them
+        _assert_measurements(cache.get("sig0"), _data(0))
+        cache.flush()
+        cache.put_many((f"bulk{i}", _data(i)) for i in range(3))
+        # Queued just before close(): close() must still commit it
+        cache.put("last", _data(42))
+        cache.close()
+
+        # Rows written before the binary format, and rows of an older schema version
+        conn = sqlite3.connect(db)
+        with conn:
+            conn.execute(
+                "INSERT INTO metrics_cache (signature, schema_version, data) VALUES (?, ?, ?)",
+                ("legacy", CACHE_SCHEMA_VERSION, json.dumps({"capture_ts": 7.0, "sharpness_score": 9.5})),
+            )
+            conn.execute(
+                "INSERT INTO metrics_cache (signature, schema_version, data) VALUES (?, ?, ?)",
+                ("stale", "0.0.1", sqlite3.Binary(encode_record(_data(0)))),
+            )
+        conn.close()
+
+        cache = CacheSQLite(db)
+        try:
+            wanted = [f"sig{i}" for i in range(10)] + ["bulk2", "last", "legacy", "stale", "missing", ""]
+            found = cache.get_many(wanted)
+            assert sorted(found) == sorted([f"sig{i}" for i in range(10)] + ["bulk2", "last", "legacy"])
+            for i in range(10):
+                _assert_measurements(found[f"sig{i}"], _data(i))
+            _assert_measurements(found["bulk2"], _data(2))
+            _assert_measurements(found["last"], _data(42))
+            assert found["legacy"] == {"capture_ts": 7.0, "sharpness_score": 9.5}
+        finally:
+            cache.close()
+
+
+if __name__ == "__main__":
+    test_record_round_trip()
+    test_write_behind_get_many_and_legacy_rows()
+    print("ok")
@@ -0,0 +1,42 @@
+import os
+import shutil
+import sys
+import tempfile
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from photo_selector.io.cache_sqlite import CacheSQLite  # noqa: E402
+from photo_selector.io.content_key import ContentKeyMemo  # noqa: E402
+
+
+def test_content_key_survives_move_and_touch():
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "a.jpg")
+        with open(src, "wb") as f:
+            f.write(os.urandom(300 * 1024))
+        moved = os.path.join(tmp, "archive", "b.jpg")
+        os.makedirs(os.path.dirname(moved))
+        shutil.copyfile(src, moved)
+        os.utime(moved, (1, 1))
+
+        memo = ContentKeyMemo(os.path.join(tmp, "content_keys.db"))
+        (h1, size1), (h2, size2), missing = memo.hash_many([src, moved, os.path.join(tmp, "nope.jpg")])
+        assert (h1, size1) == (h2, size2) and missing is None
+        assert CacheSQLite.generate_signature(src, 1024, (h1, size1)) == CacheSQLite.generate_signature(
+            moved, 1024, (h2, size2)
+        )
+        assert memo.path_for_hash(h1) in (os.path.normpath(src), os.path.normpath(moved))
+
+        # Changing the bytes changes the key (memo is invalidated by size / mtime)
+        with open(moved, "r+b") as f:
+            f.write(b"\xff\xd8changed")
+        os.utime(moved, (2, 2))
+        assert memo.hash_for(moved)[0] != h1
+        memo.close()
+
+
+if __name__ == "__main__":
+    test_content_key_survives_move_and_touch()
+    print("ok")
@@ -0,0 +1,98 @@
+import os
+import struct
+import sys
+import tempfile
+
+import cv2
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from photo_selector.io.embedded_preview import (  # noqa: E402
+    find_embedded_previews,
+    read_embedded_preview,
+)
+
+
+def _jpeg(w: int, h: int) -> bytes:
+    ok, buf = cv2.imencode(".jpg", np.full((h, w, 3), 90, dtype=np.uint8))
+    assert ok
+    return buf.tobytes()
+
+
+def _with_exif_thumbnail(main: bytes, thumb: bytes, orientation: int = 0) -> bytes:
+    # TIFF header + IFD0 (Orientation, if given) + IFD1 holding JPEGInterchangeFormat(+Length)
+    ifd0_entries = 1 if orientation else 0
+    ifd0_off = 8
+    ifd1_off = ifd0_off + 2 + ifd0_entries * 12 + 4
+    thumb_off = ifd1_off + 2 + 2 * 12 + 4
+    tiff = b"II" + struct.pack("<HI", 42, ifd0_off)
+    tiff += struct.pack("<H", ifd0_entries)
+    if orientation:
+        tiff += struct.pack("<HHIHH", 0x0112, 3, 1, orientation, 0)
+    tiff += struct.pack("<I", ifd1_off)
+    tiff += struct.pack("<H", 2)
+    tiff += struct.pack("<HHII", 0x0201, 4, 1, thumb_off)
+    tiff += struct.pack("<HHII", 0x0202, 4, 1, len(thumb))
+    tiff += struct.pack("<I", 0)
+    payload = b"Exif\x00\x00" + tiff + thumb
+    app1 = b"\xff\xe1" + struct.pack(">H", len(payload) + 2) + payload
+    return main[:2] + app1 + main[2:]
+
+
+def test_exif_thumbnail_is_used_when_large_enough():
+    with tempfile.TemporaryDirectory() as td:
+        path = os.path.join(td, "a.jpg")
+        with open(path, "wb") as f:
+            f.write(_with_exif_thumbnail(_jpeg(1800, 1200), _jpeg(160, 120)))
+
+        previews = find_embedded_previews(path)
+        assert len(previews) == 1
+
+        img = read_embedded_preview(path, 256)
+        assert img is not None
+        assert img.shape[:2] == (120, 160)
+
+        # Too small for a 1024px request: caller must fall back to a full decode
+        assert read_embedded_preview(path, 1024) is None
+
+
+def test_no_previews_in_plain_jpeg():
+    with tempfile.TemporaryDirectory() as td:
+        path = os.path.join(td, "b.jpg")
+        with open(path, "wb") as f:
+            f.write(_jpeg(640, 480))
+        assert find_embedded_previews(path) == []
+        assert read_embedded_preview(path, 256) is None
+
+
+def test_preview_follows_main_image_orientation():
+    # Asymmetric content: gradients plus a bright block in the top-left corner
+    h, w = 480, 640
+    img = np.zeros((h, w, 3), dtype=np.uint8)
+    img[..., 0] = np.linspace(0, 255, w, dtype=np.uint8)
+    img[..., 1] = np.linspace(0, 255, h, dtype=np.uint8)[:, None]
+    img[:120, :160] = 255
+    main = cv2.imencode(".jpg", img)[1].tobytes()
+    thumb = cv2.imencode(".jpg", cv2.resize(img, (160, 120), interpolation=cv2.INTER_AREA))[1].tobytes()
+
+    with tempfile.TemporaryDirectory() as td:
+        for orientation in range(1, 9):
+            path = os.path.join(td, f"o{orientation}.jpg")
+            with open(path, "wb") as f:
+                f.write(_with_exif_thumbnail(main, thumb, orientation))
+            # A full decode applies the orientation; the preview must look the same
+            full = cv2.imread(path)
+            preview = read_embedded_preview(path, 256)
+            assert preview.shape == (full.shape[0] // 4, full.shape[1] // 4, 3), orientation
+            expected = cv2.resize(full, preview.shape[1::-1], interpolation=cv2.INTER_AREA)
+            assert np.abs(preview.astype(np.int16) - expected.astype(np.int16)).mean() < 8, orientation
+
+
+if __name__ == "__main__":
+    test_exif_thumbnail_is_used_when_large_enough()
+    test_no_previews_in_plain_jpeg()
+    test_preview_follows_main_image_orientation()
+    print("ok")
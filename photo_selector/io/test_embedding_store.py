@@ -0,0 +1,105 @@
+import concurrent.futures
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from photo_selector.io.embedding_cache_sqlite import EmbeddingCacheSQLite  # noqa: E402
+from photo_selector.io.embedding_store import EmbeddingStore, open_embedding_store  # noqa: E402
+
+
+def test_append_reopen_and_zero_copy_slice():
+    rng = np.random.default_rng(0)
+    vecs = rng.normal(size=(50, 8)).astype(np.float32)
+    keys = [f"m|256|/a/{i}.jpg|1|1.000000" for i in range(50)]
+    with tempfile.TemporaryDirectory() as tmp:
+        store = EmbeddingStore(tmp)
+        store.set_many((k, 8, v.tobytes()) for k, v in zip(keys, vecs))
+        # Visible before flush
+        assert np.frombuffer(store.get(keys[3]), dtype=np.float32).tolist() == vecs[3].tolist()
+        store.set("other|256|/b.jpg|1|1.000000", 4, np.ones(4, dtype=np.float32).tobytes())
+        store.close()
+
+        # Torn key line from an interrupted write is ignored
+        with open(os.path.join(tmp, "keys.tsv"), "a", encoding="utf-8") as f:
+            f.write("m|256|/a/torn.jpg|1|1.0\t8")
+
+        store = EmbeddingStore(tmp)
+        assert len(store) == 51
+        mat, found = store.get_matrix(keys[10:20])
+        assert found.all()
+        assert isinstance(mat, np.memmap)  # contiguous rows: a view of the mapped file
+        assert np.array_equal(mat, vecs[10:20])
+
+        mat, found = store.get_matrix([keys[5], "missing", keys[2]])
+        assert found.tolist() == [True, False, True]
+        assert np.array_equal(mat[[0, 2]], vecs[[5, 2]])
+        assert not mat[1].any()
+
+        # Updating a key appends a new row; the latest one wins after reopening
+        store.set(keys[0], 8, np.zeros(8, dtype=np.float32).tobytes())
+        store.close()
+        assert not np.frombuffer(EmbeddingStore(tmp).get(keys[0]), dtype=np.float32).any()
+
+
+def _append_from_process(args):
+    store_dir, worker = args
+    store = EmbeddingStore(store_dir)
+    for batch in range(5):
+        store.set_many(
+            (f"w{worker}|{batch}|{i}", 4, np.full(4, worker * 1000 + batch * 10 + i, dtype=np.float32).tobytes())
+            for i in range(10)
+        )
+        store.flush()
+    store.close()
+
+
+def test_stores_sharing_a_directory():
+    with tempfile.TemporaryDirectory() as tmp:
+        a, b = EmbeddingStore(tmp), EmbeddingStore(tmp)
+        a.set("ka", 2, np.array([1, 1], dtype=np.float32).tobytes())
+        a.flush()
+        b.set("kb", 2, np.array([2, 2], dtype=np.float32).tobytes())
+        b.flush()
+        assert np.frombuffer(b.get("kb"), dtype=np.float32).tolist() == [2.0, 2.0]
+        reopened = EmbeddingStore(tmp)
+        assert np.frombuffer(reopened.get("ka"), dtype=np.float32).tolist() == [1.0, 1.0]
+        assert np.frombuffer(reopened.get("kb"), dtype=np.float32).tolist() == [2.0, 2.0]
+
+        # Opening leaves a half-written vector (another process mid-append) alone
+        path = os.path.join(tmp, "vectors_2.f32")
+        with open(path, "ab") as f:
+            f.write(b"\0" * 4)
+        EmbeddingStore(tmp)
+        assert os.path.getsize(path) == 4 * 2 * 2 + 4
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=4) as pool:
+            list(pool.map(_append_from_process, [(tmp, w) for w in range(4)]))
+        store = EmbeddingStore(tmp)
+        assert len(store) == 2 + 4 * 5 * 10
+        for w in range(4):
+            for batch in range(5):
+                for i in range(10):
+                    vec = np.frombuffer(store.get(f"w{w}|{batch}|{i}"), dtype=np.float32)
+                    assert vec[0] == w * 1000 + batch * 10 + i
+
+
+def test_legacy_sqlite_import():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "embedding_cache.db")
+        legacy = EmbeddingCacheSQLite(db)
+        legacy.set("m|256|/a.jpg|1|1.000000", 2, np.array([1, 2], dtype=np.float32).tobytes())
+        store = open_embedding_store(os.path.join(tmp, "embedding_store"), legacy_sqlite_path=db)
+        assert np.frombuffer(store.get("m|256|/a.jpg|1|1.000000"), dtype=np.float32).tolist() == [1.0, 2.0]
+
+
+if __name__ == "__main__":
+    test_append_reopen_and_zero_copy_slice()
+    test_stores_sharing_a_directory()
+    test_legacy_sqlite_import()
+    print("ok")
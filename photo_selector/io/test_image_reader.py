@@ -0,0 +1,77 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from photo_selector.io.image_reader import (  # noqa: E402
+    choose_reduced_factor,
+    decode_and_resize,
+    parse_jpeg_size,
+    read_and_resize,
+    to_gray,
+)
+
+
+def _encode_jpeg(w: int, h: int) -> np.ndarray:
+    img = np.full((h, w, 3), 128, dtype=np.uint8)
+    ok, buf = cv2.imencode(".jpg", img)
+    assert ok
+    return buf.ravel()
+
+
+def test_parse_jpeg_size_reads_sof_header():
+    buf = _encode_jpeg(1200, 800)
+    assert parse_jpeg_size(buf) == (1200, 800)
+    assert parse_jpeg_size(buf.tobytes()) == (1200, 800)
+    assert parse_jpeg_size(b"\x89PNG\r\n\x1a\n") is None
+
+
+def test_reduced_factor_covers_target():
+    assert choose_reduced_factor(6000, 256) == 8
+    assert choose_reduced_factor(6000, 1024) == 4
+    assert choose_reduced_factor(1800, 1024) == 1
+    assert choose_reduced_factor(2048, 1024) == 2
+
+    stats = {}
+    img = decode_and_resize(_encode_jpeg(2400, 1600), 256, stats=stats)
+    assert stats["factor"] == 8
+    assert max(img.shape[:2]) == 256
+
+
+def test_grayscale_decode_matches_converted_colour():
+    # Colour gradient, so chroma matters for the conversion
+    h, w = 1600, 2400
+    x = np.linspace(0, 255, w, dtype=np.float32)
+    y = np.linspace(0, 255, h, dtype=np.float32)[:, None]
+    img = np.dstack([np.broadcast_to(x, (h, w)), np.broadcast_to(y, (h, w)), (x + y) / 2]).astype(np.uint8)
+    ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    assert ok
+
+    gray_stats, colour_stats = {}, {}
+    gray = decode_and_resize(buf.ravel(), 256, stats=gray_stats, grayscale=True)
+    colour = decode_and_resize(buf.ravel(), 256, stats=colour_stats)
+    assert gray.ndim == 2 and colour.ndim == 3
+    assert gray.shape == colour.shape[:2]
+    assert gray_stats == colour_stats
+    # Decoded luma vs. BGR -> gray after chroma upsampling: only rounding differs
+    assert np.abs(gray.astype(np.int16) - to_gray(colour).astype(np.int16)).mean() < 1.5
+    assert to_gray(gray) is gray
+
+    # Not a JPEG (no SOF header): the fixed /4 heuristic uses the reduced grayscale flag too
+    ok, png = cv2.imencode(".png", img[:400, :600])
+    assert ok
+    stats = {}
+    small = decode_and_resize(png.ravel(), 256, stats=stats, grayscale=True)
+    assert small.shape == (100, 150) and stats["factor"] == 4
+
+
+if __name__ == "__main__":
+    test_parse_jpeg_size_reads_sof_header()
+    test_reduced_factor_covers_target()
+    test_grayscale_decode_matches_converted_colour()
+    print("ok")
@@ -0,0 +1,47 @@
+import os
+import sys
+import threading
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from photo_selector.io.io_scheduler import AdaptiveIoScheduler  # noqa: E402
+
+_DISK = threading.Lock()
+
+
+def _network_op(i: int) -> int:
+    # Latency does not depend on how many requests are in flight
+    time.sleep(0.004)
+    return i
+
+
+def _contended_op(i: int) -> int:
+    # One device serving requests one at a time
+    with _DISK:
+        time.sleep(0.001)
+    return i
+
+
+def test_concurrency_follows_latency():
+    network = AdaptiveIoScheduler(min_concurrency=2, max_concurrency=32)
+    assert sorted(r for _, r in network.map(_network_op, range(600))) == list(range(600))
+    stats = network.stats()
+    assert stats["files"] == 600
+    assert stats["concurrency"]["max"] >= 24
+    assert stats["latency_ms"]["p50"] >= 4.0
+
+    disk = AdaptiveIoScheduler(min_concurrency=2, max_concurrency=32)
+    list(disk.map(_contended_op, range(300)))
+    assert disk.stats()["concurrency"]["max"] <= 12
+
+    fixed = AdaptiveIoScheduler(initial=3, max_concurrency=3, adaptive=False)
+    list(fixed.map(_network_op, range(30)))
+    assert fixed.stats()["concurrency"]["peak_in_flight"] == 3
+
+
+if __name__ == "__main__":
+    test_concurrency_follows_latency()
+    print("ok")
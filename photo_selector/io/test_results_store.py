@@ -0,0 +1,90 @@
+import os
+import sys
+import tempfile
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from photo_selector.io.results_store import ResultsStore  # noqa: E402
+from photo_selector.pipeline.models import ExposureResult, MetricsResult, SharpnessResult  # noqa: E402
+
+
+def _results():
+    results = []
+    for i in range(10):
+        r = MetricsResult(filename=f"img_{i:02d}.jpg", technical_score=10.0 * i, capture_ts=100.0 + i)
+        r.sharpness = SharpnessResult(score=5.0 * i, is_blurry=i < 3)
+        r.exposure = ExposureResult(10.0, 1, 5, 128, 250, 255, 0.01, 0.0, 254, ["highlights_clipped"] if i == 9 else [])
+        r.is_unusable = i == 0
+        r.reasons = ["blurry"] if i == 0 else []
+        results.append(r)
+    return results
+
+
+def test_store_round_trip_groups_and_pages():
+    with tempfile.TemporaryDirectory() as td:
+        store = ResultsStore(os.path.join(td, "results.db"))
+        try:
+            results = _results()
+            store.replace_all(results)
+            assert [r.to_dict() for r in store.load()] == [r.to_dict() for r in results]
+
+            # Two groups of three; img_09 stays ungrouped
+            for i, r in enumerate(results[3:9]):
+                r.group_id, r.group_size, r.rank_in_group = i // 3, 3, 3 - i % 3
+                r.is_group_best = i % 3 == 2
+            assert store.update_groups(results) == 6
+            assert store.update_groups(results) == 0
+
+            total, groups = store.groups()
+            assert total == 2
+            assert [(g["group_id"], g["best_filename"], g["start_ts"]) for g in groups] == [
+                (0, "img_05.jpg", 103.0),
+                (1, "img_08.jpg", 106.0),
+            ]
+
+            total, page = store.query(group_best=True, min_score=60, sort="technical_score", descending=True)
+            assert (total, [r["filename"] for r in page]) == (1, ["img_08.jpg"])
+
+            total, page = store.query(sort="technical_score", descending=True, offset=2, limit=3)
+            assert (total, [r["filename"] for r in page]) == (10, ["img_07.jpg", "img_06.jpg", "img_05.jpg"])
+
+            assert store.query(grouped=False, blurry=False)[0] == 1
+            assert store.query(unusable=True)[1][0]["reasons"] == "blurry"
+            assert store.query(name="_0")[0] == 10
+        finally:
+            store.close()
+
+
+def test_replace_all_writes_only_changes():
+    with tempfile.TemporaryDirectory() as td:
+        store = ResultsStore(os.path.join(td, "results.db"))
+        try:
+            results = _results()
+            for i, r in enumerate(results[3:9]):
+                r.group_id, r.group_size, r.rank_in_group = i // 3, 3, 3 - i % 3
+                r.is_group_best = i % 3 == 2
+            assert store.replace_all(results) == 10
+            assert store.replace_all(results) == 0
+
+            # One changed score, one photo gone (the best of group 1): only those rows and group 1 change
+            results[4].technical_score = 1.0
+            best = results.pop(8)
+            results[7].is_group_best = True
+            assert store.replace_all(results) == 3
+            assert [r.to_dict() for r in store.load()] == [r.to_dict() for r in results]
+            _, groups = store.groups()
+            assert [(g["group_id"], g["group_size"], g["best_filename"]) for g in groups] == [
+                (0, 3, "img_05.jpg"),
+                (1, 2, "img_07.jpg"),
+            ]
+            assert best.filename not in [r["filename"] for r in store.query(limit=0)[1]]
+        finally:
+            store.close()
+
+
+if __name__ == "__main__":
+    test_store_round_trip_groups_and_pages()
+    test_replace_all_writes_only_changes()
+    print("ok")
@@ -0,0 +1,161 @@
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# SQLite limits the number of host parameters per statement
+_SQL_BATCH = 500
+
+
+class SidecarState(NamedTuple):
+    """What a sidecar held when it was last scanned (rating / label None when absent)."""
+
+    path: str
+    size: int
+    mtime_ns: int
+    rating: Optional[int]
+    label: Optional[str]
+    keywords: Tuple[str, ...]
+    corrupt: bool = False
+
+
+def parse_rating(text: Optional[str]) -> Optional[int]:
+    if text is None:
+        return None
+    try:
+        return int(float(text.strip()))
+    except ValueError:
+        return None
+
+
+class XmpIndex:
+    """
+    Rating, label and keywords of the sidecars next to the photos, as last
+    seen by scan-xmp. Lives in the metrics cache database (two tables next
+    to metrics_cache); rows carry the sidecar's size / mtime_ns so a rescan
+    only reads files that changed. Keywords are also kept one row per
+    keyword so "which photos carry AI/BestInGroup" is an index lookup.
+    """
+
+    def __init__(self, db_path: str = "cache.db"):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        try:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        except sqlite3.DatabaseError as e:
+            logger.warning(f"WAL not available for {db_path}: {e}")
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS xmp_sidecars (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    rating INTEGER,
+                    label TEXT,
+                    keywords TEXT NOT NULL DEFAULT '',
+                    corrupt INTEGER NOT NULL DEFAULT 0,
+                    scanned_at REAL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS xmp_sidecars_rating ON xmp_sidecars (rating)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS xmp_sidecars_label ON xmp_sidecars (label)")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS xmp_keywords (
+                    keyword TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    PRIMARY KEY (keyword, path)
+                ) WITHOUT ROWID
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS xmp_keywords_path ON xmp_keywords (path)")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _select(self, sql: str, paths: List[str]) -> List[tuple]:
+        rows: List[tuple] = []
+        for i in range(0, len(paths), _SQL_BATCH):
+            part = paths[i:i + _SQL_BATCH]
+            with self._lock:
+                rows.extend(self._conn.execute(sql.format(",".join("?" * len(part))), part).fetchall())
+        return rows
+
+    def stats_many(self, paths: Iterable[str]) -> Dict[str, Tuple[int, int]]:
+        """(size, mtime_ns) recorded per path; unknown paths are omitted."""
+        rows = self._select("SELECT path, size, mtime_ns FROM xmp_sidecars WHERE path IN ({})", list(paths))
+        return {path: (size, mtime_ns) for path, size, mtime_ns in rows}
+
+    def get_many(self, paths: Iterable[str]) -> Dict[str, SidecarState]:
+        rows = self._select(
+            "SELECT path, size, mtime_ns, rating, label, keywords, corrupt FROM xmp_sidecars WHERE path IN ({})",
+            list(paths),
+        )
+        return {
+            row[0]: SidecarState(row[0], row[1], row[2], row[3], row[4], tuple(k for k in row[5].split("\n") if k), bool(row[6]))
+            for row in rows
+        }
+
+    def paths_with_keyword(self, keyword: str) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT path FROM xmp_keywords WHERE keyword = ? ORDER BY path", (keyword,)).fetchall()
+        return [r[0] for r in rows]
+
+    def put_many(self, states: Iterable[SidecarState]) -> None:
+        """Replaces the rows (and keyword rows) of these sidecars in one transaction."""
+        states = list(states)
+        if not states:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM xmp_keywords WHERE path = ?", [(s.path,) for s in states])
+            self._conn.executemany(
+                """
+                INSERT OR REPLACE INTO xmp_sidecars (path, size, mtime_ns, rating, label, keywords, corrupt, scanned_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (s.path, s.size, s.mtime_ns, s.rating, s.label, "\n".join(s.keywords), int(s.corrupt), now)
+                    for s in states
+                ],
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO xmp_keywords (keyword, path) VALUES (?, ?)",
+                [(kw, s.path) for s in states for kw in s.keywords],
+            )
+
+    def delete_many(self, paths: Iterable[str]) -> None:
+        rows = [(p,) for p in paths]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM xmp_keywords WHERE path = ?", rows)
+            self._conn.executemany("DELETE FROM xmp_sidecars WHERE path = ?", rows)
+
+    def summary(self, paths: Iterable[str]) -> Dict:
+        """Counts per rating and label, and the most common keywords, over these sidecars."""
+        states = self.get_many(paths).values()
+        ratings: Dict[str, int] = {}
+        labels: Dict[str, int] = {}
+        keywords: Dict[str, int] = {}
+        for s in states:
+            r = "none" if s.rating is None else str(s.rating)
+            ratings[r] = ratings.get(r, 0) + 1
+            if s.label:
+                labels[s.label] = labels.get(s.label, 0) + 1
+            for kw in s.keywords:
+                keywords[kw] = keywords.get(kw, 0) + 1
+        top = sorted(keywords.items(), key=lambda kv: (-kv[1], kv[0]))[:20]
+        return {
+            "sidecars": len(states),
+            "corrupt": sum(1 for s in states if s.corrupt),
+            "ratings": dict(sorted(ratings.items())),
+            "labels": dict(sorted(labels.items())),
+            "top_keywords": dict(top),
+        }
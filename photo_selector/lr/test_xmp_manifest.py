@@ -0,0 +1,38 @@
+import os
+import sys
+import tempfile
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from photo_selector.pipeline.models import MetricsResult  # noqa: E402
+from photo_selector.pipeline.stage2_xmp import run_stage2  # noqa: E402
+
+
+def test_manifest_skips_unchanged_sidecars():
+    with tempfile.TemporaryDirectory() as td:
+        results = []
+        for i in range(4):
+            r = MetricsResult(filename=os.path.join(td, f"img_{i}.jpg"))
+            r.technical_score = 50.0 + 10 * i
+            results.append(r)
+        manifest = os.path.join(td, "xmp_manifest.json")
+
+        assert run_stage2(results, workers=2, manifest_path=manifest)["updated"] == 4
+        assert run_stage2(results, workers=2, manifest_path=manifest)["skipped"] == 4
+
+        # A new decision and an external edit are both checked again
+        results[0].technical_score = 90.0
+        with open(os.path.join(td, "img_1.xmp"), "a", encoding="utf-8") as f:
+            f.write("\n")
+        counts = run_stage2(results, workers=2, manifest_path=manifest)
+        io = counts.pop("io")
+        assert counts == {"updated": 1, "current": 1, "skipped": 2, "failed": 0}
+        assert io["files"] == 4
+        assert run_stage2(results, workers=2, manifest_path=manifest)["skipped"] == 4
+
+
+if __name__ == "__main__":
+    test_manifest_skips_unchanged_sidecars()
+    print("ok")
@@ -0,0 +1,119 @@
+import os
+import sys
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from photo_selector.lr.xmp_patch import patch_xmp  # noqa: E402
+from photo_selector.lr.xmp_writer import NEW_SIDECAR, NS_MAP, XmpWriter  # noqa: E402
+import xml.etree.ElementTree as ET  # noqa: E402
+
+LIGHTROOM_SIDECAR = b"""<x:xmpmeta xmlns:x="adobe:ns:meta/" x:xmptk="Adobe XMP Core 7.0-c000 1.000000, 0000/00/00-00:00:00        ">
+ <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <rdf:Description rdf:about=""
+    xmlns:xmp="http://ns.adobe.com/xap/1.0/"
+    xmlns:xmpMM="http://ns.adobe.com/xap/1.0/mm/"
+    xmlns:stEvt="http://ns.adobe.com/xap/1.0/sType/ResourceEvent#"
+    xmlns:dc="http://purl.org/dc/elements/1.1/"
+    xmlns:crs="http://ns.adobe.com/camera-raw-settings/1.0/"
+   xmp:Rating="3"
+   xmp:Label="Blue"
+   crs:Version="15.0"
+   crs:Exposure2012="+0.35"
+   crs:Texture="&gt;10">
+   <xmpMM:History>
+    <rdf:Seq>
+     <rdf:li
+      stEvt:action="saved"
+      stEvt:softwareAgent="Adobe Photoshop Lightroom Classic 12.0"/>
+     <rdf:li>
+      <rdf:Seq>
+       <rdf:li>nested</rdf:li>
+      </rdf:Seq>
+     </rdf:li>
+    </rdf:Seq>
+   </xmpMM:History>
+   <crs:ToneCurvePV2012>
+    <rdf:Seq>
+     <rdf:li>0, 0</rdf:li>
+     <rdf:li>255, 255</rdf:li>
+    </rdf:Seq>
+   </crs:ToneCurvePV2012>
+   <dc:subject>
+    <rdf:Bag>
+     <rdf:li>Family &amp; Friends</rdf:li>
+     <rdf:li>AI/Group/7</rdf:li>
+     <rdf:li>AI/Sharp</rdf:li>
+     <rdf:li>AI/Group/7</rdf:li>
+    </rdf:Bag>
+   </dc:subject>
+  </rdf:Description>
+ </rdf:RDF>
+</x:xmpmeta>
+"""
+
+
+def _summary(data: bytes):
+    """Everything Stage 2 cares about, plus the untouched parts of the Description."""
+    desc = ET.fromstring(data).find(f"{{{NS_MAP['rdf']}}}RDF").find(f"{{{NS_MAP['rdf']}}}Description")
+    rating_tag = f"{{{NS_MAP['xmp']}}}Rating"
+    label_tag = f"{{{NS_MAP['xmp']}}}Label"
+    rating = desc.findtext(rating_tag) if desc.find(rating_tag) is not None else desc.get(rating_tag)
+    label = desc.findtext(label_tag) if desc.find(label_tag) is not None else desc.get(label_tag)
+    bag = desc.find(f"{{{NS_MAP['dc']}}}subject/{{{NS_MAP['rdf']}}}Bag")
+    keywords = sorted(li.text for li in bag) if bag is not None else None
+    others = [
+        ET.tostring(child)
+        for child in desc
+        if child.tag not in (rating_tag, label_tag, f"{{{NS_MAP['dc']}}}subject")
+    ]
+    attrs = {k: v for k, v in desc.attrib.items() if k not in (rating_tag, label_tag)}
+    return rating, label, keywords, others, attrs
+
+
+def test_fast_path_matches_elementtree():
+    cases = [
+        (3, "Blue", ["AI/Group/7", "AI/Sharp"]),
+        (5, "Green", ["AI/Group/2", "AI/BestInGroup", "AI/Group/2"]),
+        (0, None, []),
+        (None, "Red & <Rejected>", None),
+        (7, "", ["AI/Similar"]),
+    ]
+    sidecars = [
+        LIGHTROOM_SIDECAR,
+        NEW_SIDECAR,
+        LIGHTROOM_SIDECAR.replace(b'xmp:Rating="3"', b"").replace(b"   <dc:subject>", b"   <xmp:Rating>1</xmp:Rating>\n   <dc:subject>"),
+        NEW_SIDECAR.replace(b'photoshop/1.0/">\n  </rdf:Description>', b'photoshop/1.0/"/>'),
+    ]
+    for data in sidecars:
+        for rating, label, keywords in cases:
+            fast = patch_xmp(data, rating, label, keywords)
+            assert fast is not None
+            slow = XmpWriter.patch_tree(data, rating, label, keywords)
+            assert fast[1] == slow[1], (rating, label, keywords)
+            assert _summary(fast[0]) == _summary(slow[0]), (rating, label, keywords)
+            # Applying the same values again is a no-op
+            assert patch_xmp(fast[0], rating, label, keywords) == (fast[0], False)
+
+    # Bytes outside the edited values are kept as they were
+    out, changed = patch_xmp(LIGHTROOM_SIDECAR, 4, "Blue", ["AI/Sharp"])
+    assert changed
+    assert out == LIGHTROOM_SIDECAR.replace(b'xmp:Rating="3"', b'xmp:Rating="4"').replace(
+        b"\n     <rdf:li>AI/Group/7</rdf:li>", b""
+    )
+
+
+def test_unusual_layouts_are_left_to_elementtree():
+    two_descriptions = LIGHTROOM_SIDECAR.replace(
+        b"  </rdf:Description>\n", b"  </rdf:Description>\n  <rdf:Description rdf:about=\"\"/>\n"
+    )
+    commented = LIGHTROOM_SIDECAR.replace(b"<dc:subject>", b"<!-- keywords --><dc:subject>")
+    for data in (two_descriptions, commented, LIGHTROOM_SIDECAR[:-40]):
+        assert patch_xmp(data, 4, "Red", ["AI/Sharp"]) is None
+
+
+if __name__ == "__main__":
+    test_fast_path_matches_elementtree()
+    test_unusual_layouts_are_left_to_elementtree()
+    print("ok")
@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from photo_selector.io.xmp_index import XmpIndex  # noqa: E402
+from photo_selector.lr.xmp_scan import scan_sidecars  # noqa: E402
+from photo_selector.lr.xmp_writer import XmpWriter, sidecar_path  # noqa: E402
+
+
+def test_rescan_reads_only_changed_sidecars():
+    with tempfile.TemporaryDirectory() as td:
+        images = [os.path.join(td, f"img_{i}.jpg") for i in range(5)]
+        for i, img in enumerate(images[:4]):
+            XmpWriter.update_xmp(sidecar_path(img), rating=i + 1, label="Green" if i % 2 else None, keywords=["AI/Group_1"])
+        index = XmpIndex(os.path.join(td, "cache.db"))
+        try:
+            counts = scan_sidecars(images, index, workers=2)
+            assert (counts["scanned"], counts["missing"]) == (4, 1)
+            assert counts["summary"]["ratings"] == {"1": 1, "2": 1, "3": 1, "4": 1}
+            assert counts["summary"]["labels"] == {"Green": 2}
+
+            assert scan_sidecars(images, index)["unchanged"] == 4
+
+            XmpWriter.update_xmp(sidecar_path(images[0]), rating=5, label=None, keywords=["AI/BestInGroup"])
+            os.remove(os.path.join(td, "img_3.xmp"))
+            counts = scan_sidecars(images, index)
+            assert (counts["scanned"], counts["unchanged"], counts["missing"]) == (1, 2, 2)
+            assert index.paths_with_keyword("AI/BestInGroup") == [os.path.join(td, "img_0.xmp")]
+            assert counts["summary"]["sidecars"] == 3
+
+            assert scan_sidecars(images, index, rebuild=True)["scanned"] == 3
+        finally:
+            index.close()
+
+
+if __name__ == "__main__":
+    test_rescan_reads_only_changed_sidecars()
+    print("ok")
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = "xmp_manifest.json"
+_MANIFEST_VERSION = 1
+
+
+def xmp_fingerprint(rating: Optional[int], label: Optional[str], keywords: Optional[List[str]]) -> str:
+    """Fingerprint of what XmpWriter.update_xmp would leave in a sidecar for these values."""
+    if rating is not None:
+        rating = max(0, min(5, int(rating)))
+    ai = sorted({kw for kw in (keywords or []) if isinstance(kw, str) and kw.startswith("AI/")})
+    payload = json.dumps([rating, label, keywords is not None, ai], ensure_ascii=False)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=12).hexdigest()
+
+
+def sidecar_stat(xmp_path: str) -> Optional[Tuple[int, int]]:
+    """(size, mtime_ns) of a sidecar, None when it does not exist."""
+    try:
+        st = os.stat(xmp_path)
+    except OSError:
+        return None
+    return int(st.st_size), int(st.st_mtime_ns)
+
+
+class XmpManifest:
+    """
+    What Stage 2 last left in each sidecar: the fingerprint of the values
+    it synced and the sidecar's size / mtime right after. A sidecar whose
+    stat still matches and whose desired fingerprint is unchanged is known
+    to be current without parsing it; anything edited since (Lightroom,
+    another tool) no longer matches and gets checked again.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._entries: Dict[str, Tuple[str, int, int]] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == _MANIFEST_VERSION:
+                    self._entries = {k: (str(v[0]), int(v[1]), int(v[2])) for k, v in data["entries"].items()}
+            except (OSError, ValueError, KeyError, TypeError, IndexError) as e:
+                logger.warning(f"Ignoring unreadable XMP manifest {path}: {e}")
+                self._entries = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, xmp_path: str) -> Optional[Tuple[str, int, int]]:
+        """(fingerprint, size, mtime_ns) recorded for a sidecar."""
+        return self._entries.get(os.path.abspath(xmp_path))
+
+    def record(self, xmp_path: str, fingerprint: str, stat: Optional[Tuple[int, int]]) -> None:
+        key = os.path.abspath(xmp_path)
+        with self._lock:
+            if stat is None:
+                if self._entries.pop(key, None) is not None:
+                    self._dirty = True
+                return
+            entry = (fingerprint, int(stat[0]), int(stat[1]))
+            if self._entries.get(key) != entry:
+                self._entries[key] = entry
+                self._dirty = True
+
+    def save(self) -> None:
+        if not self.path or not self._dirty:
+            return
+        with self._lock:
+            data = {
+                "version": _MANIFEST_VERSION,
+                "entries": {k: list(v) for k, v in self._entries.items()},
+            }
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+            self._dirty = False
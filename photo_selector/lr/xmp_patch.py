@@ -0,0 +1,463 @@
+"""
+Byte-level patching of xmp:Rating, xmp:Label and the AI/ keywords in
+dc:subject for the usual sidecar layout:
+
+    <x:xmpmeta>
+     <rdf:RDF>
+      <rdf:Description xmp:Rating="3" crs:...="..." ...>
+       ... <xmp:Label>Red</xmp:Label> ... <dc:subject><rdf:Bag><rdf:li>...</rdf:li></rdf:Bag></dc:subject> ...
+      </rdf:Description>
+     </rdf:RDF>
+    </x:xmpmeta>
+
+Tags are found with a regex tokenizer; the Description's other children
+(crs: tone curves, xmpMM:History, ...) are skipped by searching for their
+closing tag instead of being tokenized, and everything outside the edited
+spans is copied through untouched. Anything else (comments, DOCTYPE,
+CDATA, several Descriptions, character references in the edited values,
+non-UTF-8 encodings, ...) is reported as unsupported so the caller can
+fall back to ElementTree.
+"""
+import re
+from typing import Dict, List, Optional, Tuple
+
+RDF_NS = b"http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+XMP_NS = b"http://ns.adobe.com/xap/1.0/"
+DC_NS = b"http://purl.org/dc/elements/1.1/"
+XML_NS = b"http://www.w3.org/XML/1998/namespace"
+
+_TAG = re.compile(rb"<(/?)([^\s/>]+)((?:\s+[^\s=/>]+\s*=\s*(?:\"[^\"]*\"|'[^']*'))*)\s*(/?)>")
+_XMLNS = re.compile(rb"\sxmlns(?::([^\s=/>]+))?\s*=\s*(?:\"([^\"]*)\"|'([^']*)')")
+# Only Rating / Label attributes of the Description are read, not its crs: settings
+_PROP_ATTR = re.compile(rb"\s([^\s=/>]+:(?:Rating|Label))\s*=\s*(?:\"([^\"]*)\"|'([^']*)')")
+_PI = re.compile(rb"<\?.*?\?>", re.S)
+_DECL_ENCODING = re.compile(rb"encoding\s*=\s*[\"']([A-Za-z0-9._-]+)[\"']")
+
+
+class _Unsupported(Exception):
+    pass
+
+
+class _Tag:
+    __slots__ = ("closing", "name", "self_closing", "start", "end", "attrs_start", "attrs_end")
+
+    def __init__(self, m: "re.Match"):
+        self.closing = bool(m.group(1))
+        self.name = m.group(2)
+        self.self_closing = bool(m.group(4))
+        self.start = m.start()
+        self.end = m.end()
+        self.attrs_start = m.start(3)
+        self.attrs_end = m.end(3)
+
+
+class _Value:
+    """Text of a property element or value of an attribute, with its byte span."""
+
+    __slots__ = ("text", "start", "end", "quote")
+
+    def __init__(self, text: Optional[str], start: int, end: int, quote: Optional[bytes] = None):
+        self.text = text
+        self.start = start
+        self.end = end
+        self.quote = quote
+
+
+def _decode(raw: bytes) -> str:
+    try:
+        text = raw.decode("utf-8")
+    except UnicodeDecodeError:
+        raise _Unsupported("not UTF-8")
+    if "&" in text:
+        if "&#" in text:
+            raise _Unsupported("character reference")
+        # Not xml.sax.saxutils: it imports urllib.request (http.client, email, ssl)
+        # on the write-xmp cold start. &amp; goes last so "&amp;lt;" stays "&lt;".
+        text = (
+            text.replace("&lt;", "<")
+            .replace("&gt;", ">")
+            .replace("&quot;", '"')
+            .replace("&apos;", "'")
+            .replace("&amp;", "&")
+        )
+    return text
+
+
+def _escape(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _encode_text(text: str) -> bytes:
+    return _escape(text).encode("utf-8")
+
+
+def _encode_attr(text: str, quote: bytes) -> bytes:
+    if quote == b'"':
+        return _escape(text).replace('"', "&quot;").encode("utf-8")
+    return _escape(text).replace("'", "&apos;").encode("utf-8")
+
+
+class _Patcher:
+    def __init__(self, data: bytes):
+        self.data = data
+        self._skip_patterns: Dict[bytes, "re.Pattern"] = {}
+
+    def next_tag(self, pos: int) -> _Tag:
+        data = self.data
+        while True:
+            lt = data.find(b"<", pos)
+            if lt < 0:
+                raise _Unsupported("unexpected end of document")
+            if data.startswith(b"<?", lt):
+                end = data.find(b"?>", lt)
+                if end < 0:
+                    raise _Unsupported("unterminated processing instruction")
+                pos = end + 2
+                continue
+            m = _TAG.match(data, lt)
+            if m is None:
+                raise _Unsupported("malformed tag")
+            return _Tag(m)
+
+    def next_tag_after_space(self, pos: int) -> _Tag:
+        """Next tag, requiring only whitespace between pos and it."""
+        tag = self.next_tag(pos)
+        if self.data[pos:tag.start].strip():
+            raise _Unsupported("mixed content")
+        return tag
+
+    def closing_tag(self, open_tag: _Tag) -> _Tag:
+        tag = self.next_tag(open_tag.end)
+        if not tag.closing or tag.name != open_tag.name:
+            raise _Unsupported(f"unexpected tag inside {open_tag.name!r}")
+        return tag
+
+    def scope(self, tag: _Tag, parent: Dict[bytes, bytes]) -> Dict[bytes, bytes]:
+        scope = parent
+        for m in _XMLNS.finditer(self.data, tag.attrs_start, tag.attrs_end):
+            if scope is parent:
+                scope = dict(parent)
+            scope[m.group(1) or b""] = m.group(2) if m.group(2) is not None else m.group(3)
+        return scope
+
+    @staticmethod
+    def resolve(name: bytes, scope: Dict[bytes, bytes], attribute: bool = False) -> Tuple[Optional[bytes], bytes]:
+        if b":" in name:
+            prefix, local = name.split(b":", 1)
+            uri = scope.get(prefix)
+            if uri is None:
+                raise _Unsupported(f"unbound prefix {prefix!r}")
+            return uri, local
+        return (None if attribute else scope.get(b"")), name
+
+    def skip_element(self, tag: _Tag) -> int:
+        """End offset of an element, found by scanning for its own name only."""
+        if tag.self_closing:
+            return tag.end
+        pattern = self._skip_patterns.get(tag.name)
+        if pattern is None:
+            pattern = re.compile(rb"<(/?)" + re.escape(tag.name) + rb"(?=[\s/>])")
+            self._skip_patterns[tag.name] = pattern
+        depth = 1
+        for m in pattern.finditer(self.data, tag.end):
+            inner = _TAG.match(self.data, m.start())
+            if inner is None:
+                raise _Unsupported("malformed tag")
+            if m.group(1):
+                depth -= 1
+                if depth == 0:
+                    return inner.end()
+            elif not inner.group(4):
+                depth += 1
+        raise _Unsupported(f"unterminated {tag.name!r}")
+
+    def line_indent(self, pos: int) -> bytes:
+        """Whitespace between the start of pos's line and pos (empty if there is other text)."""
+        line_start = self.data.rfind(b"\n", 0, pos) + 1
+        ws = self.data[line_start:pos]
+        return ws if not ws.strip() else b""
+
+    def text_value(self, tag: _Tag) -> Tuple[_Value, int]:
+        """A text-only property element's value and end offset."""
+        if tag.self_closing:
+            raise _Unsupported("empty property element")
+        close = self.closing_tag(tag)
+        if self.data.find(b"<", tag.end) != close.start:
+            raise _Unsupported("processing instruction inside a value")
+        return _Value(_decode(self.data[tag.end:close.start]), tag.end, close.start), close.end
+
+
+def _prefix_for(uri: bytes, default: bytes, scope: Dict[bytes, bytes]) -> Tuple[bytes, bytes]:
+    """(prefix, xmlns declaration to add) for writing an element in namespace uri."""
+    for prefix, bound in scope.items():
+        if prefix and bound == uri:
+            return prefix, b""
+    if default in scope:
+        raise _Unsupported(f"prefix {default!r} is bound to another namespace")
+    return default, b' xmlns:' + default + b'="' + uri + b'"'
+
+
+def patch_xmp(
+    data: bytes,
+    rating: Optional[int] = None,
+    label: Optional[str] = None,
+    keywords: Optional[List[str]] = None,
+) -> Optional[Tuple[bytes, bool]]:
+    """
+    (new bytes, changed) with the same outcome as XmpWriter's ElementTree
+    path, or None when the sidecar's layout is not supported here.
+    """
+    try:
+        return _patch(data, rating, label, keywords)
+    except _Unsupported:
+        return None
+
+
+class _Layout:
+    """Where the synced properties are in a supported sidecar."""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        if b"<!" in data or data[:2] in (b"\xff\xfe", b"\xfe\xff"):
+            raise _Unsupported("comment, DOCTYPE, CDATA or UTF-16")
+        decl_end = data.find(b"?>") if data.lstrip(b"\xef\xbb\xbf").startswith(b"<?xml") else -1
+        if decl_end >= 0:
+            m = _DECL_ENCODING.search(data, 0, decl_end)
+            if m and m.group(1).lower() not in (b"utf-8", b"utf8"):
+                raise _Unsupported("encoding")
+
+        p = _Patcher(data)
+        root = p.next_tag(0)
+        if root.closing or root.self_closing or _PI.sub(b"", data[:root.start]).lstrip(b"\xef\xbb\xbf").strip():
+            raise _Unsupported("root")
+        root_scope = p.scope(root, {b"xml": XML_NS})
+        rdf = p.next_tag_after_space(root.end)
+        rdf_scope = p.scope(rdf, root_scope)
+        if rdf.closing or rdf.self_closing or p.resolve(rdf.name, rdf_scope) != (RDF_NS, b"RDF"):
+            raise _Unsupported("rdf:RDF is not the first child of the root")
+        desc = p.next_tag_after_space(rdf.end)
+        scope = p.scope(desc, rdf_scope)
+        if desc.closing or p.resolve(desc.name, scope) != (RDF_NS, b"Description"):
+            raise _Unsupported("rdf:Description is not the first child of rdf:RDF")
+
+        props: Dict[bytes, _Value] = {}
+        for m in _PROP_ATTR.finditer(data, desc.attrs_start, desc.attrs_end):
+            uri, local = p.resolve(m.group(1), scope, attribute=True)
+            if uri == XMP_NS and local in (b"Rating", b"Label"):
+                quoted = 2 if m.group(2) is not None else 3
+                props[local] = _Value(
+                    _decode(m.group(quoted)), m.start(quoted), m.end(quoted), b'"' if quoted == 2 else b"'"
+                )
+
+        first_child: Optional[int] = None
+        children_end = desc.end
+        subject = None
+        if not desc.self_closing:
+            pos = desc.end
+            while True:
+                tag = p.next_tag_after_space(pos)
+                if tag.closing:
+                    if tag.name != desc.name:
+                        raise _Unsupported("unbalanced rdf:Description")
+                    desc_close = tag
+                    break
+                if first_child is None:
+                    first_child = tag.start
+                child_scope = p.scope(tag, scope)
+                uri, local = p.resolve(tag.name, child_scope)
+                if uri == XMP_NS and local in (b"Rating", b"Label"):
+                    if local in props:
+                        raise _Unsupported(f"duplicate xmp:{local.decode()}")
+                    props[local], pos = p.text_value(tag)
+                elif uri == DC_NS and local == b"subject":
+                    if subject is not None:
+                        raise _Unsupported("duplicate dc:subject")
+                    subject, pos = _read_subject(p, tag, child_scope)
+                else:
+                    pos = p.skip_element(tag)
+                children_end = pos
+            # A second Description (or anything else) inside rdf:RDF is left to ElementTree
+            rdf_close = p.next_tag_after_space(desc_close.end)
+            if not rdf_close.closing or rdf_close.name != rdf.name:
+                raise _Unsupported("more than one rdf:Description")
+        else:
+            rdf_close = p.next_tag_after_space(desc.end)
+            if not rdf_close.closing or rdf_close.name != rdf.name:
+                raise _Unsupported("more than one rdf:Description")
+        root_close = p.next_tag_after_space(rdf_close.end)
+        if not root_close.closing or root_close.name != root.name:
+            raise _Unsupported("unexpected content after rdf:RDF")
+        if _PI.sub(b"", data[root_close.end:]).strip():
+            raise _Unsupported("trailing content")
+
+        self.p = p
+        self.desc = desc
+        self.desc_close = None if desc.self_closing else desc_close
+        self.scope = scope
+        self.props = props
+        self.first_child = first_child
+        self.children_end = children_end
+        self.subject = subject
+
+
+def read_xmp(data: bytes) -> Optional[Tuple[Optional[str], Optional[str], Optional[List[str]]]]:
+    """
+    (rating text, label, dc:subject keywords) of a sidecar, None for each
+    property that is absent; None when the layout is not supported here.
+    """
+    try:
+        layout = _Layout(data)
+    except _Unsupported:
+        return None
+    rating = layout.props.get(b"Rating")
+    label = layout.props.get(b"Label")
+    keywords = [text for text, *_ in layout.subject[1] if text] if layout.subject is not None else None
+    return (
+        rating.text if rating is not None else None,
+        label.text if label is not None else None,
+        keywords,
+    )
+
+
+def _patch(data: bytes, rating: Optional[int], label: Optional[str], keywords: Optional[List[str]]):
+    layout = _Layout(data)
+    p, desc, desc_close, scope = layout.p, layout.desc, layout.desc_close, layout.scope
+    props, first_child, children_end, subject = layout.props, layout.first_child, layout.children_end, layout.subject
+
+    edits: List[Tuple[int, int, bytes]] = []
+    additions: List[bytes] = []
+    changed = False
+
+    def set_value(value: _Value, text: str) -> None:
+        nonlocal changed
+        if value.text != text:
+            encoded = _encode_attr(text, value.quote) if value.quote else _encode_text(text)
+            edits.append((value.start, value.end, encoded))
+            changed = True
+
+    # New properties are indented like the existing first child
+    if first_child is not None and b"\n" in data[desc.end:first_child]:
+        child_indent = data[data.rfind(b"\n", desc.end, first_child):first_child]
+    else:
+        child_indent = b"\n" + p.line_indent(desc.start) + b" "
+
+    if rating is not None:
+        rating = max(0, min(5, rating))
+        if b"Rating" in props:
+            set_value(props[b"Rating"], str(rating))
+        elif rating != 0:
+            prefix, decl = _prefix_for(XMP_NS, b"xmp", scope)
+            additions.append(
+                child_indent + b"<" + prefix + b":Rating" + decl + b">" + str(rating).encode() + b"</" + prefix + b":Rating>"
+            )
+            changed = True
+
+    if label is not None:
+        if b"Label" in props:
+            set_value(props[b"Label"], label)
+        else:
+            prefix, decl = _prefix_for(XMP_NS, b"xmp", scope)
+            additions.append(
+                child_indent + b"<" + prefix + b":Label" + decl + b">" + _encode_text(label) + b"</" + prefix + b":Label>"
+            )
+            changed = True
+
+    if keywords is not None:
+        desired = {kw for kw in keywords if isinstance(kw, str) and kw.startswith("AI/")}
+        container = desc if subject is None else subject[0]
+        rdf_prefix = container.name.split(b":", 1)[0] + b":" if b":" in container.name else b""
+        li_open, li_close = b"<" + rdf_prefix + b"li>", b"</" + rdf_prefix + b"li>"
+        if subject is None:
+            prefix, decl = _prefix_for(DC_NS, b"dc", scope)
+            bag_indent = child_indent + b" "
+            lis = b"".join(bag_indent + b" " + li_open + _encode_text(kw) + li_close for kw in sorted(desired))
+            additions.append(
+                child_indent + b"<" + prefix + b":subject" + decl + b">"
+                + bag_indent + b"<" + rdf_prefix + b"Bag>" + lis + bag_indent + b"</" + rdf_prefix + b"Bag>"
+                + child_indent + b"</" + prefix + b":subject>"
+            )
+            changed = True
+        else:
+            bag, items, items_end, bag_close = subject
+            seen = set()
+            kept = set()
+            for text, ws_start, _start, end in items:
+                if not text or not text.startswith("AI/"):
+                    if text:
+                        kept.add(text)
+                    continue
+                if text in seen or text not in desired:
+                    edits.append((ws_start, end, b""))
+                    changed = True
+                else:
+                    seen.add(text)
+                    kept.add(text)
+            missing = sorted(desired - kept)
+            if missing:
+                if items:
+                    li_indent = data[items[0][1]:items[0][2]]
+                    if b"\n" not in li_indent:
+                        li_indent = b"\n" + p.line_indent(bag.start) + b" "
+                else:
+                    li_indent = b"\n" + p.line_indent(bag.start) + b" "
+                insert = b"".join(li_indent + li_open + _encode_text(kw) + li_close for kw in missing)
+                if not items and b"\n" not in data[bag.end:bag_close.start]:
+                    insert += b"\n" + p.line_indent(bag.start)
+                edits.append((items_end, items_end, insert))
+                changed = True
+
+    if additions:
+        block = b"".join(additions)
+        if desc.self_closing:
+            close = b"\n" + p.line_indent(desc.start) + b"</" + desc.name + b">"
+            edits.append((desc.end - 2, desc.end, b">" + block + close))
+        else:
+            if first_child is None and b"\n" not in data[desc.end:desc_close.start]:
+                block += b"\n" + p.line_indent(desc.start)
+            edits.append((children_end, children_end, block))
+
+    if not changed:
+        return data, False
+    edits.sort(key=lambda e: (e[0], e[1]))
+    out = []
+    pos = 0
+    for start, end, replacement in edits:
+        if start < pos:
+            raise _Unsupported("overlapping edits")
+        out.append(data[pos:start])
+        out.append(replacement)
+        pos = end
+    out.append(data[pos:])
+    return b"".join(out), True
+
+
+def _read_subject(p: _Patcher, subject: _Tag, scope: Dict[bytes, bytes]):
+    """(bag tag, [(li text, whitespace start, li start, li end)], end of last li, bag close tag), end."""
+    if subject.self_closing:
+        raise _Unsupported("empty dc:subject")
+    bag = p.next_tag_after_space(subject.end)
+    bag_scope = p.scope(bag, scope)
+    if bag.closing or bag.self_closing or p.resolve(bag.name, bag_scope) != (RDF_NS, b"Bag"):
+        raise _Unsupported("dc:subject without an rdf:Bag")
+    items = []
+    pos = bag.end
+    while True:
+        tag = p.next_tag_after_space(pos)
+        if tag.closing:
+            if tag.name != bag.name:
+                raise _Unsupported("unbalanced rdf:Bag")
+            bag_close = tag
+            break
+        if p.resolve(tag.name, p.scope(tag, bag_scope)) != (RDF_NS, b"li"):
+            raise _Unsupported("unexpected element in rdf:Bag")
+        if tag.self_closing:
+            items.append((None, pos, tag.start, tag.end))
+            pos = tag.end
+            continue
+        value, end = p.text_value(tag)
+        items.append((value.text, pos, tag.start, end))
+        pos = end
+    subject_close = p.next_tag_after_space(bag_close.end)
+    if not subject_close.closing or subject_close.name != subject.name:
+        raise _Unsupported("more than one container in dc:subject")
+    return (bag, items, pos, bag_close), subject_close.end
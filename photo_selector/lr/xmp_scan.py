@@ -0,0 +1,86 @@
+import logging
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+
+from photo_selector.config import default_config
+from photo_selector.io.io_scheduler import AdaptiveIoScheduler
+from photo_selector.io.xmp_index import SidecarState, XmpIndex, parse_rating
+from photo_selector.lr.xmp_manifest import sidecar_stat
+from photo_selector.lr.xmp_writer import XmpWriter, sidecar_path
+
+logger = logging.getLogger(__name__)
+
+# Index rows are written in transactions of this many sidecars
+_WRITE_BATCH = 500
+
+
+def _scan_task(task: Tuple[str, Optional[Tuple[int, int]]]) -> Tuple[str, Optional[SidecarState]]:
+    """("missing" | "unchanged" | "scanned" | "corrupt", new state) for one sidecar."""
+    xmp_path, known = task
+    stat = sidecar_stat(xmp_path)
+    if stat is None:
+        return "missing", None
+    if known == stat:
+        return "unchanged", None
+    try:
+        values = XmpWriter.read_xmp(xmp_path)
+    except OSError:
+        return "missing", None
+    if values is None:
+        return "corrupt", SidecarState(xmp_path, stat[0], stat[1], None, None, (), True)
+    rating, label, keywords = values
+    return "scanned", SidecarState(xmp_path, stat[0], stat[1], parse_rating(rating), label, tuple(keywords or ()))
+
+
+def scan_sidecars(
+    image_paths: List[str],
+    index: XmpIndex,
+    workers: int = 0,
+    rebuild: bool = False,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+) -> Dict:
+    """
+    Brings the index up to date for the sidecars (photo.xmp) of these
+    images: sidecars whose size / mtime match their row are not opened,
+    changed ones are read in parallel (AdaptiveIoScheduler, workers > 0
+    pins the concurrency), rows of deleted sidecars are dropped.
+    Returns counts per status, the scheduler's "io" stats and the index
+    "summary" of these sidecars.
+    """
+    xmp_paths = sorted({os.path.abspath(sidecar_path(p)) for p in image_paths})
+    known = {} if rebuild else index.stats_many(xmp_paths)
+    if workers > 0:
+        scheduler = AdaptiveIoScheduler(initial=workers, max_concurrency=workers, adaptive=False)
+    else:
+        scheduler = AdaptiveIoScheduler(
+            min_concurrency=default_config.XMP_IO_MIN_CONCURRENCY,
+            max_concurrency=default_config.XMP_IO_MAX_CONCURRENCY,
+        )
+
+    counts = {"scanned": 0, "unchanged": 0, "missing": 0, "corrupt": 0}
+    updates: List[SidecarState] = []
+    removed: List[str] = []
+    total = len(xmp_paths)
+    done = 0
+    for (xmp_path, _), (status, state) in scheduler.map(_scan_task, [(p, known.get(p)) for p in xmp_paths]):
+        counts[status] += 1
+        if state is not None:
+            updates.append(state)
+        elif status == "missing" and xmp_path in known:
+            removed.append(xmp_path)
+        if len(updates) >= _WRITE_BATCH:
+            index.put_many(updates)
+            updates = []
+        done += 1
+        if progress_callback and (done % 200 == 0 or done == total):
+            progress_callback(done, total)
+    index.put_many(updates)
+    index.delete_many(removed)
+
+    io_stats = scheduler.stats()
+    logger.info(
+        f"Sidecar scan: {counts['scanned']} read, {counts['unchanged']} unchanged, "
+        f"{counts['missing']} missing, {counts['corrupt']} corrupt "
+        f"({io_stats['throughput_per_s']} files/s)"
+    )
+    return {**counts, "io": io_stats, "summary": index.summary(xmp_paths)}
@@ -1,9 +1,11 @@
 
 import os
 import xml.etree.ElementTree as ET
-from typing import List, Optional
+from typing import List, Optional, Tuple
 import logging
 
+from photo_selector.lr.xmp_patch import patch_xmp, read_xmp
+
 logger = logging.getLogger(__name__)
 
 # Register namespaces to avoid ns0 prefixes
@@ -29,7 +31,44 @@ TEMPLATE = """<x:xmpmeta xmlns:x="adobe:ns:meta/" x:xmptk="Adobe XMP Core 5.6-c1
  </rdf:RDF>
 </x:xmpmeta>"""
 
+NEW_SIDECAR = b"<?xml version='1.0' encoding='utf-8'?>\n" + TEMPLATE.encode("utf-8")
+
+
+def sidecar_path(image_path: str) -> str:
+    """The sidecar Stage 2 writes for an image: photo.jpg -> photo.xmp."""
+    base, _ext = os.path.splitext(image_path)
+    return f"{base}.xmp"
+
 class XmpWriter:
+    @staticmethod
+    def read_xmp(xmp_path: str) -> Optional[Tuple[Optional[str], Optional[str], Optional[List[str]]]]:
+        """
+        (rating text, label, dc:subject keywords) of an existing sidecar, each
+        None when absent; None if the sidecar does not parse. Raises OSError
+        if it cannot be read.
+        """
+        with open(xmp_path, "rb") as f:
+            data = f.read()
+        values = read_xmp(data)
+        if values is not None:
+            return values
+        try:
+            root = ET.fromstring(data)
+        except ET.ParseError:
+            return None
+        rdf = root.find(f"{{{NS_MAP['rdf']}}}RDF")
+        desc = rdf.find(f"{{{NS_MAP['rdf']}}}Description") if rdf is not None else None
+        if desc is None:
+            return None, None, None
+        found = []
+        for name in ("Rating", "Label"):
+            tag = f"{{{NS_MAP['xmp']}}}{name}"
+            elem = desc.find(tag)
+            found.append((elem.text or "") if elem is not None else desc.get(tag))
+        bag = desc.find(f"{{{NS_MAP['dc']}}}subject/{{{NS_MAP['rdf']}}}Bag")
+        keywords = [li.text for li in bag.findall(f"{{{NS_MAP['rdf']}}}li") if li.text] if bag is not None else None
+        return found[0], found[1], keywords
+
     @staticmethod
     def update_xmp(
         xmp_path: str, 
@@ -40,18 +79,66 @@ class XmpWriter:
         """
         Updates XMP sidecar. Returns True if file was written (changed), False otherwise.
         """
+        return bool(XmpWriter.sync_xmp(xmp_path, rating, label, keywords))
+
+    @staticmethod
+    def sync_xmp(
+        xmp_path: str,
+        rating: Optional[int] = None,
+        label: Optional[str] = None,
+        keywords: Optional[List[str]] = None
+    ) -> Optional[bool]:
+        """
+        Like update_xmp, but tells "already up to date" (False) apart from
+        failures (None: corrupt sidecar or write error).
+        """
         # 1. Read or Create
         if os.path.exists(xmp_path):
             try:
-                tree = ET.parse(xmp_path)
-                root = tree.getroot()
-            except ET.ParseError:
-                logger.error(f"Corrupt XMP: {xmp_path}, skipping update to avoid data loss.")
-                return False
+                with open(xmp_path, "rb") as f:
+                    data = f.read()
+            except OSError as e:
+                logger.error(f"Failed to read XMP {xmp_path}: {e}")
+                return None
         else:
-            # Create new
-            root = ET.fromstring(TEMPLATE)
-            tree = ET.ElementTree(root)
+            data = NEW_SIDECAR
+
+        # Typical sidecars are patched in place; other layouts go through ElementTree
+        patched = patch_xmp(data, rating, label, keywords)
+        if patched is None:
+            patched = XmpWriter.patch_tree(data, rating, label, keywords)
+            if patched is None:
+                logger.error(f"Corrupt XMP: {xmp_path}, skipping update to avoid data loss.")
+                return None
+        out, changed = patched
+
+        # Write if changed
+        if changed:
+            try:
+                with open(xmp_path, "wb") as f:
+                    f.write(out)
+                return True
+            except Exception as e:
+                logger.error(f"Failed to write XMP {xmp_path}: {e}")
+                return None
+
+        return False
+
+    @staticmethod
+    def patch_tree(
+        data: bytes,
+        rating: Optional[int] = None,
+        label: Optional[str] = None,
+        keywords: Optional[List[str]] = None
+    ) -> Optional[Tuple[bytes, bool]]:
+        """
+        ElementTree version of the update: (serialized sidecar, changed), or
+        None if data does not parse.
+        """
+        try:
+            root = ET.fromstring(data)
+        except ET.ParseError:
+            return None
 
         # 2. Find Description node
         # It's usually under rdf:RDF -> rdf:Description
@@ -78,6 +165,11 @@ class XmpWriter:
                 if curr_rating.text != str(rating):
                     curr_rating.text = str(rating)
                     changed = True
+            elif desc.get(rating_tag) is not None:
+                # Lightroom writes simple properties as attributes of the Description
+                if desc.get(rating_tag) != str(rating):
+                    desc.set(rating_tag, str(rating))
+                    changed = True
             else:
                 if rating != 0: # Only write if non-zero? Or always write?
                     # LR treats missing as 0 usually.
@@ -96,6 +188,10 @@ class XmpWriter:
                 if curr_label.text != label:
                     curr_label.text = label
                     changed = True
+            elif desc.get(label_tag) is not None:
+                if desc.get(label_tag) != label:
+                    desc.set(label_tag, label)
+                    changed = True
             else:
                 elem = ET.SubElement(desc, label_tag)
                 elem.text = label
@@ -144,13 +240,6 @@ class XmpWriter:
                     li.text = kw
                     changed = True
 
-        # 6. Write if changed
-        if changed:
-            try:
-                tree.write(xmp_path, encoding='utf-8', xml_declaration=True)
-                return True
-            except Exception as e:
-                logger.error(f"Failed to write XMP {xmp_path}: {e}")
-                return False
-        
-        return False
+        if not changed:
+            return data, False
+        return ET.tostring(root, encoding='utf-8', xml_declaration=True), True
@@ -10,8 +10,6 @@ import argparse
 import logging
 import multiprocessing
 from photo_selector.config import default_config
-from photo_selector.pipeline.stage1_metrics import run_stage1
-from photo_selector.pipeline.stage2_xmp import run_stage2, load_results_from_csv
 
 # Setup logging
 logging.basicConfig(
@@ -33,7 +31,8 @@ def main():
     # Workers
     default_workers = min(os.cpu_count() or 4, 8)
     parser.add_argument("--workers", type=int, default=default_workers, help=f"Stage 1 Workers (default: {default_workers})")
-    parser.add_argument("--xmp-workers", type=int, default=4, help="Stage 2 XMP Workers (default: 4)")
+    parser.add_argument("--xmp-workers", type=int, default=0, help="Stage 2 XMP Workers (default: 0 = adapt to storage latency)")
+    parser.add_argument("--xmp-processes", action="store_true", help="Run Stage 2 XMP Workers as processes instead of threads")
     
     # Config overrides
     parser.add_argument("--max-long-edge", type=int, default=1024, help="Downsampling size (default: 1024)")
@@ -64,7 +63,9 @@ def main():
     os.makedirs(output_dir, exist_ok=True)
     output_csv = os.path.join(output_dir, "results.csv")
     
-    # Stage 1
+    # Stage 1 (imported only after argument parsing so `--help` stays fast)
+    from photo_selector.pipeline.stage1_metrics import run_stage1
+
     logger.info("=== Stage 1: Metrics Calculation ===")
     results = run_stage1(
         input_dir=input_dir,
@@ -75,6 +76,9 @@ def main():
     
     # Stage 2
     if args.write_xmp:
+        from photo_selector.lr.xmp_manifest import MANIFEST_FILENAME
+        from photo_selector.pipeline.stage2_xmp import run_stage2, load_results_from_csv
+
         logger.info("=== Stage 2: XMP Writing ===")
         # If results is empty (e.g. from cache logic variation or if we want to support independent run),
         # we could reload from CSV. But run_stage1 returns all results (cached or new).
@@ -82,7 +86,12 @@ def main():
              # Fallback if for some reason we didn't get results passed (unlikely with current logic)
              results = load_results_from_csv(output_csv)
              
-        run_stage2(results, workers=args.xmp_workers)
+        run_stage2(
+            results,
+            workers=args.xmp_workers,
+            manifest_path=os.path.join(output_dir, MANIFEST_FILENAME),
+            processes=args.xmp_processes,
+        )
         
         print("\n" + "="*60)
         print("IMPORTANT: To see changes in Lightroom:")
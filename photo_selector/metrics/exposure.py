@@ -32,42 +32,54 @@ def score_exposure_from_stats(p50: int, white_ratio: float, black_ratio: float,
 
     return float(max(0.0, score)), flags
 
-def compute_exposure(img: np.ndarray) -> ExposureResult:
+def _empty_exposure() -> ExposureResult:
+    return ExposureResult(
+        score=0.0,
+        p1=0, p5=0, p50=0, p95=0, p99=0,
+        white_ratio=0.0, black_ratio=0.0,
+        dynamic_range=0,
+        flags=["error_empty_image"]
+    )
+
+def histogram_percentiles(hist: np.ndarray, qs) -> np.ndarray:
     """
-    基于亮度计算曝光指标。
+    从 256 级直方图计算百分位数，与对像素排序后的 np.percentile（线性插值）结果一致，
+    但不需要排序约一百万个像素。
     """
-    if img is None or img.size == 0:
-        return ExposureResult(
-            score=0.0,
-            p1=0, p5=0, p50=0, p95=0, p99=0,
-            white_ratio=0.0, black_ratio=0.0,
-            dynamic_range=0,
-            flags=["error_empty_image"]
-        )
+    cum = np.cumsum(hist, dtype=np.int64)
+    n = int(cum[-1])
+    pos = (n - 1) * (np.asarray(qs, dtype=np.float64) / 100.0)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.minimum(lo + 1, n - 1)
+    frac = pos - lo
+    # 第 i 个（从 0 开始）排序后像素的值 = 第一个累计计数 > i 的灰度级
+    v_lo = np.searchsorted(cum, lo, side="right")
+    v_hi = np.searchsorted(cum, hi, side="right")
+    return v_lo + frac * (v_hi - v_lo)
+
+def exposure_from_histogram(hist: np.ndarray) -> ExposureResult:
+    """
+    基于 256 级亮度直方图计算曝光指标。缓存中保存了直方图，
+    因此调整曝光规则（阈值、裁剪级别）后可以直接从缓存重新计算，无需重新解码图像。
+    """
+    hist = np.asarray(hist).reshape(-1)
+    total = float(hist.sum())
+    if hist.shape[0] != 256 or total <= 0:
+        return _empty_exposure()
 
-    if len(img.shape) == 3:
-        # 转换为 LAB L 通道以获得更好的亮度感知，或者直接使用标准灰度图
-        # 灰度图处理更快，通常对于曝光检查已经足够
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    else:
-        gray = img
-        
     # 百分位数
-    p1, p5, p50, p95, p99 = np.percentile(gray, [1, 5, 50, 95, 99])
-    
-    # 比率
+    p1, p5, p50, p95, p99 = histogram_percentiles(hist, [1, 5, 50, 95, 99])
+
+    # 比率：直接取直方图两端的计数
     # 过曝像素（接近 255）
-    white_mask = gray >= 250
-    white_ratio = np.mean(white_mask)
-    
+    white_ratio = float(hist[int(default_config.EXPOSURE_WHITE_LEVEL):].sum()) / total
     # 欠曝像素（接近 0）
-    black_mask = gray <= 5
-    black_ratio = np.mean(black_mask)
-    
+    black_ratio = float(hist[: int(default_config.EXPOSURE_BLACK_LEVEL) + 1].sum()) / total
+
     dynamic_range = p99 - p1
-    
+
     score, flags = score_exposure_from_stats(int(p50), float(white_ratio), float(black_ratio), int(dynamic_range))
-        
+
     return ExposureResult(
         score=score,
         p1=int(p1),
@@ -78,5 +90,23 @@ def compute_exposure(img: np.ndarray) -> ExposureResult:
         white_ratio=float(white_ratio),
         black_ratio=float(black_ratio),
         dynamic_range=int(dynamic_range),
-        flags=flags
+        flags=flags,
+        histogram=hist.astype(np.uint32),
     )
+
+def compute_exposure(img: np.ndarray) -> ExposureResult:
+    """
+    基于亮度计算曝光指标（单次 cv2.calcHist，而不是对全部像素排序）。
+    """
+    if img is None or img.size == 0:
+        return _empty_exposure()
+
+    if len(img.shape) == 3:
+        # 转换为 LAB L 通道以获得更好的亮度感知，或者直接使用标准灰度图
+        # 灰度图处理更快，通常对于曝光检查已经足够
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    else:
+        gray = img
+
+    hist = cv2.calcHist([gray], [0], None, [256], [0, 256]).reshape(-1)
+    return exposure_from_histogram(hist.astype(np.int64))
@@ -1,21 +1,85 @@
-
 import cv2
 import numpy as np
+from typing import Optional
 from photo_selector.pipeline.models import SharpnessResult
 from photo_selector.config import default_config
 
-def compute_sharpness(img: np.ndarray) -> SharpnessResult:
+# 重叠块以 1/4 块为粒度对齐
+_OVERLAP_SUBDIV = 4
+
+def laplacian_block_variances(
+    gray: np.ndarray,
+    rows: int = 4,
+    cols: int = 4,
+    overlap: float = 0.0,
+) -> np.ndarray:
+    """
+    对整幅图只做一次 float32 拉普拉斯，然后向量化地求每个块的方差，返回 rows x cols 的分数图。
+    先把拉普拉斯图及其平方按小格 reshape 求和，再在小格网格上做积分图，
+    因此重叠块（每侧扩展 overlap/2 个块长）与普通网格的代价相同。
+    与逐块计算一致，无法整除的边缘像素被忽略。
+    """
+    sub = _OVERLAP_SUBDIV if overlap > 0 else 1
+    fine_rows = rows * sub
+    fine_cols = cols * sub
+    h, w = gray.shape[:2]
+    cell_h = h // fine_rows
+    cell_w = w // fine_cols
+    if cell_h == 0 or cell_w == 0:
+        return np.zeros((0, 0), dtype=np.float64)
+
+    laplacian = cv2.Laplacian(gray, cv2.CV_32F)
+    lap = laplacian[: fine_rows * cell_h, : fine_cols * cell_w].reshape(fine_rows, cell_h, fine_cols, cell_w)
+    # 先沿行方向（连续内存）求和再沿列方向，比一次 axis=(1, 3) 快且与格子数量无关
+    sums = lap.sum(axis=1).sum(axis=2, dtype=np.float64)
+    sq_sums = np.square(lap).sum(axis=1).sum(axis=2, dtype=np.float64)
+    cell_area = float(cell_h * cell_w)
+
+    if sub == 1:
+        mean = sums / cell_area
+        return np.maximum(sq_sums / cell_area - mean * mean, 0.0)
+
+    # 小格网格上的积分图
+    def integral(t):
+        out = np.zeros((t.shape[0] + 1, t.shape[1] + 1), dtype=np.float64)
+        out[1:, 1:] = t.cumsum(axis=0).cumsum(axis=1)
+        return out
+
+    pad = int(round(overlap / 2 * sub))
+    y0 = np.maximum(np.arange(rows) * sub - pad, 0)
+    y1 = np.minimum((np.arange(rows) + 1) * sub + pad, fine_rows)
+    x0 = np.maximum(np.arange(cols) * sub - pad, 0)
+    x1 = np.minimum((np.arange(cols) + 1) * sub + pad, fine_cols)
+
+    def box(table):
+        return (
+            table[np.ix_(y1, x1)] - table[np.ix_(y0, x1)]
+            - table[np.ix_(y1, x0)] + table[np.ix_(y0, x0)]
+        )
+
+    area = np.outer(y1 - y0, x1 - x0) * cell_area
+    mean = box(integral(sums)) / area
+    return np.maximum(box(integral(sq_sums)) / area - mean * mean, 0.0)
+
+def compute_sharpness(
+    img: np.ndarray,
+    rows: Optional[int] = None,
+    cols: Optional[int] = None,
+    overlap: Optional[float] = None,
+    top_fraction: Optional[float] = None,
+) -> SharpnessResult:
     """
     使用基于网格的拉普拉斯方差方法计算清晰度。
     通过关注最清晰的区域（前 K 个块）而不是全局平均值，该方法对散景/浅景深具有鲁棒性。
-    
+    网格参数默认取自配置（4x4、不重叠、前 25%），结果中附带块分数图 block_map。
+
     输入图像应为 BGR（将转换为灰度）或灰度图。
     """
     if len(img.shape) == 3:
         gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     else:
         gray = img
-        
+
     # 如果图像过大则进行缩放，以提高速度并降低高 ISO 噪点敏感度
     # 保持纵横比对于方差计算并非严格必要，但为了简单起见，我们保持纵横比。如果调整为固定宽度，阈值会更稳定。
     target_width = 1024
@@ -24,60 +88,32 @@ def compute_sharpness(img: np.ndarray) -> SharpnessResult:
         scale = target_width / w
         new_h = int(h * scale)
         gray = cv2.resize(gray, (target_width, new_h), interpolation=cv2.INTER_AREA)
-        
-    h, w = gray.shape
-    
+
     # 网格参数
-    rows = 4
-    cols = 4
-    
-    # 计算块尺寸
-    # 我们使用简单的滑动窗口或固定网格。固定网格更快。
-    step_h = h // rows
-    step_w = w // cols
-    
-    block_scores = []
-    
-    for r in range(rows):
-        for c in range(cols):
-            # 提取感兴趣区域 (ROI)
-            y_start = r * step_h
-            y_end = (r + 1) * step_h
-            x_start = c * step_w
-            x_end = (c + 1) * step_w
-            
-            roi = gray[y_start:y_end, x_start:x_end]
-            
-            # 跳过空或非常小的 ROI（边缘情况）
-            if roi.size == 0:
-                continue
-                
-            # 计算该块的拉普拉斯方差
-            # 需要使用 cv2.CV_64F 以避免上溢/下溢
-            laplacian = cv2.Laplacian(roi, cv2.CV_64F)
-            score = laplacian.var()
-            block_scores.append(score)
-            
-    if not block_scores:
-        return SharpnessResult(score=0.0, is_blurry=True)
-        
-    # 按降序对分数进行排序
-    block_scores.sort(reverse=True)
-    
+    rows = max(1, int(rows or default_config.SHARPNESS_GRID_ROWS))
+    cols = max(1, int(cols or default_config.SHARPNESS_GRID_COLS))
+    overlap = float(default_config.SHARPNESS_TILE_OVERLAP if overlap is None else overlap)
+    top_fraction = float(default_config.SHARPNESS_TOP_FRACTION if top_fraction is None else top_fraction)
+
+    block_map = laplacian_block_variances(gray, rows, cols, overlap)
+    if block_map.size == 0:
+        return SharpnessResult(score=0.0, is_blurry=True, block_map=block_map)
+
     # 策略：取前 K 个块
-    # 例如，如果有 16 个块，可能取前 4 个（图像的 25%）
+    # 例如，如果有 16 个块，取前 4 个（图像的 25%）
     # 这假设图像中至少有 25% 的区域应该聚焦清晰
     # 对于人像摄影，这通常是正确的（脸/眼睛）。
-    top_k = 4
-    valid_scores = block_scores[:top_k]
-    
+    flat = block_map.ravel()
+    top_k = min(flat.size, max(1, int(round(flat.size * top_fraction))))
+    valid_scores = np.partition(flat, flat.size - top_k)[flat.size - top_k:]
+
     # 最终得分是前 K 个块的平均值
     # 这可以防止单个噪点块歪曲结果（如使用最大值时），同时忽略模糊的背景（如使用平均值时）。
     final_score = float(np.mean(valid_scores))
-    
+
     # 配置中的阈值可能需要调整，因为块方差可能高于全局方差。
     # 但是，由于我们将宽度调整为 1024，方差值与全分辨率相比会下降。
     # 我们假设用户会在配置中调整阈值。
     is_blurry = bool(final_score < default_config.SHARPNESS_THRESHOLD)
-    
-    return SharpnessResult(score=final_score, is_blurry=is_blurry)
+
+    return SharpnessResult(score=final_score, is_blurry=is_blurry, block_map=block_map)
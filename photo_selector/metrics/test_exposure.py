@@ -0,0 +1,45 @@
+import os
+import sys
+
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from photo_selector.config import default_config  # noqa: E402
+from photo_selector.metrics.exposure import compute_exposure, exposure_from_histogram  # noqa: E402
+
+
+def test_histogram_percentiles_match_numpy():
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        h, w = rng.integers(1, 200, 2)
+        gray = np.clip(rng.normal(rng.uniform(0, 255), rng.uniform(1, 100), (h, w)), 0, 255).astype(np.uint8)
+        res = compute_exposure(gray)
+        p1, p5, p50, p95, p99 = np.percentile(gray, [1, 5, 50, 95, 99])
+        assert (res.p1, res.p5, res.p50, res.p95, res.p99) == (int(p1), int(p5), int(p50), int(p95), int(p99))
+        assert res.white_ratio == float(np.mean(gray >= 250))
+        assert res.black_ratio == float(np.mean(gray <= 5))
+        assert res.dynamic_range == int(p99 - p1)
+
+
+def test_rules_reevaluate_from_histogram():
+    gray = np.full((10, 10), 240, dtype=np.uint8)
+    res = compute_exposure(gray)
+    assert res.white_ratio == 0.0
+
+    old = default_config.EXPOSURE_WHITE_LEVEL
+    default_config.EXPOSURE_WHITE_LEVEL = 230
+    try:
+        again = exposure_from_histogram(res.histogram)
+    finally:
+        default_config.EXPOSURE_WHITE_LEVEL = old
+    assert again.white_ratio == 1.0
+    assert "highlight_clipping" in again.flags
+
+
+if __name__ == "__main__":
+    test_histogram_percentiles_match_numpy()
+    test_rules_reevaluate_from_histogram()
+    print("ok")
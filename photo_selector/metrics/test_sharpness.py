@@ -0,0 +1,51 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from photo_selector.metrics.sharpness import compute_sharpness, laplacian_block_variances  # noqa: E402
+
+
+def _gray():
+    rng = np.random.default_rng(0)
+    img = (rng.random((300, 400)) * 255).astype(np.uint8)
+    # Left half blurry, right half sharp
+    img[:, :200] = cv2.GaussianBlur(img[:, :200], (15, 15), 0)
+    return img
+
+
+def test_block_map_matches_per_block_variance():
+    gray = _gray()
+    lap = cv2.Laplacian(gray, cv2.CV_32F).astype(np.float64)
+    m = laplacian_block_variances(gray, rows=4, cols=4)
+    assert m.shape == (4, 4)
+    sh, sw = 300 // 4, 400 // 4
+    for r in range(4):
+        for c in range(4):
+            expected = lap[r * sh:(r + 1) * sh, c * sw:(c + 1) * sw].var()
+            assert abs(m[r, c] - expected) <= 1e-3 * expected + 1e-6
+
+    # Overlapping tiles: block (1, 1) grown by a quarter block on each side
+    mo = laplacian_block_variances(gray, rows=4, cols=4, overlap=0.5)
+    ch, cw = 300 // 16, 400 // 16
+    expected = lap[3 * ch:9 * ch, 3 * cw:9 * cw].var()
+    assert abs(mo[1, 1] - expected) <= 1e-3 * expected + 1e-6
+
+
+def test_top_k_uses_sharp_blocks():
+    res = compute_sharpness(_gray(), rows=8, cols=8)
+    assert res.block_map.shape == (8, 8)
+    # The sharp right half dominates the top 25%
+    assert res.score >= float(np.median(res.block_map))
+    assert res.block_map[:, 4:].mean() > res.block_map[:, :4].mean()
+
+
+if __name__ == "__main__":
+    test_block_map_matches_per_block_variance()
+    test_top_k_uses_sharp_blocks()
+    print("ok")
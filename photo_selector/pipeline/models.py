@@ -6,6 +6,8 @@ from typing import List, Dict, Any, Optional
 class SharpnessResult:
     score: float
     is_blurry: bool
+    # Per-block Laplacian variance (rows x cols), only set right after computation
+    block_map: Optional[Any] = field(default=None, repr=False, compare=False)
 
 @dataclass
 class ExposureResult:
@@ -19,6 +21,8 @@ class ExposureResult:
     black_ratio: float
     dynamic_range: int
     flags: List[str] = field(default_factory=list)
+    # 256-bin luminance histogram, persisted in the metrics cache (not in results)
+    histogram: Optional[Any] = field(default=None, repr=False, compare=False)
 
 @dataclass
 class MetricsResult:
@@ -119,6 +123,7 @@ class MetricsResult:
                 white_ratio=float(data.get("white_ratio", 0)),
                 black_ratio=float(data.get("black_ratio", 0)),
                 dynamic_range=int(data.get("dynamic_range", 0)),
-                flags=data.get("exposure_flags", "").split(";") if data.get("exposure_flags") else []
+                flags=data.get("exposure_flags", "").split(";") if data.get("exposure_flags") else [],
+                histogram=data.get("exp_histogram"),
             )
         return res
@@ -4,16 +4,19 @@ import glob
 import logging
 import time
 import concurrent.futures
-from typing import List, Tuple, Dict, Any
+import numpy as np
+from typing import Iterator, List, Tuple, Dict, Any, Optional
 
 from photo_selector.config import default_config
 from photo_selector.pipeline.models import MetricsResult, SharpnessResult, ExposureResult
-from photo_selector.io.image_reader import read_and_resize
+from photo_selector.io.image_reader import read_and_resize, read_image_bytes, decode_and_resize, resize_long_edge, tally_decode_factor, to_gray
 from photo_selector.metrics.sharpness import compute_sharpness
-from photo_selector.metrics.exposure import compute_exposure, score_exposure_from_stats
+from photo_selector.metrics.exposure import compute_exposure, exposure_from_histogram, score_exposure_from_stats
 from photo_selector.io.cache_sqlite import CacheSQLite
+from photo_selector.io.content_key import content_keys_enabled, content_memo, metrics_cache_path
 from photo_selector.io.results_writer import write_results
-from photo_selector.io.photo_time import get_capture_timestamp
+from photo_selector.io.photo_time import get_capture_timestamp, get_capture_timestamp_from_bytes
+from photo_selector.io.embedding_store import EmbeddingStore
 
 logger = logging.getLogger(__name__)
 
@@ -56,14 +59,18 @@ def rescore_cached_result(res: MetricsResult) -> MetricsResult:
         res.sharpness.is_blurry = bool(res.sharpness.score < default_config.SHARPNESS_THRESHOLD)
 
     if res.exposure:
-        score, flags = score_exposure_from_stats(
-            int(res.exposure.p50),
-            float(res.exposure.white_ratio),
-            float(res.exposure.black_ratio),
-            int(res.exposure.dynamic_range),
-        )
-        res.exposure.score = score
-        res.exposure.flags = flags
+        if res.exposure.histogram is not None:
+            # 有直方图时按当前规则完整重算（包括裁剪级别），无需重新解码
+            res.exposure = exposure_from_histogram(res.exposure.histogram)
+        else:
+            score, flags = score_exposure_from_stats(
+                int(res.exposure.p50),
+                float(res.exposure.white_ratio),
+                float(res.exposure.black_ratio),
+                int(res.exposure.dynamic_range),
+            )
+            res.exposure.score = score
+            res.exposure.flags = flags
 
     if res.sharpness and res.exposure:
         final_score, is_unusable, reasons = score_result(res.sharpness, res.exposure)
@@ -77,40 +84,125 @@ def rescore_cached_result(res: MetricsResult) -> MetricsResult:
 
     return res
 
-def process_image(file_path: str) -> MetricsResult:
+def _metrics_from_image(file_path: str, img, capture_ts: float) -> MetricsResult:
+    if img is None:
+        return MetricsResult(
+            filename=file_path, 
+            capture_ts=capture_ts,
+            is_unusable=True, 
+            reasons=["Read Error"]
+        )
+        
+    # 2. 计算指标：两个指标都只需要灰度图，只转换一次
+    gray = to_gray(img)
+    sharpness_res = compute_sharpness(gray)
+    exposure_res = compute_exposure(gray)
+
+    final_score, is_unusable, reasons = score_result(sharpness_res, exposure_res)
+
+    return MetricsResult(
+        filename=file_path,
+        sharpness=sharpness_res,
+        exposure=exposure_res,
+        capture_ts=capture_ts,
+        technical_score=final_score,
+        is_unusable=is_unusable,
+        reasons=reasons
+    )
+
+def measurement_params(luma_only: bool) -> str:
+    """
+    缓存签名中除尺寸外影响测量值的设置：清晰度网格、重叠、取样比例以及解码方式
+    （只解码亮度平面与彩色解码后转灰度的结果略有不同）。
+    评分权重等只在命中后重新计算的设置不包含在内。
+    """
+    c = default_config
+    return (
+        f"grid{c.SHARPNESS_GRID_ROWS}x{c.SHARPNESS_GRID_COLS}"
+        f"|ov{float(c.SHARPNESS_TILE_OVERLAP):g}|top{float(c.SHARPNESS_TOP_FRACTION):g}"
+        f"|{'luma' if luma_only else 'bgr'}"
+    )
+
+def process_image(
+    file_path: str,
+    long_edge: Optional[int] = None,
+    luma_only: Optional[bool] = None,
+    decode_factors: Optional[Dict[int, int]] = None,
+) -> MetricsResult:
     """
     处理单张图像的工作函数。
     必须是顶层函数以便进行 pickle 序列化。
+    luma_only 时只解码亮度平面，跳过色度上采样和颜色转换。
+    decode_factors 非空时累计本次解码选用的降采样倍数。
     """
+    if luma_only is None:
+        luma_only = default_config.LUMA_ONLY_DECODE
     try:
         capture_ts = get_capture_timestamp(file_path, source="auto")
         # 1. 读取图像（降采样）
-        img = read_and_resize(file_path, default_config.DEFAULT_LONG_EDGE)
+        stats: dict = {}
+        img = read_and_resize(
+            file_path, long_edge or default_config.DEFAULT_LONG_EDGE, stats=stats, grayscale=bool(luma_only)
+        )
+        if decode_factors is not None:
+            tally_decode_factor(decode_factors, stats)
+        return _metrics_from_image(file_path, img, capture_ts)
         
-        if img is None:
-            return MetricsResult(
-                filename=file_path, 
-                capture_ts=capture_ts,
-                is_unusable=True, 
-                reasons=["Read Error"]
-            )
-            
-        # 2. 计算指标
-        sharpness_res = compute_sharpness(img)
-        exposure_res = compute_exposure(img)
-
-        final_score, is_unusable, reasons = score_result(sharpness_res, exposure_res)
-
+    except Exception as e:
+        logger.error(f"Error processing {file_path}: {e}")
         return MetricsResult(
             filename=file_path,
-            sharpness=sharpness_res,
-            exposure=exposure_res,
-            capture_ts=capture_ts,
-            technical_score=final_score,
-            is_unusable=is_unusable,
-            reasons=reasons
+            capture_ts=get_capture_timestamp(file_path, source="auto"),
+            is_unusable=True,
+            reasons=[f"Exception: {str(e)}"]
         )
-        
+
+def analyze_image(
+    file_path: str,
+    long_edge: int,
+    embed_model: str,
+    thumb_long_edge: int,
+    decode_factors: Optional[Dict[int, int]] = None,
+) -> Tuple[MetricsResult, Optional[Tuple[str, Any]]]:
+    """
+    融合分析：文件只读取、解码一次，同时产出指标、EXIF 拍摄时间和分组用的缩略图。
+    返回 (MetricsResult, payload)，payload 为：
+      - ("vec", bytes)：cv2_hist / phash / dhash 等内置模型直接在 worker 中算出的 embedding
+      - ("thumb", ndarray)：torch 模型所需的 BGR 缩略图，由主进程批量推理
+      - None：读取失败
+    decode_factors 与 process_image 相同。
+    """
+    counts: Dict[int, int] = {} if decode_factors is None else decode_factors
+
+    def decode(buf, target: int):
+        stats: dict = {}
+        img = decode_and_resize(buf, target, path=file_path, stats=stats)
+        tally_decode_factor(counts, stats)
+        return img
+
+    # 分组模块只在融合模式下才需要，延迟导入以免拖慢其他命令的启动
+    from photo_selector.similarity.grouping import builtin_embedding, is_builtin_model
+
+    try:
+        buf = read_image_bytes(file_path)
+        capture_ts = get_capture_timestamp_from_bytes(buf, file_path, source="auto")
+        img = decode(buf, long_edge) if buf is not None else None
+        res = _metrics_from_image(file_path, img, capture_ts)
+        if img is None:
+            return res, None
+
+        if thumb_long_edge > long_edge:
+            # 缩略图比指标图还大时只能再解码一次（仍然复用已读入的字节）
+            thumb = decode(buf, thumb_long_edge)
+        else:
+            thumb = resize_long_edge(img, thumb_long_edge)
+        if thumb is None:
+            return res, None
+
+        if is_builtin_model(embed_model):
+            return res, ("vec", builtin_embedding(thumb, embed_model).tobytes())
+        return res, ("thumb", thumb)
+
     except Exception as e:
         logger.error(f"Error processing {file_path}: {e}")
         return MetricsResult(
@@ -118,26 +210,127 @@ def process_image(file_path: str) -> MetricsResult:
             capture_ts=get_capture_timestamp(file_path, source="auto"),
             is_unusable=True,
             reasons=[f"Exception: {str(e)}"]
+        ), None
+
+def _cache_record(res: MetricsResult) -> Dict[str, Any]:
+    """写入指标缓存的数据：结果字段加上亮度直方图（不写入 results.csv/json）。"""
+    data = res.to_dict()
+    if res.exposure is not None and res.exposure.histogram is not None:
+        data["exp_histogram"] = res.exposure.histogram
+    return data
+
+def pack_result(res: MetricsResult) -> tuple:
+    """
+    将 worker 的测量值压缩为元组，减少 IPC 的 pickle 开销。
+    分数、标记等由主进程通过 rescore_cached_result 重新计算，因此只需原始测量值。
+    """
+    sh = res.sharpness
+    ex = res.exposure
+    if sh is None or ex is None:
+        return (res.filename, float(res.capture_ts or 0.0), ";".join(res.reasons))
+    return (
+        res.filename,
+        float(res.capture_ts or 0.0),
+        float(sh.score),
+        int(ex.p1), int(ex.p5), int(ex.p50), int(ex.p95), int(ex.p99),
+        float(ex.white_ratio),
+        float(ex.black_ratio),
+        int(ex.dynamic_range),
+        np.asarray(ex.histogram, dtype=np.uint32).tobytes() if ex.histogram is not None else None,
+    )
+
+def unpack_result(t: tuple) -> MetricsResult:
+    """pack_result 的逆操作，返回尚未评分的 MetricsResult。"""
+    if len(t) == 3:
+        filename, capture_ts, reasons = t
+        return MetricsResult(
+            filename=filename,
+            capture_ts=capture_ts,
+            is_unusable=True,
+            reasons=reasons.split(";") if reasons else ["Read Error"],
         )
+    filename, capture_ts, sharp, p1, p5, p50, p95, p99, white, black, dr, hist = t
+    return MetricsResult(
+        filename=filename,
+        capture_ts=capture_ts,
+        sharpness=SharpnessResult(score=sharp, is_blurry=False),
+        exposure=ExposureResult(
+            score=0.0,
+            p1=p1, p5=p5, p50=p50, p95=p95, p99=p99,
+            white_ratio=white,
+            black_ratio=black,
+            dynamic_range=dr,
+            histogram=np.frombuffer(hist, dtype=np.uint32) if hist is not None else None,
+        ),
+    )
+
+def process_chunk(
+    file_paths: List[str],
+    long_edge: int,
+    embed_model: Optional[str] = None,
+    thumb_long_edge: int = 256,
+    luma_only: bool = True,
+) -> Tuple[List[Tuple[tuple, Optional[Tuple[str, Any]]]], Dict[int, int]]:
+    """
+    一次 IPC 往返处理 N 个文件，返回 ([(pack_result 元组, 融合模式的 embedding payload)], 降采样倍数计数)。
+    融合模式需要彩色缩略图，因此只有纯指标运行才使用 luma_only 解码。
+    计数随结果返回，由主进程按每次运行汇总（worker 进程可能被多次运行复用）。
+    """
+    out = []
+    decode_factors: Dict[int, int] = {}
+    for fp in file_paths:
+        if embed_model:
+            res, payload = analyze_image(fp, long_edge, embed_model, thumb_long_edge, decode_factors)
+        else:
+            res, payload = process_image(fp, long_edge, luma_only, decode_factors), None
+        out.append((pack_result(res), payload))
+    return out, decode_factors
+
+def _discover_files(input_dir: str) -> List[str]:
+    # 支持 jpg, jpeg, JPG, JPEG
+    extensions = ['*.jpg', '*.JPG', '*.jpeg', '*.JPEG']
+    files = []
+    for ext in extensions:
+        files.extend(glob.glob(os.path.join(input_dir, ext)))
+    return sorted(list(set(files))) # 移除重复项（如果有）
 
 def run_stage1(
     input_dir: str, 
-    output_csv: str, 
+    output_csv: Optional[str], 
     workers: int, 
     rebuild_cache: bool = False,
-    progress_callback = None
+    progress_callback = None,
+    embed_model: Optional[str] = None,
+    thumb_long_edge: int = 256,
+    embedding_cache_dir: Optional[str] = None,
+    embed_batch_size: int = 32,
+    chunk_size: int = 8,
+    max_inflight: Optional[int] = None,
+    executor: Optional[concurrent.futures.Executor] = None,
+    cache: Optional[CacheSQLite] = None,
+    embed_cache: Optional[EmbeddingStore] = None,
+    stats: Optional[dict] = None,
 ) -> List[MetricsResult]:
+    """
+    流式调度：缓存查询与 worker 执行交错进行，同时在途的任务块数量有上限
+    （默认 workers * 2），每个任务块包含 chunk_size 个文件。
+    因此内存占用和首个结果的延迟只与 worker 数量有关，而与文件夹大小无关。
+
+    embed_model 非空时启用融合分析模式：每个 worker 只解码一次，
+    同时写入指标缓存和 embedding 缓存，之后的 group 运行可以全部命中缓存。
+
+    executor / cache / embed_cache 可由调用方传入（例如常驻的 serve 进程），
+    此时它们在运行结束后保持打开，供下一个任务复用。
+
+    返回的结果与文件顺序一致，与缓存命中情况和 worker 完成顺序无关。
+    output_csv 为 None 时不写 results.csv（结果只进入 results.db）。
+    stats 非空时写入 "decode_factors"：本次运行各降采样倍数的解码次数（各 worker 汇总，缓存命中不计）。
+    """
     
     start_time = time.time()
     
     # 1. 发现文件
-    # 支持 jpg, jpeg, JPG, JPEG
-    extensions = ['*.jpg', '*.JPG', '*.jpeg', '*.JPEG']
-    files = []
-    for ext in extensions:
-        files.extend(glob.glob(os.path.join(input_dir, ext)))
-    
-    files = sorted(list(set(files))) # 移除重复项（如果有）
+    files = _discover_files(input_dir)
     total_files = len(files)
     logger.info(f"Found {total_files} images in {input_dir}")
     
@@ -145,85 +338,197 @@ def run_stage1(
         return []
         
     # 2. 缓存初始化
-    cache = CacheSQLite()
-    
-    # 3. 缓存检查与任务分配
-    tasks = [] # (file_path, signature)
-    results = []
-    
+    owns_cache = cache is None
+    if owns_cache:
+        cache = CacheSQLite(metrics_cache_path())
+    long_edge = int(default_config.DEFAULT_LONG_EDGE)
+
+    fused = bool(embed_model)
+    # 融合模式需要彩色缩略图，只有纯指标运行才只解码亮度平面
+    luma_only = bool(default_config.LUMA_ONLY_DECODE) and not fused
+    params = measurement_params(luma_only)
+    embedder = None
+    if fused:
+        from photo_selector.similarity.grouping import (
+            TorchBatchEmbedder,
+            embedding_cache_key,
+            embedding_store_for,
+        )
+    if fused and embed_cache is None:
+        # embedding 存储放在 embedding_cache_dir 下，默认与结果文件同目录
+        embed_cache = embedding_store_for(embedding_cache_dir or os.path.dirname(output_csv or "") or ".")
+
+    chunk_size = max(1, int(chunk_size))
+    workers = max(1, int(workers))
+    max_inflight = max(1, int(max_inflight or workers * 2))
+
+    # 每次批量查询的缓存键数量
+    lookup_batch = max(64, chunk_size * max_inflight)
+
+    results: List[MetricsResult] = []
+    decode_factors: Dict[int, int] = {}
     hits = 0
-    
-    for fpath in files:
-        signature = CacheSQLite.generate_signature(fpath, default_config.DEFAULT_LONG_EDGE)
-        
-        cached_data = None
-        if not rebuild_cache:
-            cached_data = cache.get(signature)
-            
-        if cached_data:
-            # 缓存命中
+    misses = 0
+    done_count = 0
+
+    def report(force: bool = False):
+        if progress_callback and (force or done_count % 256 == 0):
+            progress_callback(done_count, total_files)
+
+    def lookup() -> Iterator[Tuple[str, str, Optional[str]]]:
+        """
+        3. 缓存检查：命中的直接产出结果，未命中的 (path, signature, embedding_key) 交给调度器。
+        这是一个生成器，只有在需要补充任务时才会继续查询，因此查询与执行是重叠的。
+        """
+        nonlocal hits, done_count
+        for start in range(0, len(files), lookup_batch):
+            batch = files[start:start + lookup_batch]
+            # 内容寻址模式：键由文件内容的部分哈希和大小组成，移动或复制文件夹后仍能命中缓存
+            contents = content_memo().hash_many(batch) if content_keys_enabled() else [None] * len(batch)
+            signatures = [
+                CacheSQLite.generate_signature(fpath, long_edge, content, params)
+                for fpath, content in zip(batch, contents)
+            ]
+            cached_by_sig = {} if rebuild_cache else cache.get_many(signatures)
+
+            for fpath, signature, content in zip(batch, signatures, contents):
+                embed_key = None
+                if fused:
+                    try:
+                        embed_key = embedding_cache_key(
+                            os.path.normpath(fpath), thumb_long_edge, embed_model, content=content
+                        )
+                    except OSError:
+                        embed_key = None
+
+                cached_data = cached_by_sig.get(signature) if signature else None
+                # 融合模式下 embedding 缺失时也需要重新解码，顺便重新计算指标
+                if cached_data and embed_key and embed_key not in embed_cache:
+                    cached_data = None
+
+                if cached_data:
+                    # 缓存命中
+                    try:
+                        res = MetricsResult.from_dict(cached_data)
+                        # 确保文件名匹配（应该匹配，但签名包含路径）
+                        if res.filename != fpath:
+                            res.filename = fpath
+                        if not getattr(res, "capture_ts", 0.0):
+                            res.capture_ts = get_capture_timestamp(fpath, source="auto")
+                        res = rescore_cached_result(res)
+                        results.append(res)
+                        hits += 1
+                        done_count += 1
+                        report()
+                        continue
+                    except Exception as e:
+                        logger.warning(f"Cache data corrupted for {fpath}, recomputing.")
+
+                # 缓存未命中
+                yield fpath, signature, embed_key
+
+    def handle_chunk(chunk: List[Tuple[str, str, Optional[str]]], chunk_out):
+        nonlocal done_count, embedder
+        for (path, sig, ek), (packed, payload) in zip(chunk, chunk_out):
             try:
-                res = MetricsResult.from_dict(cached_data)
-                # 确保文件名匹配（应该匹配，但签名包含路径）
-                if res.filename != fpath:
-                    res.filename = fpath
-                if not getattr(res, "capture_ts", 0.0):
-                    res.capture_ts = get_capture_timestamp(fpath, source="auto")
-                res = rescore_cached_result(res)
+                res = rescore_cached_result(unpack_result(packed))
+                res.filename = path
                 results.append(res)
-                hits += 1
+
+                # 写入缓存
+                # 注意：从主进程写入 sqlite 是安全的
+                cache.put(sig, _cache_record(res))
+
+                if payload is not None and ek:
+                    kind, data = payload
+                    if kind == "vec":
+                        embed_cache.set(ek, len(data) // 4, data)
+                    else:
+                        # torch 只在真正需要推理时才加载
+                        if embedder is None:
+                            embedder = TorchBatchEmbedder(embed_model, embed_cache, batch_size=embed_batch_size)
+                        embedder.add(data, ek, path)
             except Exception as e:
-                logger.warning(f"Cache data corrupted for {fpath}, recomputing.")
-                tasks.append((fpath, signature))
-        else:
-            # 缓存未命中
-            tasks.append((fpath, signature))
-            
-    logger.info(f"Cache hits: {hits}/{total_files}. Tasks to run: {len(tasks)}")
-    
-    # 4. 并行执行
-    if tasks:
-        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
-            # 映射任务
-            # 我们只需要映射文件路径
-            task_paths = [t[0] for t in tasks]
-            task_signatures = [t[1] for t in tasks]
-            
-            # 提交
-            # 我们使用 map 是为了简单，或者使用 submit 来控制顺序。Map 也可以。
-            # process_image 是纯函数。
-            
-            # 显示进度？
-            logger.info(f"Starting execution with {workers} workers...")
-            
-            futures = {executor.submit(process_image, p): (p, sig) for p, sig in zip(task_paths, task_signatures)}
-            
-            completed_count = 0
-            for future in concurrent.futures.as_completed(futures):
-                path, sig = futures[future]
+                logger.error(f"Worker exception for {path}: {e}")
+            done_count += 1
+
+    # 4. 并行执行（有界、分块、流式）
+    owns_executor = executor is None
+    pending: Dict[concurrent.futures.Future, List[Tuple[str, str, Optional[str]]]] = {}
+    task_iter = lookup()
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < max_inflight:
+                chunk = []
+                for task in task_iter:
+                    chunk.append(task)
+                    if len(chunk) >= chunk_size:
+                        break
+                else:
+                    exhausted = True
+                if not chunk:
+                    break
+                if executor is None:
+                    logger.info(f"Starting execution with {workers} workers...")
+                    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+                misses += len(chunk)
+                fut = executor.submit(
+                    process_chunk,
+                    [t[0] for t in chunk],
+                    long_edge,
+                    embed_model if fused else None,
+                    thumb_long_edge,
+                    luma_only,
+                )
+                pending[fut] = chunk
+
+            if not pending:
+                break
+
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for fut in done:
+                chunk = pending.pop(fut)
                 try:
-                    res = future.result()
-                    res = rescore_cached_result(res)
-                    results.append(res)
-                    
-                    # 写入缓存
-                    # 注意：从主进程写入 sqlite 是安全的
-                    cache.put(sig, res.to_dict())
-                    
+                    chunk_out, chunk_factors = fut.result()
                 except Exception as e:
-                    logger.error(f"Worker exception for {path}: {e}")
-                
-                completed_count += 1
-                if progress_callback:
-                    progress_callback(completed_count, len(tasks))
-                
-                if completed_count % 10 == 0:
-                    logger.info(f"Progress: {completed_count}/{len(tasks)}")
+                    logger.error(f"Worker exception for chunk starting at {chunk[0][0]}: {e}")
+                    chunk_out = [((path, 0.0, "Read Error"), None) for path, _sig, _ek in chunk]
+                    chunk_factors = {}
+                for factor, n in chunk_factors.items():
+                    decode_factors[factor] = decode_factors.get(factor, 0) + n
+                handle_chunk(chunk, chunk_out)
+                report(force=True)
+                if done_count % 100 < len(chunk):
+                    logger.info(f"Progress: {done_count}/{total_files}")
+    finally:
+        if owns_executor and executor is not None:
+            executor.shutdown(wait=True)
+
+    logger.info(f"Cache hits: {hits}/{total_files}. Tasks run: {misses}")
+    if progress_callback and hits and not misses:
+        progress_callback(done_count, total_files)
+
+    if embedder is not None:
+        embedder.flush()
+    if embed_cache is not None:
+        embed_cache.flush()
+
+    # 结果按完成顺序到达（缓存命中在前），统一恢复为文件顺序
+    position = {fp: i for i, fp in enumerate(files)}
+    results.sort(key=lambda r: position.get(r.filename, total_files))
 
     # 5. 输出
-    write_results(results, output_csv)
-    cache.close()
+    if output_csv:
+        write_results(results, output_csv)
+    if owns_cache:
+        cache.close()
+    else:
+        cache.flush()
     
+    if stats is not None:
+        stats["decode_factors"] = {str(k): int(v) for k, v in sorted(decode_factors.items())}
+
     duration = time.time() - start_time
     logger.info(f"Stage 1 completed in {duration:.2f}s. Average: {duration/total_files:.3f}s/img")
     
@@ -3,9 +3,11 @@ import os
 import csv
 import logging
 import concurrent.futures
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 from photo_selector.pipeline.models import MetricsResult
-from photo_selector.lr.xmp_writer import XmpWriter
+from photo_selector.io.io_scheduler import AdaptiveIoScheduler
+from photo_selector.lr.xmp_manifest import XmpManifest, sidecar_stat, xmp_fingerprint
+from photo_selector.lr.xmp_writer import XmpWriter, sidecar_path
 from photo_selector.config import default_config
 
 logger = logging.getLogger(__name__)
@@ -15,9 +17,15 @@ def apply_xmp_logic(result: MetricsResult, group_best_score: Optional[dict] = No
     Determines what to write and calls XmpWriter.
     Returns True if changed.
     """
+    xmp_path, rating, label, keywords = desired_xmp(result, group_best_score)
+    return XmpWriter.update_xmp(xmp_path, rating, label, keywords)
+
+def desired_xmp(
+    result: MetricsResult, group_best_score: Optional[dict] = None
+) -> Tuple[str, int, Optional[str], List[str]]:
+    """(sidecar path, rating, label, keywords) that Stage 2 wants for a result."""
     xmp_path_1 = f"{result.filename}.xmp"
-    base, _ext = os.path.splitext(result.filename)
-    xmp_path_2 = f"{base}.xmp"
+    xmp_path_2 = sidecar_path(result.filename)
     
     # Also support sidecar naming convention: image.xmp (if image.jpg) 
     # But usually image.jpg.xmp is safer to avoid collision if image.raw exists.
@@ -81,17 +89,78 @@ def apply_xmp_logic(result: MetricsResult, group_best_score: Optional[dict] = No
                 elif mode == "downgrade":
                     rating = min(int(rating), int(default_config.GROUP_NONBEST_MAX_RATING))
 
-    # Write
-    return XmpWriter.update_xmp(xmp_path_2, rating, label, keywords)
+    return xmp_path_2, rating, label, keywords
+
+def sync_sidecar(
+    xmp_path: str,
+    rating: int,
+    label: Optional[str],
+    keywords: List[str],
+    known: Optional[Tuple[str, int, int]] = None,
+) -> Tuple[str, str, Optional[Tuple[int, int]]]:
+    """
+    Syncs one sidecar unless known (its manifest entry) shows it is already
+    current. Returns (status, fingerprint, sidecar stat) where status is
+    "skipped" (not opened), "updated", "current" (read, nothing to change)
+    or "failed". Module-level so it can run in a process pool.
+    """
+    fingerprint = xmp_fingerprint(rating, label, keywords)
+    if known is not None and known[0] == fingerprint:
+        stat = sidecar_stat(xmp_path)
+        if stat == (known[1], known[2]):
+            return "skipped", fingerprint, stat
+    try:
+        changed = XmpWriter.sync_xmp(xmp_path, rating, label, keywords)
+    except Exception as e:
+        logger.error(f"Error writing XMP for {xmp_path}: {e}")
+        changed = None
+    if changed is None:
+        return "failed", fingerprint, None
+    return ("updated" if changed else "current"), fingerprint, sidecar_stat(xmp_path)
+
+def _sync_task(task: tuple) -> Tuple[str, str, Optional[Tuple[int, int]]]:
+    """sync_sidecar on a (xmp_path, rating, label, keywords, known) tuple."""
+    return sync_sidecar(*task)
 
 def run_stage2(
     results: List[MetricsResult], 
-    workers: int = 4
-):
-    logger.info(f"Starting Stage 2 (XMP Writing) with {workers} workers...")
+    workers: int = 0,
+    manifest_path: Optional[str] = None,
+    processes: bool = False,
+) -> Dict:
+    """
+    Syncs rating / label / AI keywords into every result's sidecar.
+
+    workers > 0 keeps that many sidecars in flight; 0 lets
+    AdaptiveIoScheduler follow the measured per-file latency between
+    XMP_IO_MIN_CONCURRENCY and XMP_IO_MAX_CONCURRENCY (many on a NAS, few
+    on a local disk). With manifest_path (see XmpManifest), sidecars whose
+    desired values and size / mtime are unchanged since the last run are
+    skipped without being read. processes=True runs the sidecar updates in
+    a process pool (workers, or one per CPU) instead of threads.
+
+    Returns counts per sync_sidecar status plus "io": the scheduler's
+    throughput / concurrency / latency summary.
+    """
+    if processes:
+        scheduler = AdaptiveIoScheduler(initial=workers or (os.cpu_count() or 4), adaptive=False, processes=True)
+    elif workers > 0:
+        scheduler = AdaptiveIoScheduler(initial=workers, max_concurrency=workers, adaptive=False)
+    else:
+        scheduler = AdaptiveIoScheduler(
+            min_concurrency=default_config.XMP_IO_MIN_CONCURRENCY,
+            max_concurrency=default_config.XMP_IO_MAX_CONCURRENCY,
+        )
+    if scheduler.adaptive:
+        logger.info(
+            f"Starting Stage 2 (XMP Writing) with {scheduler.initial} workers "
+            f"(adaptive, {scheduler.min_concurrency}-{scheduler.max_concurrency})..."
+        )
+    else:
+        logger.info(f"Starting Stage 2 (XMP Writing) with {scheduler.initial} {'processes' if processes else 'workers'}...")
     
-    count_updated = 0
-    count_skipped = 0
+    counts = {"updated": 0, "current": 0, "skipped": 0, "failed": 0}
+    manifest = XmpManifest(manifest_path) if manifest_path else None
 
     best_score_by_group = {}
     for r in results:
@@ -100,25 +169,30 @@ def run_stage2(
             continue
         s = float(getattr(r, "technical_score", 0.0) or 0.0)
         best_score_by_group[gid] = max(float(best_score_by_group.get(gid, -1e9)), s)
-    
-    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
-        # Submit tasks
-        future_to_file = {
-            executor.submit(apply_xmp_logic, res, best_score_by_group): res.filename for res in results
-        }
-        
-        for future in concurrent.futures.as_completed(future_to_file):
-            fpath = future_to_file[future]
-            try:
-                changed = future.result()
-                if changed:
-                    count_updated += 1
-                else:
-                    count_skipped += 1
-            except Exception as e:
-                logger.error(f"Error writing XMP for {fpath}: {e}")
-                
-    logger.info(f"Stage 2 Complete. Updated: {count_updated}, Skipped: {count_skipped}")
+
+    tasks = []
+    for res in results:
+        xmp_path, rating, label, keywords = desired_xmp(res, best_score_by_group)
+        tasks.append((xmp_path, rating, label, keywords, manifest.get(xmp_path) if manifest is not None else None))
+
+    try:
+        for task, (status, fingerprint, stat) in scheduler.map(_sync_task, tasks):
+            counts[status] += 1
+            if manifest is not None:
+                manifest.record(task[0], fingerprint, stat)
+    finally:
+        if manifest is not None:
+            manifest.save()
+
+    io_stats = scheduler.stats()
+    logger.info(
+        f"Stage 2 Complete. Updated: {counts['updated']}, Unchanged: {counts['current']}, "
+        f"Skipped via manifest: {counts['skipped']}, Failed: {counts['failed']} "
+        f"({io_stats['throughput_per_s']} files/s, p50 {io_stats['latency_ms']['p50']} ms, "
+        f"p99 {io_stats['latency_ms']['p99']} ms, concurrency {io_stats['concurrency']['min']}-"
+        f"{io_stats['concurrency']['max']})"
+    )
+    return {**counts, "io": io_stats}
 
 def load_results_from_csv(csv_path: str) -> List[MetricsResult]:
     results = []
@@ -0,0 +1,103 @@
+import concurrent.futures
+import os
+import sys
+import tempfile
+
+import cv2
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from photo_selector.config import default_config  # noqa: E402
+from photo_selector.io.cache_sqlite import CacheSQLite  # noqa: E402
+from photo_selector.io.embedding_store import EmbeddingStore  # noqa: E402
+from photo_selector.pipeline.stage1_metrics import run_stage1  # noqa: E402
+from photo_selector.similarity.grouping import compute_embeddings  # noqa: E402
+
+
+def _write_photos(folder: str, names, seed: int = 0):
+    # Smaller than every target size, so no run resizes and the decodes are comparable
+    rng = np.random.default_rng(seed)
+    for name in names:
+        img = cv2.GaussianBlur(rng.integers(0, 256, size=(180, 240, 3), dtype=np.uint8), (0, 0), rng.uniform(0.5, 3))
+        cv2.imwrite(os.path.join(folder, name), img)
+
+
+def _run(folder: str, cache: CacheSQLite, pool, **kwargs):
+    stats = {}
+    results = run_stage1(
+        input_dir=folder,
+        output_csv=None,
+        workers=2,
+        executor=pool,
+        cache=cache,
+        chunk_size=3,
+        max_inflight=2,
+        stats=stats,
+        **kwargs,
+    )
+    return results, stats
+
+
+def test_streaming_results_keep_file_order():
+    with tempfile.TemporaryDirectory() as tmp, concurrent.futures.ThreadPoolExecutor(2) as pool:
+        photos = os.path.join(tmp, "photos")
+        os.makedirs(photos)
+        _write_photos(photos, [f"{i:02d}.jpg" for i in range(10)])
+        cache = CacheSQLite(os.path.join(tmp, "cache.db"))
+        try:
+            first, stats = _run(photos, cache, pool)
+            assert [r.filename for r in first] == sorted(os.path.join(photos, n) for n in os.listdir(photos))
+            assert stats["decode_factors"] == {"1": 10}
+
+            # All hits: same results in the same order, nothing decoded
+            again, stats = _run(photos, cache, pool)
+            assert [r.to_dict() for r in again] == [r.to_dict() for r in first]
+            assert stats["decode_factors"] == {}
+
+            # Hits and misses interleaved: still file order, cached rows unchanged
+            _write_photos(photos, ["00a.jpg", "05a.jpg", "zz.jpg"], seed=1)
+            mixed, stats = _run(photos, cache, pool)
+            assert [r.filename for r in mixed] == sorted(os.path.join(photos, n) for n in os.listdir(photos))
+            assert stats["decode_factors"] == {"1": 3}
+            by_name = {r.filename: r.to_dict() for r in mixed}
+            assert [by_name[r.filename] for r in first] == [r.to_dict() for r in first]
+        finally:
+            cache.close()
+
+
+def test_fused_run_matches_metrics_only_run():
+    luma_only = default_config.LUMA_ONLY_DECODE
+    # Colour decode in both modes: the fused run needs BGR thumbnails, and the metrics must not differ
+    default_config.LUMA_ONLY_DECODE = False
+    try:
+        with tempfile.TemporaryDirectory() as tmp, concurrent.futures.ThreadPoolExecutor(2) as pool:
+            photos = os.path.join(tmp, "photos")
+            os.makedirs(photos)
+            _write_photos(photos, [f"{i:02d}.jpg" for i in range(10)])
+            plain_cache = CacheSQLite(os.path.join(tmp, "plain.db"))
+            plain, _ = _run(photos, plain_cache, pool)
+            plain_cache.close()
+
+            store = EmbeddingStore(os.path.join(tmp, "store"))
+            fused_cache = CacheSQLite(os.path.join(tmp, "fused.db"))
+            fused, _ = _run(photos, fused_cache, pool, embed_model="cv2_hist", embed_cache=store)
+            fused_cache.close()
+            assert [r.to_dict() for r in fused] == [r.to_dict() for r in plain]
+
+            # The fused run cached exactly the embeddings grouping computes on its own
+            files = [r.filename for r in plain]
+            cached, hits = compute_embeddings(files, "cv2_hist", 256, store)
+            assert hits == len(files)
+            fresh, _ = compute_embeddings(files, "cv2_hist", 256, EmbeddingStore(os.path.join(tmp, "fresh")))
+            np.testing.assert_array_equal(cached, fresh)
+    finally:
+        default_config.LUMA_ONLY_DECODE = luma_only
+
+
+if __name__ == "__main__":
+    test_streaming_results_keep_file_order()
+    test_fused_run_matches_metrics_only_run()
+    print("ok")
@@ -0,0 +1,398 @@
+"""
+IVF (inverted file) index over cached embeddings, in pure NumPy.
+
+Vectors are clustered with spherical k-means into `nlist` lists and stored
+grouped by list, so a query only scans the `nprobe` lists whose centroids
+are most similar to it. The index is a directory:
+
+  meta.json         model, thumb size, dim, counts, size/mtime of the source caches
+  centroids.npy     (nlist, dim) float32
+  vectors.npy       (n, dim) float32, grouped by list, memory-mapped on load
+  list_offsets.npy  (nlist + 1,) int64, rows of list i are [off[i], off[i+1])
+  paths.json        file path of each row of vectors.npy
+"""
+import json
+import os
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from photo_selector.io.embedding_store import embedding_cache_stamp, open_embedding_cache
+from photo_selector.pipeline.models import MetricsResult
+from photo_selector.similarity.grouping import (
+    apply_grouping_to_results,
+    dbscan_from_neighbors,
+    embedding_key_model,
+    l2_normalize,
+    parse_embedding_key,
+    write_groups_json,
+)
+from photo_selector.similarity.perceptual_hash import is_hash_model
+
+ANN_INDEX_DIRNAME = "ann_index"
+
+_INDEX_VERSION = 1
+# Rows per matmul block when assigning / scanning
+_BLOCK_ROWS = 4096
+_KMEANS_ITERS = 10
+# k-means trains on at most this many sampled vectors per list
+_KMEANS_SAMPLE_PER_LIST = 64
+_KMEANS_MAX_SAMPLE = 200_000
+
+
+def default_nlist(n: int) -> int:
+    return int(min(4096, max(1, round(np.sqrt(n)))))
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the most similar centroid for every row, computed in blocks."""
+    n = int(vectors.shape[0])
+    labels = np.empty(n, dtype=np.int32)
+    for s in range(0, n, _BLOCK_ROWS):
+        e = min(n, s + _BLOCK_ROWS)
+        labels[s:e] = np.argmax(np.asarray(vectors[s:e]) @ centroids.T, axis=1)
+    return labels
+
+
+def _spherical_kmeans(sample: np.ndarray, nlist: int, rng: np.random.Generator) -> np.ndarray:
+    n = int(sample.shape[0])
+    nlist = min(nlist, n)
+    centroids = sample[rng.choice(n, size=nlist, replace=False)].copy()
+    for _ in range(_KMEANS_ITERS):
+        labels = _assign(sample, centroids)
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=nlist)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        nonempty = counts > 0
+        sums = np.add.reduceat(sample[order], starts[nonempty], axis=0)
+        centroids[nonempty] = l2_normalize(sums)
+        # Empty lists restart from random points
+        empty = np.flatnonzero(~nonempty)
+        if empty.size:
+            centroids[empty] = sample[rng.choice(n, size=empty.size, replace=False)]
+    return centroids.astype(np.float32)
+
+
+class IvfIndex:
+    def __init__(
+        self,
+        index_dir: str,
+        meta: Dict,
+        centroids: np.ndarray,
+        vectors: np.ndarray,
+        offsets: np.ndarray,
+        paths: List[str],
+    ):
+        self.index_dir = index_dir
+        self.meta = meta
+        self.centroids = centroids
+        self.vectors = vectors
+        self.offsets = offsets
+        self.paths = paths
+        self._row_by_path: Optional[Dict[str, int]] = None
+
+    @property
+    def size(self) -> int:
+        return len(self.paths)
+
+    @staticmethod
+    def exists(index_dir: str) -> bool:
+        return os.path.exists(os.path.join(index_dir, "meta.json"))
+
+    @classmethod
+    def load(cls, index_dir: str) -> "IvfIndex":
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if int(meta.get("version", 0)) != _INDEX_VERSION:
+            raise ValueError(f"Unsupported ANN index version in {index_dir}")
+        with open(os.path.join(index_dir, "paths.json"), "r", encoding="utf-8") as f:
+            paths = json.load(f)
+        return cls(
+            index_dir=index_dir,
+            meta=meta,
+            centroids=np.load(os.path.join(index_dir, "centroids.npy")),
+            vectors=np.load(os.path.join(index_dir, "vectors.npy"), mmap_mode="r"),
+            offsets=np.load(os.path.join(index_dir, "list_offsets.npy")),
+            paths=paths,
+        )
+
+    @classmethod
+    def build(
+        cls,
+        cache_paths: Sequence[str],
+        index_dir: str,
+        embed_model: str,
+        thumb_long_edge: int,
+        thumb_source: str = "decode",
+        nlist: Optional[int] = None,
+        check_files: bool = True,
+        progress_callback: Optional[Callable[[str, int, int], None]] = None,
+        seed: int = 0,
+        path_resolver: Optional[Callable[[str], Optional[str]]] = None,
+    ) -> "IvfIndex":
+        """
+        Builds the index from one or more embedding caches (store dirs or
+        legacy SQLite files). Only vectors for
+        this model / thumb size / thumb source are used, and only the newest
+        entry per file; with check_files, entries for files that are gone or
+        have changed since they were embedded are skipped. Content-addressed
+        keys ("#<hash>") are mapped back to a file by path_resolver(hash) and
+        skipped without one.
+        """
+        if is_hash_model(embed_model):
+            raise ValueError(f"{embed_model} hashes have no cosine geometry; use a vector embed model")
+        model_key = embedding_key_model(embed_model, thumb_source)
+        prefix = f"{model_key}|{int(thumb_long_edge)}|"
+        # Taken before reading: anything written meanwhile makes the index stale
+        stamps = [embedding_cache_stamp(p) for p in cache_paths]
+
+        # Pass 1: pick the newest key per path (keys only, no vectors)
+        chosen: Dict[str, Tuple[float, int, str]] = {}
+        dims: Dict[int, int] = {}
+        caches = []
+        for ci, cache_path in enumerate(cache_paths):
+            cache = open_embedding_cache(cache_path)
+            caches.append(cache)
+            for key, dim, _ in cache.iter_prefix(prefix, with_vectors=False):
+                parsed = parse_embedding_key(key)
+                if parsed is None:
+                    continue
+                _, _, path, size, mtime = parsed
+                if path.startswith("#"):
+                    path = path_resolver(path[1:]) if path_resolver else None
+                    if path is None:
+                        continue
+                prev = chosen.get(path)
+                if prev is None or mtime > prev[0]:
+                    chosen[path] = (mtime, ci, key)
+                dims[dim] = dims.get(dim, 0) + 1
+
+        if check_files:
+            for path in list(chosen):
+                parsed = parse_embedding_key(chosen[path][2])
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    del chosen[path]
+                    continue
+                content_key = parsed[2].startswith("#")
+                if st.st_size != parsed[3] or (not content_key and abs(st.st_mtime - parsed[4]) > 1e-5):
+                    del chosen[path]
+
+        if not chosen:
+            raise ValueError(f"No cached embeddings for {model_key} at {thumb_long_edge}px")
+        dim = max(dims.items(), key=lambda kv: kv[1])[0]
+
+        os.makedirs(index_dir, exist_ok=True)
+        paths = sorted(chosen)
+        row_by_key = {chosen[p][2]: i for i, p in enumerate(paths)}
+        n = len(paths)
+
+        # Pass 2: stream the vectors into an unsorted scratch matrix on disk
+        raw_path = os.path.join(index_dir, "vectors.raw.npy")
+        raw = np.lib.format.open_memmap(raw_path, mode="w+", dtype=np.float32, shape=(n, dim))
+        valid = np.zeros(n, dtype=bool)
+        for ci, cache in enumerate(caches):
+            for key, d, vec in cache.iter_prefix(prefix):
+                row = row_by_key.get(key)
+                if row is None or d != dim or chosen[paths[row]][1] != ci:
+                    continue
+                raw[row] = np.frombuffer(vec, dtype=np.float32)
+                valid[row] = True
+        if progress_callback:
+            progress_callback("load", n, n)
+
+        for s in range(0, n, _BLOCK_ROWS):
+            e = min(n, s + _BLOCK_ROWS)
+            raw[s:e] = l2_normalize(np.asarray(raw[s:e]))
+
+        # Train on a sample, then assign every vector to its list
+        rng = np.random.default_rng(seed)
+        keep = np.flatnonzero(valid)
+        nlist = int(nlist or default_nlist(keep.size))
+        sample_size = min(keep.size, _KMEANS_MAX_SAMPLE, max(nlist, nlist * _KMEANS_SAMPLE_PER_LIST))
+        sample_rows = np.sort(rng.choice(keep, size=sample_size, replace=False))
+        centroids = _spherical_kmeans(np.asarray(raw[sample_rows]), nlist, rng)
+        nlist = int(centroids.shape[0])
+        if progress_callback:
+            progress_callback("train", 1, 1)
+
+        labels = _assign(raw, centroids)[keep]
+        order = keep[np.argsort(labels, kind="stable")]
+        counts = np.bincount(labels, minlength=nlist)
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        tmp_vectors = os.path.join(index_dir, "vectors.tmp.npy")
+        out = np.lib.format.open_memmap(tmp_vectors, mode="w+", dtype=np.float32, shape=(order.size, dim))
+        for s in range(0, order.size, _BLOCK_ROWS):
+            e = min(order.size, s + _BLOCK_ROWS)
+            out[s:e] = raw[order[s:e]]
+            if progress_callback:
+                progress_callback("write", e, order.size)
+        out.flush()
+        del out, raw
+        os.remove(raw_path)
+
+        ordered_paths = [paths[i] for i in order.tolist()]
+        meta = {
+            "version": _INDEX_VERSION,
+            "embed_model": embed_model,
+            "model_key": model_key,
+            "thumb_long_edge": int(thumb_long_edge),
+            "thumb_source": thumb_source,
+            "dim": int(dim),
+            "count": len(ordered_paths),
+            "nlist": nlist,
+            "built_at": time.time(),
+            "caches": [os.path.abspath(p) for p in cache_paths],
+            "cache_stamps": stamps,
+        }
+
+        os.replace(tmp_vectors, os.path.join(index_dir, "vectors.npy"))
+        np.save(os.path.join(index_dir, "centroids.npy"), centroids)
+        np.save(os.path.join(index_dir, "list_offsets.npy"), offsets)
+        with open(os.path.join(index_dir, "paths.json"), "w", encoding="utf-8") as f:
+            json.dump(ordered_paths, f, ensure_ascii=False)
+        # meta.json last: its presence marks a complete index
+        with open(os.path.join(index_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        return cls.load(index_dir)
+
+    def is_current(self, cache_paths: Sequence[str]) -> bool:
+        """False when built from other caches, or when they were written to since the build."""
+        return self.meta.get("caches") == [os.path.abspath(p) for p in cache_paths] and self.meta.get(
+            "cache_stamps"
+        ) == [embedding_cache_stamp(p) for p in cache_paths]
+
+    def vector_for(self, path: str) -> Optional[np.ndarray]:
+        """Stored vector of an indexed file (paths are compared in absolute, normalized form)."""
+        if self._row_by_path is None:
+            self._row_by_path = {os.path.normpath(os.path.abspath(p)): i for i, p in enumerate(self.paths)}
+        row = self._row_by_path.get(os.path.normpath(os.path.abspath(path)))
+        return None if row is None else np.asarray(self.vectors[row])
+
+    def _probe(self, sims: np.ndarray, nprobe: int) -> np.ndarray:
+        nprobe = max(1, min(int(nprobe), sims.shape[-1]))
+        return np.argpartition(-sims, nprobe - 1, axis=-1)[..., :nprobe]
+
+    def search(self, query: np.ndarray, k: int = 10, nprobe: int = 8) -> List[Tuple[str, float]]:
+        """Top-k (path, cosine similarity) among the nprobe lists closest to the query."""
+        q = l2_normalize(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+        lists = self._probe(self.centroids @ q, nprobe)
+        rows = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in lists])
+        if rows.size == 0:
+            return []
+        sims = np.concatenate(
+            [np.asarray(self.vectors[self.offsets[l]:self.offsets[l + 1]]) @ q for l in lists]
+        )
+        k = min(int(k), rows.size)
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top], kind="stable")]
+        return [(self.paths[int(rows[i])], float(sims[i])) for i in top]
+
+    def neighbor_graph(
+        self,
+        sim_threshold: float,
+        nprobe: int = 8,
+        progress_callback: Optional[Callable[[str, int, int], None]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Library-wide neighbor graph: every pair with cosine similarity >=
+        sim_threshold, found by scanning each list against the nprobe lists
+        whose centroids are closest to its own centroid. Returns symmetric
+        CSR arrays (indptr, indices) like grouping.windowed_neighbors.
+        """
+        n = self.size
+        nlist = int(self.centroids.shape[0])
+        probes = self._probe(self.centroids @ self.centroids.T, nprobe)
+
+        src: List[np.ndarray] = []
+        dst: List[np.ndarray] = []
+        for l in range(nlist):
+            a, b = int(self.offsets[l]), int(self.offsets[l + 1])
+            if a == b:
+                continue
+            cand_rows = np.concatenate(
+                [np.arange(self.offsets[p], self.offsets[p + 1]) for p in probes[l]]
+            )
+            cand = np.concatenate(
+                [np.asarray(self.vectors[self.offsets[p]:self.offsets[p + 1]]) for p in probes[l]]
+            )
+            for s in range(a, b, _BLOCK_ROWS):
+                e = min(b, s + _BLOCK_ROWS)
+                r, c = np.nonzero(np.asarray(self.vectors[s:e]) @ cand.T >= sim_threshold)
+                gi = r + s
+                gj = cand_rows[c]
+                keep = gi != gj
+                src.append(gi[keep])
+                dst.append(gj[keep])
+            if progress_callback:
+                progress_callback("neighbors", l + 1, nlist)
+
+        if src:
+            i = np.concatenate(src + dst).astype(np.int64)
+            j = np.concatenate(dst + src).astype(np.int64)
+            pairs = np.unique(i * n + j)
+            i, j = pairs // n, pairs % n
+        else:
+            i = j = np.zeros(0, dtype=np.int64)
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(i, minlength=n), out=indptr[1:])
+        return indptr, j
+
+
+def run_library_dedup(
+    index: IvfIndex,
+    output_path: str,
+    eps: float,
+    min_samples: int = 2,
+    nprobe: int = 8,
+    topk: int = 1,
+    scores: Optional[Dict[str, float]] = None,
+    progress_callback: Optional[Callable[[Dict], None]] = None,
+) -> str:
+    """
+    Near-duplicate clusters across the whole index, written in the groups.json
+    format. Photos without duplicates are left out of "noise" so the file
+    stays small for large archives. scores (path -> technical score, paths
+    compared in absolute, normalized form) decide the best photos of each
+    group; photos without a score count as 0.
+    """
+
+    def on_progress(phase: str, done: int, total: int):
+        if progress_callback:
+            progress_callback({"type": "dedup", "phase": phase, "done": int(done), "total": int(total)})
+
+    indptr, indices = index.neighbor_graph(1.0 - float(eps), nprobe=nprobe, progress_callback=on_progress)
+    labels = dbscan_from_neighbors(indptr, indices, min_samples, progress_callback=on_progress)
+
+    scores = {os.path.normpath(os.path.abspath(p)): s for p, s in (scores or {}).items()}
+    grouped = [
+        MetricsResult(
+            filename=index.paths[i],
+            technical_score=float(scores.get(os.path.normpath(os.path.abspath(index.paths[i])), 0.0)),
+        )
+        for i, label in enumerate(labels)
+        if label != -1
+    ]
+    labels_by_filename = {index.paths[i]: int(label) for i, label in enumerate(labels) if label != -1}
+    _, groups, _ = apply_grouping_to_results(grouped, labels_by_filename, topk=topk)
+
+    write_groups_json(
+        output_path=output_path,
+        input_dir=index.index_dir,
+        embed_model=str(index.meta.get("embed_model", "")),
+        thumb_long_edge=int(index.meta.get("thumb_long_edge", 0)),
+        eps=eps,
+        min_samples=min_samples,
+        neighbor_window=0,
+        time_window_secs=0.0,
+        time_source="none",
+        topk=topk,
+        groups=groups,
+        noise=[],
+        neighbor_mode="ann",
+    )
+    return output_path
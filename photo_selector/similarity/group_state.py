@@ -0,0 +1,257 @@
+import json
+import logging
+import os
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from photo_selector.similarity.grouping import candidate_ranges, dbscan_from_neighbors, windowed_neighbors
+
+logger = logging.getLogger(__name__)
+
+GROUP_STATE_JSON = "group_state.json"
+GROUP_STATE_ARRAYS = "group_state.npz"
+# 2: unreadable photos are left out of the neighbor graph
+_STATE_VERSION = 2
+
+
+def _segment_index(starts: np.ndarray, lens: np.ndarray) -> np.ndarray:
+    """Concatenation of arange(starts[k], starts[k] + lens[k]) for all k."""
+    lens = np.asarray(lens, dtype=np.int64)
+    total = int(lens.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.asarray(starts, dtype=np.int64) - np.cumsum(lens) + lens
+    return np.repeat(offsets, lens) + np.arange(total, dtype=np.int64)
+
+
+class GroupState:
+    """
+    What a `group` run leaves behind for the next one: the photos in
+    clustering order (filename, embedding key, timestamp), their CSR
+    neighbor graph and group labels, and the parameters they were computed
+    with. Stored next to groups.json as group_state.npz (arrays) and
+    group_state.json (the rest, written last).
+    """
+
+    def __init__(
+        self,
+        params: Dict,
+        filenames: Sequence[str],
+        keys: Sequence[str],
+        timestamps: np.ndarray,
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        labels: np.ndarray,
+        next_group_id: int,
+    ):
+        self.params = params
+        self.filenames = list(filenames)
+        self.keys = list(keys)
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self.next_group_id = int(next_group_id)
+
+    @classmethod
+    def load(cls, output_dir: str) -> Optional["GroupState"]:
+        json_path = os.path.join(output_dir, GROUP_STATE_JSON)
+        arrays_path = os.path.join(output_dir, GROUP_STATE_ARRAYS)
+        if not (os.path.exists(json_path) and os.path.exists(arrays_path)):
+            return None
+        try:
+            with open(json_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with np.load(arrays_path, allow_pickle=False) as arrays:
+                state = cls(
+                    params=meta["params"],
+                    filenames=meta["filenames"],
+                    keys=meta["keys"],
+                    timestamps=arrays["timestamps"],
+                    indptr=arrays["indptr"],
+                    indices=arrays["indices"],
+                    labels=arrays["labels"],
+                    next_group_id=meta["next_group_id"],
+                )
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable grouping state in {output_dir}: {e}")
+            return None
+        n = len(state.filenames)
+        if meta.get("version") != _STATE_VERSION or not (
+            len(state.keys) == state.timestamps.shape[0] == state.labels.shape[0] == n
+            and state.indptr.shape[0] == n + 1
+            and int(state.indptr[-1]) == state.indices.shape[0]
+        ):
+            return None
+        return state
+
+    def save(self, output_dir: str) -> None:
+        arrays_tmp = os.path.join(output_dir, "group_state.tmp.npz")
+        np.savez(
+            arrays_tmp,
+            timestamps=self.timestamps,
+            indptr=self.indptr,
+            indices=self.indices,
+            labels=self.labels,
+        )
+        os.replace(arrays_tmp, os.path.join(output_dir, GROUP_STATE_ARRAYS))
+        json_path = os.path.join(output_dir, GROUP_STATE_JSON)
+        with open(json_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": _STATE_VERSION,
+                    "params": self.params,
+                    "next_group_id": self.next_group_id,
+                    "filenames": self.filenames,
+                    "keys": self.keys,
+                },
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(json_path + ".tmp", json_path)
+
+
+def regroup(
+    embs: np.ndarray,
+    filenames: Sequence[str],
+    keys: Sequence[str],
+    timestamps: np.ndarray,
+    params: Dict,
+    eps: float,
+    min_samples: int,
+    neighbor_window: int,
+    time_secs: Optional[float] = None,
+    neighbor_mode: str = "index",
+    previous: Optional[GroupState] = None,
+    progress_callback: Optional[Callable[[str, int, int], None]] = None,
+    readable: Optional[np.ndarray] = None,
+) -> Tuple[List[int], GroupState, Dict]:
+    """
+    Windowed DBSCAN labels for the photos (in clustering order), reusing
+    previous when it was computed with the same params.
+
+    A photo is reused when its filename, embedding key and timestamp are
+    unchanged and its candidate range still holds exactly the same photos;
+    its neighbor list is then carried over. Only the remaining rows are
+    searched again, and DBSCAN is rerun on the connected components that
+    contain them. Clusters keep the id of the previous cluster most of
+    their members belonged to; brand-new clusters get fresh ids.
+    readable is passed on to windowed_neighbors.
+    Returns (labels, new state, stats).
+    """
+    n = len(filenames)
+    sim_threshold = 1.0 - float(eps)
+    ts = np.asarray(timestamps, dtype=np.float64) if time_secs else None
+
+    def full_run(reason: str) -> Tuple[List[int], GroupState, Dict]:
+        indptr, indices = windowed_neighbors(
+            embs, sim_threshold, neighbor_window, time_secs, ts, progress_callback, neighbor_mode,
+            readable=readable,
+        )
+        labels = np.asarray(dbscan_from_neighbors(indptr, indices, min_samples, progress_callback), dtype=np.int64)
+        next_id = int(labels.max()) + 1 if n else 0
+        state = GroupState(params, filenames, keys, timestamps, indptr, indices, labels, next_id)
+        stats = {"incremental": False, "reason": reason, "rows_searched": n, "rows_clustered": n}
+        return labels.tolist(), state, stats
+
+    if previous is None:
+        return full_run("no previous state")
+    if previous.params != params:
+        return full_run("parameters changed")
+    old_n = len(previous.filenames)
+    if n == 0 or old_n == 0:
+        return full_run("empty")
+
+    ts_all = np.asarray(timestamps, dtype=np.float64)
+    old_index = {(f, k): i for i, (f, k) in enumerate(zip(previous.filenames, previous.keys))}
+    new_to_old = np.array([old_index.get((f, k), -1) for f, k in zip(filenames, keys)], dtype=np.int64)
+    kept = new_to_old >= 0
+    kept[kept] = previous.timestamps[new_to_old[kept]] == ts_all[kept]
+    new_to_old[~kept] = -1
+    if np.any(np.diff(new_to_old[kept]) <= 0):
+        return full_run("order changed")
+    old_to_new = np.full(old_n, -1, dtype=np.int64)
+    old_to_new[new_to_old[kept]] = np.flatnonzero(kept)
+
+    # A kept row can reuse its neighbors if its range maps onto exactly its old range
+    lo, hi = candidate_ranges(n, neighbor_window, neighbor_mode, time_secs, ts)
+    old_ts = previous.timestamps if time_secs else None
+    olo, ohi = candidate_ranges(old_n, neighbor_window, neighbor_mode, time_secs, old_ts)
+    fresh = np.concatenate([[0], np.cumsum(~kept)])
+    o = np.where(kept, new_to_old, 0)
+    same = (
+        kept
+        & (fresh[hi] == fresh[lo])
+        & (hi - lo == ohi[o] - olo[o])
+        & (new_to_old[lo] == olo[o])
+        & (new_to_old[hi - 1] == ohi[o] - 1)
+    )
+    rows = np.flatnonzero(~same)
+    reuse = np.flatnonzero(same)
+
+    part_indptr, part_indices = windowed_neighbors(
+        embs, sim_threshold, neighbor_window, time_secs, ts, progress_callback, neighbor_mode,
+        rows=rows, readable=readable,
+    )
+    counts = np.diff(part_indptr)
+    counts[reuse] = np.diff(previous.indptr)[new_to_old[reuse]]
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    indices = np.empty(int(indptr[-1]), dtype=np.int64)
+    indices[_segment_index(indptr[rows], counts[rows])] = part_indices
+    src = _segment_index(previous.indptr[new_to_old[reuse]], counts[reuse])
+    indices[_segment_index(indptr[reuse], counts[reuse])] = old_to_new[previous.indices[src]]
+
+    # Every connected component touching a searched row gets clustered again
+    dirty = np.zeros(n, dtype=bool)
+    dirty[rows] = True
+    frontier = rows
+    while frontier.size:
+        nb = indices[_segment_index(indptr[frontier], counts[frontier])]
+        nb = np.unique(nb[~dirty[nb]])
+        dirty[nb] = True
+        frontier = nb
+
+    labels = np.full(n, -1, dtype=np.int64)
+    clean = np.flatnonzero(~dirty)
+    labels[clean] = previous.labels[new_to_old[clean]]
+
+    sub = np.flatnonzero(dirty)
+    new_to_sub = np.full(n, -1, dtype=np.int64)
+    new_to_sub[sub] = np.arange(sub.size)
+    sub_indptr = np.zeros(sub.size + 1, dtype=np.int64)
+    np.cumsum(counts[sub], out=sub_indptr[1:])
+    sub_indices = new_to_sub[indices[_segment_index(indptr[sub], counts[sub])]]
+    sub_labels = np.asarray(dbscan_from_neighbors(sub_indptr, sub_indices, min_samples), dtype=np.int64)
+
+    claimed = set(labels[clean].tolist()) - {-1}
+    next_id = previous.next_group_id
+    clustered = np.flatnonzero(sub_labels >= 0)
+    order = clustered[np.argsort(sub_labels[clustered], kind="stable")]
+    splits = np.flatnonzero(np.diff(sub_labels[order])) + 1
+    clusters = [sub[m] for m in np.split(order, splits) if m.size]
+    # Larger clusters pick their old id first
+    clusters.sort(key=lambda m: (-m.size, int(m[0])))
+    for members in clusters:
+        olds = new_to_old[members]
+        votes = Counter(previous.labels[olds[olds >= 0]].tolist())
+        votes.pop(-1, None)
+        gid = next((g for g, _ in votes.most_common() if g not in claimed), None)
+        if gid is None:
+            gid = next_id
+            next_id += 1
+        claimed.add(gid)
+        labels[members] = gid
+
+    next_id = max(next_id, int(labels.max()) + 1)
+    state = GroupState(params, filenames, keys, timestamps, indptr, indices, labels, next_id)
+    stats = {
+        "incremental": True,
+        "added_or_changed": int(n - kept.sum()),
+        "removed": int(old_n - kept.sum()),
+        "rows_searched": int(rows.size),
+        "rows_clustered": int(sub.size),
+    }
+    return labels.tolist(), state, stats
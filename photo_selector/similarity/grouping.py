@@ -1,15 +1,42 @@
+import concurrent.futures
 import json
 import os
 import sys
 from dataclasses import asdict, dataclass
+from multiprocessing import shared_memory
 from typing import Callable, Dict, List, Optional, Tuple
 
 import numpy as np
 
-from photo_selector.io.embedding_cache_sqlite import EmbeddingCacheSQLite
-from photo_selector.io.image_reader import read_and_resize
+from photo_selector.config import default_config
+from photo_selector.io.content_key import cache_dir, content_keys_enabled, content_memo
+from photo_selector.io.embedded_preview import read_embedded_preview
+from photo_selector.io.embedding_store import (
+    EMBEDDING_STORE_DIRNAME,
+    LEGACY_SQLITE_FILENAME,
+    EmbeddingStore,
+    open_embedding_store,
+)
+from photo_selector.io.image_reader import read_and_resize, tally_decode_factor
 from photo_selector.io.photo_time import get_capture_timestamp
 from photo_selector.pipeline.models import MetricsResult
+from photo_selector.similarity.inference import (
+    QUANTIZED_MODELS,
+    apply_backend,
+    backend_key_suffix,
+    build_quantized_model,
+    normalize_inference_backend,
+    quantized_transforms,
+    tuned_settings,
+)
+from photo_selector.similarity.perceptual_hash import (
+    hamming_distances,
+    hash_bits,
+    hash_words,
+    is_hash_model,
+    perceptual_hash,
+)
+from photo_selector.similarity.preprocess import BatchPreprocessor
 
 
 def make_embedding_key(
@@ -22,7 +49,131 @@ def make_embedding_key(
     return f"{embed_model}|{thumb_long_edge}|{file_path}|{file_size}|{mtime:.6f}"
 
 
-def _load_torch_model(embed_model: str):
+def embedding_store_dir(output_dir: str) -> str:
+    """The shared store when a cache dir is configured, else one per output dir."""
+    return os.path.join(cache_dir() or output_dir, EMBEDDING_STORE_DIRNAME)
+
+
+def embedding_store_for(output_dir: str) -> EmbeddingStore:
+    """Opens the embedding store for an output dir (imports a legacy embedding_cache.db on first use)."""
+    return open_embedding_store(
+        embedding_store_dir(output_dir),
+        legacy_sqlite_path=os.path.join(output_dir, LEGACY_SQLITE_FILENAME),
+    )
+
+
+CV2_HIST_MODELS = ("cv2_hist", "opencv_hist")
+
+# decode: downscale the main image; embedded: prefer EXIF/MPF previews, fall back to decode
+THUMB_SOURCES = ("decode", "embedded")
+# "index": +-neighbor_window positions; "time": everything within the time window
+NEIGHBOR_MODES = ("index", "time")
+
+
+def is_cv2_hist_model(embed_model: str) -> bool:
+    return (embed_model or "").strip().lower() in CV2_HIST_MODELS
+
+
+def is_builtin_model(embed_model: str) -> bool:
+    """Models computed with OpenCV / NumPy alone (no torch): cv2_hist and the perceptual hashes."""
+    return is_cv2_hist_model(embed_model) or is_hash_model(embed_model)
+
+
+def builtin_embedding_dim(embed_model: str) -> int:
+    """Stored vector length; hashes are kept as their packed bytes viewed as float32."""
+    if is_hash_model(embed_model):
+        return hash_bits(embed_model) // 32
+    return 512
+
+
+def builtin_embedding(img_bgr, embed_model: str) -> np.ndarray:
+    """Vector of a builtin model as stored in the embedding cache (float32)."""
+    if is_hash_model(embed_model):
+        packed = perceptual_hash(img_bgr, embed_model)
+        return np.ascontiguousarray(packed).view(np.float32)
+    return _cv2_hist_embedding(img_bgr)
+
+
+def normalize_thumb_source(thumb_source: Optional[str]) -> str:
+    src = (thumb_source or "decode").strip().lower()
+    return src if src in THUMB_SOURCES else "decode"
+
+
+def normalize_neighbor_mode(neighbor_mode: Optional[str]) -> str:
+    mode = (neighbor_mode or "index").strip().lower()
+    return mode if mode in NEIGHBOR_MODES else "index"
+
+
+def embedding_cache_key(
+    file_path: str,
+    thumb_long_edge: int,
+    embed_model: str,
+    thumb_source: str = "decode",
+    content: Optional[Tuple[str, int]] = None,
+) -> str:
+    """
+    Builds the embedding cache key exactly like compute_embeddings does for this model.
+    With content=(partial hash, size) from io.content_key the key is content-addressed:
+    the path slot holds "#<hash>" and mtime is 0, so it survives moves and copies.
+    """
+    key_model = embedding_key_model(embed_model, thumb_source)
+    if content is not None:
+        return make_embedding_key(f"#{content[0]}", content[1], 0.0, thumb_long_edge, key_model)
+    st = os.stat(file_path)
+    return make_embedding_key(file_path, st.st_size, st.st_mtime, thumb_long_edge, key_model)
+
+
+def embedding_cache_keys(
+    file_paths: List[str],
+    thumb_long_edge: int,
+    embed_model: str,
+    thumb_source: str = "decode",
+) -> List[str]:
+    """Keys for many files; content-addressed when CACHE_KEY_MODE is "content"."""
+    contents = content_memo().hash_many(file_paths) if content_keys_enabled() else [None] * len(file_paths)
+    return [
+        embedding_cache_key(fp, thumb_long_edge, embed_model, thumb_source, content)
+        for fp, content in zip(file_paths, contents)
+    ]
+
+
+def embedding_key_model(embed_model: str, thumb_source: str = "decode", backend: Optional[str] = None) -> str:
+    """The model part of an embedding cache key (backend defaults to INFERENCE_BACKEND)."""
+    if is_builtin_model(embed_model):
+        embed_model = (embed_model or "").strip().lower()
+    else:
+        embed_model = f"{embed_model}{backend_key_suffix(backend)}"
+    if normalize_thumb_source(thumb_source) != "decode":
+        # Vectors from embedded previews differ slightly, keep them apart. "2": previews
+        # follow the EXIF orientation since then; vectors of sideways previews are not reused
+        embed_model = f"{embed_model}+{normalize_thumb_source(thumb_source)}2"
+    return embed_model
+
+
+def parse_embedding_key(key: str) -> Optional[Tuple[str, int, str, int, float]]:
+    """Inverse of make_embedding_key: (embed_model, thumb_long_edge, file_path, file_size, mtime)."""
+    try:
+        embed_model, thumb, rest = key.split("|", 2)
+        file_path, size, mtime = rest.rsplit("|", 2)
+        return embed_model, int(thumb), file_path, int(size), float(mtime)
+    except ValueError:
+        return None
+
+
+# Loaded models stay in memory for the life of the process (see `cli.py serve`)
+_MODEL_CACHE: Dict[Tuple[str, str], tuple] = {}
+
+
+def _load_torch_model(embed_model: str, backend: Optional[str] = None):
+    key = ((embed_model or "").strip().lower(), normalize_inference_backend(backend))
+    if key not in _MODEL_CACHE:
+        torch, model, preprocess, forward_features, feature_dim = _build_torch_model(*key)
+        forward_features = apply_backend(torch, model, forward_features, key[1])
+        _MODEL_CACHE[key] = (torch, model, preprocess, forward_features, feature_dim)
+    return _MODEL_CACHE[key]
+
+
+def _build_torch_model(embed_model: str, backend: str = "fp32"):
     try:
         import torch
         import torchvision
@@ -32,6 +183,10 @@ def _load_torch_model(embed_model: str):
         ) from e
 
     embed_model = (embed_model or "").strip().lower()
+    if backend == "int8":
+        model, preprocess, forward_features, feature_dim = build_quantized_model(torch, torchvision, embed_model)
+        return torch, model, preprocess, forward_features, feature_dim
+
     if embed_model in ("mobilenetv3", "mobilenet_v3_small", "mbv3_small"):
         weights = torchvision.models.MobileNet_V3_Small_Weights.DEFAULT
 
@@ -100,27 +255,44 @@ def _load_torch_model(embed_model: str):
     raise ValueError(f"不支持的 embedding 模型：{embed_model}")
 
 
-def _to_pil_rgb(img_bgr) -> "object":
-    try:
-        from PIL import Image
-    except Exception as e:
-        raise RuntimeError("缺少依赖：Pillow（PIL）。torchvision 的 transforms 需要它。") from e
-
-    import cv2
+# torchvision weights enum per model name; its transforms() is the model's preprocessing
+_WEIGHTS_BY_MODEL = {
+    "mobilenetv3": "MobileNet_V3_Small_Weights",
+    "mobilenet_v3_small": "MobileNet_V3_Small_Weights",
+    "mbv3_small": "MobileNet_V3_Small_Weights",
+    "mobilenet_v3_large": "MobileNet_V3_Large_Weights",
+    "mbv3_large": "MobileNet_V3_Large_Weights",
+    "resnet50": "ResNet50_Weights",
+    "resnet_50": "ResNet50_Weights",
+}
+
+_PREPROCESSORS: Dict[Tuple[str, str], BatchPreprocessor] = {}
+
+
+def _batch_preprocessor(embed_model: str, backend: str = "fp32") -> BatchPreprocessor:
+    """The model's preprocessing without loading its weights, e.g. in decode workers."""
+    model = (embed_model or "").strip().lower()
+    key = (model, backend)
+    if key not in _PREPROCESSORS:
+        if model not in _WEIGHTS_BY_MODEL:
+            raise ValueError(f"不支持的 embedding 模型：{embed_model}")
+        if backend == "int8" and model in QUANTIZED_MODELS:
+            transform = quantized_transforms(model)
+        else:
+            import torchvision
 
-    img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-    return Image.fromarray(img_rgb)
+            transform = getattr(torchvision.models, _WEIGHTS_BY_MODEL[model]).DEFAULT.transforms()
+        _PREPROCESSORS[key] = BatchPreprocessor.from_transform(transform)
+    return _PREPROCESSORS[key]
 
 
-def _l2_normalize(x: np.ndarray, eps: float = 1e-12) -> np.ndarray:
+def l2_normalize(x: np.ndarray, eps: float = 1e-12) -> np.ndarray:
+    """Rows of x scaled to unit length (all-zero rows stay zero)."""
     n = np.linalg.norm(x, axis=1, keepdims=True)
     n = np.maximum(n, eps)
     return x / n
 
 
-def _cosine_sim(a: np.ndarray, b: np.ndarray) -> float:
-    return float(np.dot(a, b))
-
 def _cv2_hist_embedding(img_bgr) -> np.ndarray:
     import cv2
 
@@ -128,153 +300,526 @@ def _cv2_hist_embedding(img_bgr) -> np.ndarray:
     hist = cv2.calcHist([hsv], [0, 1, 2], None, [8, 8, 8], [0, 180, 0, 256, 0, 256])
     hist = hist.astype(np.float32).reshape(1, -1)
     hist = hist / (float(hist.sum()) + 1e-6)
-    hist = _l2_normalize(hist)[0]
+    hist = l2_normalize(hist)[0]
     return hist.astype(np.float32)
 
 
+def _new_thumb_stats() -> Dict:
+    return {"embedded_hit": 0, "embedded_total": 0, "decode_factors": {}}
+
+
+def _merge_thumb_stats(into: Dict, stats: Dict) -> None:
+    into["embedded_hit"] += int(stats.get("embedded_hit", 0))
+    into["embedded_total"] += int(stats.get("embedded_total", 0))
+    for factor, n in stats.get("decode_factors", {}).items():
+        into["decode_factors"][factor] = into["decode_factors"].get(factor, 0) + int(n)
+
+
+def _load_thumb(fp: str, thumb_long_edge: int, thumb_source: str, thumb_stats: Dict):
+    """
+    BGR thumbnail for embedding; counts embedded-preview attempts / hits and
+    the reduction factor of full decodes in thumb_stats (see _new_thumb_stats).
+    """
+    if thumb_source == "embedded":
+        thumb_stats["embedded_total"] += 1
+        img = read_embedded_preview(fp, thumb_long_edge)
+        if img is not None:
+            thumb_stats["embedded_hit"] += 1
+            return img
+    stats: dict = {}
+    img = read_and_resize(fp, target_long_edge=thumb_long_edge, stats=stats)
+    tally_decode_factor(thumb_stats["decode_factors"], stats)
+    return img
+
+
+def _builtin_chunk(
+    file_paths: List[str],
+    embed_model: str,
+    thumb_long_edge: int,
+    thumb_source: str,
+) -> Tuple[List[Optional[bytes]], Dict]:
+    """Worker: builtin-model vectors (None for unreadable files) for a chunk of files."""
+    stats = _new_thumb_stats()
+    out: List[Optional[bytes]] = []
+    for fp in file_paths:
+        img = _load_thumb(fp, thumb_long_edge, thumb_source, stats)
+        out.append(None if img is None else builtin_embedding(img, embed_model).tobytes())
+    return out, stats
+
+
+def _preprocess_chunk(
+    file_paths: List[str],
+    embed_model: str,
+    thumb_long_edge: int,
+    thumb_source: str,
+    shm_name: str,
+    backend: str = "fp32",
+) -> Tuple[List[bool], Dict]:
+    """
+    Worker: decodes and preprocesses a chunk of files straight into the
+    shared-memory batch buffer shm_name: the readable files fill the first
+    rows of a (len(file_paths), C, H, W) float32 array, in order. Returns
+    which files were readable.
+    """
+    stats = _new_thumb_stats()
+    preprocessor = _batch_preprocessor(embed_model, backend)
+    images = [_load_thumb(fp, thumb_long_edge, thumb_source, stats) for fp in file_paths]
+    ok = [img is not None for img in images]
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        batch = np.ndarray((len(file_paths),) + preprocessor.item_shape, dtype=np.float32, buffer=shm.buf)
+        preprocessor([img for img in images if img is not None], out=batch)
+        del batch
+    finally:
+        shm.close()
+    return ok, stats
+
+
+class TorchBatchEmbedder:
+    """
+    Accumulates BGR thumbnails and runs the torch model on full batches.
+    Every computed vector is written to the embedding cache under the key
+    given to `add`; `flush` returns (tag, vec) pairs for the caller.
+
+    backend defaults to INFERENCE_BACKEND and threads to TORCH_THREADS.
+    batch_size / threads <= 0 use the values autotuned for this model,
+    backend and machine (see similarity.inference).
+    """
+
+    def __init__(
+        self,
+        embed_model: str,
+        cache: EmbeddingStore,
+        batch_size: int = 32,
+        device: str = "cpu",
+        backend: Optional[str] = None,
+        threads: Optional[int] = None,
+    ):
+        embed_model_norm = (embed_model or "").strip().lower()
+        self.backend = normalize_inference_backend(backend)
+        self.torch, self.model, self.preprocess, self.forward_features, self.feature_dim = _load_torch_model(
+            embed_model_norm, self.backend
+        )
+        self.model.to(device)
+        self.preprocessor = BatchPreprocessor.from_transform(self.preprocess)
+
+        batch_size = int(batch_size or 0)
+        threads = int(default_config.TORCH_THREADS if threads is None else threads)
+        if batch_size <= 0 or threads <= 0:
+            tuned = tuned_settings(
+                self.torch, embed_model_norm, self.backend, self.forward_features,
+                self.preprocessor.item_shape, device,
+            )
+            batch_size = batch_size if batch_size > 0 else int(tuned["batch_size"])
+            threads = threads if threads > 0 else int(tuned["threads"])
+        self.torch.set_num_threads(threads)
+
+        self.cache = cache
+        self.batch_size = max(1, batch_size)
+        self.device = device
+        # Reused by every flush; torch.from_numpy shares its memory
+        self._buffer = np.empty((self.batch_size,) + self.preprocessor.item_shape, dtype=np.float32)
+        self._images: List[np.ndarray] = []
+        self._keys: List[str] = []
+        self._tags: List[object] = []
+
+    def __len__(self) -> int:
+        return len(self._images)
+
+    def add(self, img_bgr, key: str, tag: object) -> List[Tuple[object, np.ndarray]]:
+        self._images.append(img_bgr)
+        self._keys.append(key)
+        self._tags.append(tag)
+        if len(self._images) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def flush(self) -> List[Tuple[object, np.ndarray]]:
+        if not self._images:
+            return []
+        feats = self.embed_preprocessed(self.preprocessor(self._images, out=self._buffer), self._keys)
+        out = [(tag, feats[bi]) for bi, tag in enumerate(self._tags)]
+        self._images = []
+        self._keys = []
+        self._tags = []
+        return out
+
+    def embed_preprocessed(self, batch: np.ndarray, keys: List[str]) -> np.ndarray:
+        """Runs an already preprocessed (N, C, H, W) float32 batch; vectors are cached under keys."""
+        return self._run(self.torch.from_numpy(batch), keys)
+
+    def _run(self, batch_tensor, keys: List[str]) -> np.ndarray:
+        torch = self.torch
+        with torch.inference_mode():
+            feats = self.forward_features(batch_tensor.to(self.device)).detach().to("cpu").float().numpy()
+        feats = l2_normalize(feats.astype(np.float32))
+        self.cache.set_many((k, feats.shape[1], feats[bi].tobytes()) for bi, k in enumerate(keys))
+        return feats
+
+
 def compute_embeddings(
     file_paths: List[str],
     embed_model: str,
     thumb_long_edge: int,
-    cache: EmbeddingCacheSQLite,
+    cache: EmbeddingStore,
     batch_size: int = 32,
     device: str = "cpu",
-    progress_callback: Optional[Callable[[int, int, int], None]] = None,
+    progress_callback: Optional[Callable[[int, int, int, Dict], None]] = None,
+    thumb_source: str = "decode",
+    workers: int = 1,
+    executor: Optional[concurrent.futures.Executor] = None,
+    keys: Optional[List[str]] = None,
+    decode_factors: Optional[Dict[int, int]] = None,
+    readable: Optional[np.ndarray] = None,
 ) -> Tuple[np.ndarray, int]:
+    """
+    progress_callback receives (done, total, cache_hits, thumb_stats) where
+    thumb_stats counts embedded-preview hits and attempts for thumb_source="embedded".
+    decode_factors, if given, receives how often each JPEG reduction factor
+    was used by this call's decodes, including those done in worker processes.
+    readable, if given (len(file_paths) bools, array or list), is set to which
+    files got an embedding: cached ones and those whose thumbnail loaded.
+    The rows of the others are all zero, which for hash models is also a
+    valid hash, so pass it on to the neighbor search.
+    keys are the files' embedding_cache_keys when the caller already has them.
+
+    Keys are built once per file and looked up in one get_matrix call, so a
+    fully cached folder comes back as a single slice of the store (and the
+    torch model is never loaded).
+
+    With workers > 1 the cache misses are decoded and preprocessed in a
+    process pool (executor, or a private one), one batch per task: torch
+    models get each batch as a ready (N, C, H, W) tensor in a shared-memory
+    buffer, so the model only runs forward passes while the next batches
+    are being decoded.
+
+    Hash models (phash / dhash) return their packed bits as a
+    (n, hash_bits / 8) uint8 matrix instead of float vectors.
+    """
     embed_model_norm = (embed_model or "").strip().lower()
-    if embed_model_norm in ("cv2_hist", "opencv_hist"):
-        feature_dim = 512
-        total = len(file_paths)
-        out = np.zeros((total, feature_dim), dtype=np.float32)
-        cache_hits = 0
-        for i, fp in enumerate(file_paths):
-            st = os.stat(fp)
-            k = make_embedding_key(fp, st.st_size, st.st_mtime, thumb_long_edge, embed_model_norm)
-            cached = cache.get(k)
-            if cached is not None:
-                vec = np.frombuffer(cached, dtype=np.float32)
-                if vec.shape[0] == feature_dim:
-                    out[i] = vec
-                    cache_hits += 1
-                    if progress_callback:
-                        progress_callback(i + 1, total, cache_hits)
-                    continue
-
-            img = read_and_resize(fp, target_long_edge=thumb_long_edge)
-            if img is None:
-                out[i] = np.zeros((feature_dim,), dtype=np.float32)
-                if progress_callback:
-                    progress_callback(i + 1, total, cache_hits)
-                continue
+    thumb_source = normalize_thumb_source(thumb_source)
+    thumb_stats = _new_thumb_stats()
+    if decode_factors is not None:
+        thumb_stats["decode_factors"] = decode_factors
+    builtin = is_builtin_model(embed_model_norm)
+    key_model = embed_model_norm if builtin else embed_model
+
+    def result(mat: np.ndarray) -> Tuple[np.ndarray, int]:
+        if readable is not None:
+            readable[:] = ok
+        return (mat.view(np.uint8) if is_hash_model(embed_model_norm) else mat), cache_hits
 
-            vec = _cv2_hist_embedding(img)
-            out[i] = vec
-            cache.set(k, feature_dim, vec.astype(np.float32).tobytes())
-            if progress_callback:
-                progress_callback(i + 1, total, cache_hits)
-        return out, cache_hits
+    total = len(file_paths)
+    if keys is None:
+        keys = embedding_cache_keys(file_paths, thumb_long_edge, key_model, thumb_source)
+    cached, found = cache.get_matrix(keys, builtin_embedding_dim(embed_model_norm) if builtin else None)
+    cache_hits = int(found.sum())
+
+    embedder = None
+    if builtin:
+        feature_dim = builtin_embedding_dim(embed_model_norm)
+    elif cache_hits == total and total > 0:
+        feature_dim = int(cached.shape[1])
+    else:
+        embedder = TorchBatchEmbedder(embed_model, cache, batch_size=batch_size, device=device)
+        feature_dim = embedder.feature_dim
+        if cached is not None and cached.shape[1] != feature_dim:
+            cached, found, cache_hits = None, np.zeros(total, dtype=bool), 0
+    ok = found.copy()
 
-    torch, model, preprocess, forward_features, feature_dim = _load_torch_model(embed_model_norm)
-    model.to(device)
+    if cache_hits == total and total > 0:
+        if progress_callback:
+            progress_callback(total, total, cache_hits, thumb_stats)
+        return result(cached)
 
-    total = len(file_paths)
     out = np.zeros((total, feature_dim), dtype=np.float32)
-    cache_hits = 0
-
-    batch_images: List[object] = []
-    batch_indices: List[int] = []
+    if cached is not None:
+        out[found] = cached[found]
+    done = cache_hits
+    if progress_callback and cache_hits:
+        progress_callback(done, total, cache_hits, thumb_stats)
+
+    misses = np.flatnonzero(~found)
+    workers = max(1, int(workers or 1))
+    if workers > 1 and misses.size > 1:
+        def on_chunk_done(n: int):
+            if progress_callback:
+                progress_callback(done + n, total, cache_hits, thumb_stats)
 
-    def flush_batch():
-        nonlocal batch_images, batch_indices
-        if not batch_images:
-            return
-        with torch.inference_mode():
-            batch_tensor = torch.stack([preprocess(img) for img in batch_images], dim=0).to(device)
-            feats = forward_features(batch_tensor).detach().to("cpu").float().numpy()
-        feats = _l2_normalize(feats.astype(np.float32))
-        for bi, idx in enumerate(batch_indices):
-            out[idx] = feats[bi]
-            file_path = file_paths[idx]
-            st = os.stat(file_path)
-            k = make_embedding_key(file_path, st.st_size, st.st_mtime, thumb_long_edge, embed_model)
-            cache.set(k, feats.shape[1], feats[bi].astype(np.float32).tobytes())
-        batch_images = []
-        batch_indices = []
-
-    for i, fp in enumerate(file_paths):
-        st = os.stat(fp)
-        k = make_embedding_key(fp, st.st_size, st.st_mtime, thumb_long_edge, embed_model)
-        cached = cache.get(k)
-        if cached is not None:
-            vec = np.frombuffer(cached, dtype=np.float32)
-            if vec.shape[0] == feature_dim:
+        _embed_parallel(
+            misses, file_paths, keys, out, ok, embed_model_norm, thumb_long_edge, thumb_source,
+            cache, embedder, batch_size, workers, executor, thumb_stats, on_chunk_done,
+        )
+        cache.flush()
+        return result(out)
+
+    def store(batch: List[Tuple[object, np.ndarray]]):
+        for idx, vec in batch:
+            out[int(idx)] = vec
+            ok[int(idx)] = True
+
+    new_vectors: List[Tuple[str, int, bytes]] = []
+    for i in misses.tolist():
+        fp = file_paths[i]
+        img = _load_thumb(fp, thumb_long_edge, thumb_source, thumb_stats)
+        if img is not None:
+            if builtin:
+                vec = builtin_embedding(img, embed_model_norm)
                 out[i] = vec
-                cache_hits += 1
-                if progress_callback:
-                    progress_callback(i + 1, total, cache_hits)
-                continue
+                ok[i] = True
+                new_vectors.append((keys[i], feature_dim, vec.tobytes()))
+            else:
+                store(embedder.add(img, keys[i], i))
+        done += 1
+        if progress_callback:
+            progress_callback(done, total, cache_hits, thumb_stats)
 
-        img = read_and_resize(fp, target_long_edge=thumb_long_edge)
-        if img is None:
-            out[i] = np.zeros((feature_dim,), dtype=np.float32)
-            if progress_callback:
-                progress_callback(i + 1, total, cache_hits)
-            continue
+    if embedder is not None:
+        store(embedder.flush())
+    cache.set_many(new_vectors)
+    cache.flush()
+    return result(out)
 
-        pil_img = _to_pil_rgb(img)
-        batch_images.append(pil_img)
-        batch_indices.append(i)
-        if len(batch_images) >= batch_size:
-            flush_batch()
-        if progress_callback:
-            progress_callback(i + 1, total, cache_hits)
 
-    flush_batch()
-    return out, cache_hits
+def _embed_parallel(
+    misses: np.ndarray,
+    file_paths: List[str],
+    keys: List[str],
+    out: np.ndarray,
+    ok: np.ndarray,
+    embed_model_norm: str,
+    thumb_long_edge: int,
+    thumb_source: str,
+    cache: EmbeddingStore,
+    embedder: Optional[TorchBatchEmbedder],
+    batch_size: int,
+    workers: int,
+    executor: Optional[concurrent.futures.Executor],
+    thumb_stats: Dict,
+    on_done: Callable[[int], None],
+) -> None:
+    """
+    Producer/consumer loop for compute_embeddings: at most 2 * workers
+    chunks are in flight, each owning one shared-memory slot (torch models)
+    that is recycled as soon as its batch went through the model. Rows of
+    out that get a vector are flagged in ok.
+    """
+    batch_size = embedder.batch_size if embedder is not None else max(1, int(batch_size or 32))
+    chunks = [misses[s:s + batch_size] for s in range(0, int(misses.size), batch_size)]
+    owns_executor = executor is None
+    if owns_executor:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+
+    slots: List[shared_memory.SharedMemory] = []
+    item_shape: Tuple[int, ...] = ()
+    if embedder is not None:
+        item_shape = embedder.preprocessor.item_shape
+        slot_bytes = batch_size * int(np.prod(item_shape)) * 4
+        slots = [shared_memory.SharedMemory(create=True, size=slot_bytes)
+                 for _ in range(min(len(chunks), 2 * workers))]
+    free_slots = list(range(len(slots)))
+
+    in_flight: Dict[concurrent.futures.Future, Tuple[np.ndarray, int]] = {}
+    next_chunk = 0
+    done = 0
+    max_in_flight = 2 * workers
+
+    def submit() -> None:
+        nonlocal next_chunk
+        chunk = chunks[next_chunk]
+        paths = [file_paths[i] for i in chunk.tolist()]
+        if embedder is None:
+            fut = executor.submit(_builtin_chunk, paths, embed_model_norm, thumb_long_edge, thumb_source)
+            slot = -1
+        else:
+            slot = free_slots.pop()
+            fut = executor.submit(
+                _preprocess_chunk,
+                paths, embed_model_norm, thumb_long_edge, thumb_source, slots[slot].name, embedder.backend,
+            )
+        in_flight[fut] = (chunk, slot)
+        next_chunk += 1
 
+    try:
+        while next_chunk < len(chunks) or in_flight:
+            while next_chunk < len(chunks) and len(in_flight) < max_in_flight and (embedder is None or free_slots):
+                submit()
+            finished, _ = concurrent.futures.wait(list(in_flight), return_when=concurrent.futures.FIRST_COMPLETED)
+            for fut in finished:
+                chunk, slot = in_flight.pop(fut)
+                result, stats = fut.result()
+                _merge_thumb_stats(thumb_stats, stats)
+                if embedder is None:
+                    new_vectors = []
+                    for i, vec_bytes in zip(chunk.tolist(), result):
+                        if vec_bytes is not None:
+                            out[i] = np.frombuffer(vec_bytes, dtype=np.float32)
+                            ok[i] = True
+                            new_vectors.append((keys[i], out.shape[1], vec_bytes))
+                    cache.set_many(new_vectors)
+                else:
+                    rows = chunk[np.array(result, dtype=bool)]
+                    if rows.size:
+                        batch = np.ndarray((len(chunk),) + item_shape, dtype=np.float32, buffer=slots[slot].buf)
+                        out[rows] = embedder.embed_preprocessed(batch[:rows.size], [keys[i] for i in rows.tolist()])
+                        ok[rows] = True
+                        del batch
+                    free_slots.append(slot)
+                done += len(chunk)
+                on_done(done)
+    finally:
+        if owns_executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+        elif in_flight:
+            # Shared executor: let running chunks finish before their buffers go away
+            concurrent.futures.wait(list(in_flight))
+        for shm in slots:
+            shm.close()
+            shm.unlink()
+
+
+# Rows per block in the banded neighbor search
+_NEIGHBOR_BLOCK_ROWS = 512
+# Upper bound on similarity entries per block (dense bursts shrink the block)
+_NEIGHBOR_BLOCK_CELLS = 1 << 22
+
+
+def candidate_ranges(
+    n: int,
+    neighbor_window: int,
+    neighbor_mode: str = "index",
+    time_secs: Optional[float] = None,
+    timestamps: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Per-row candidate range [lo, hi) for the neighbor search.
+
+    "index" mode: +-neighbor_window positions.
+    "time" mode: a searchsorted sweep over the (sorted) timestamps selects
+    everything within +-time_secs, so the work follows the real burst
+    density; neighbor_window > 0 additionally caps the range, <= 0 means
+    no cap. Both bounds are non-decreasing in the row index.
+    """
+    idx = np.arange(n, dtype=np.int64)
+    if normalize_neighbor_mode(neighbor_mode) == "time":
+        if timestamps is None or time_secs is None or time_secs <= 0:
+            raise ValueError("neighbor_mode 'time' needs timestamps and time_secs > 0")
+        ts = timestamps.astype(np.float64, copy=False)
+        if n > 1 and bool(np.any(np.diff(ts) < 0)):
+            raise ValueError("neighbor_mode 'time' needs timestamps sorted ascending")
+        lo = np.searchsorted(ts, ts - time_secs, side="left").astype(np.int64)
+        hi = np.searchsorted(ts, ts + time_secs, side="right").astype(np.int64)
+        cap = int(neighbor_window)
+        if cap > 0:
+            lo = np.maximum(lo, idx - cap)
+            hi = np.minimum(hi, idx + cap + 1)
+        return lo, hi
 
-def dbscan_windowed_cosine(
+    w = max(1, int(neighbor_window))
+    return np.maximum(idx - w, 0), np.minimum(idx + w + 1, n)
+
+
+def windowed_neighbors(
     embs: np.ndarray,
-    eps: float,
-    min_samples: int,
+    sim_threshold: float,
     neighbor_window: int,
     time_secs: Optional[float] = None,
     timestamps: Optional[np.ndarray] = None,
     progress_callback: Optional[Callable[[str, int, int], None]] = None,
-) -> List[int]:
+    neighbor_mode: str = "index",
+    rows: Optional[np.ndarray] = None,
+    readable: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Neighbors inside each row's candidate range (see candidate_ranges) whose
+    cosine similarity is >= sim_threshold (and, with timestamps, at most
+    time_secs apart). For packed uint8 hashes the similarity is
+    1 - Hamming distance / bits, compared via XOR + popcount.
+
+    Rows are processed in contiguous blocks: each block is multiplied once
+    against the band of columns it can reach, and the range / time limits
+    are applied as vectorized masks. Returns CSR arrays (indptr, indices),
+    with each row's neighbors in ascending index order. With rows (sorted
+    row indices) only those rows are searched; all other rows come back empty.
+    Rows that readable (see compute_embeddings) marks False neither have nor
+    are neighbors: their all-zero hashes would all match each other.
+    """
     n = int(embs.shape[0])
-    if n == 0:
-        return []
-
-    sim_threshold = 1.0 - float(eps)
-    neighbor_window = max(1, int(neighbor_window))
-    min_samples = max(1, int(min_samples))
-
-    time_secs_f = float(time_secs) if time_secs is not None else None
+    hashed = embs.dtype == np.uint8
+    if hashed:
+        max_dist = int(np.floor((1.0 - sim_threshold) * embs.shape[1] * 8 + 1e-9))
+        embs = hash_words(embs)
+    else:
+        embs = np.ascontiguousarray(embs)
     ts = None
-    if time_secs_f is not None and time_secs_f > 0 and timestamps is not None and int(timestamps.shape[0]) == n:
+    if time_secs is not None and time_secs > 0 and timestamps is not None and int(timestamps.shape[0]) == n:
         ts = timestamps.astype(np.float64, copy=False)
+    lo, hi = candidate_ranges(n, neighbor_window, neighbor_mode, time_secs, ts)
+    if readable is not None:
+        readable = np.asarray(readable, dtype=bool)
 
-    neighbors: List[List[int]] = [[] for _ in range(n)]
-    for i in range(n):
-        start = max(0, i - neighbor_window)
-        end = min(n, i + neighbor_window + 1)
-        vi = embs[i]
-        for j in range(start, end):
-            if j == i:
-                continue
+    if rows is None:
+        runs = [(0, n)]
+        total = n
+    else:
+        rows = np.asarray(rows, dtype=np.int64)
+        breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+        runs = [(int(r[0]), int(r[-1]) + 1) for r in np.split(rows, breaks) if r.size]
+        total = int(rows.size)
+
+    counts = np.zeros(n, dtype=np.int64)
+    chunks: List[np.ndarray] = []
+    done = 0
+    for run_start, run_end in runs:
+        s = run_start
+        while s < run_end:
+            rows_n = min(_NEIGHBOR_BLOCK_ROWS, run_end - s)
+            while rows_n > 1 and rows_n * int(hi[s + rows_n - 1] - lo[s]) > _NEIGHBOR_BLOCK_CELLS:
+                rows_n //= 2
+            e = s + rows_n
+            c0 = int(lo[s])
+            c1 = int(hi[e - 1])
+            if hashed:
+                close = hamming_distances(embs[s:e], embs[c0:c1]) <= max_dist
+            else:
+                close = embs[s:e] @ embs[c0:c1].T >= sim_threshold
+
+            block_rows = np.arange(s, e)[:, None]
+            cols = np.arange(c0, c1)[None, :]
+            mask = (cols >= lo[s:e, None]) & (cols < hi[s:e, None]) & (cols != block_rows) & close
             if ts is not None:
-                if abs(float(ts[i]) - float(ts[j])) > time_secs_f:
-                    continue
-            if _cosine_sim(vi, embs[j]) >= sim_threshold:
-                neighbors[i].append(j)
-        if progress_callback and (i % 50 == 0 or i == n - 1):
-            progress_callback("neighbors", i + 1, n)
-
-    is_core = [False] * n
-    for i in range(n):
-        if 1 + len(neighbors[i]) >= min_samples:
-            is_core[i] = True
+                mask &= np.abs(ts[s:e, None] - ts[None, c0:c1]) <= time_secs
+            if readable is not None:
+                mask &= readable[s:e, None] & readable[None, c0:c1]
+
+            # nonzero is row-major, so every row's columns come out sorted
+            r, c = np.nonzero(mask)
+            counts[s:e] = np.bincount(r, minlength=e - s)
+            chunks.append(c + c0)
+            done += e - s
+            if progress_callback:
+                progress_callback("neighbors", done, total)
+            s = e
+
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    indices = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int64)
+    return indptr, indices
+
+
+def dbscan_from_neighbors(
+    indptr: np.ndarray,
+    indices: np.ndarray,
+    min_samples: int,
+    progress_callback: Optional[Callable[[str, int, int], None]] = None,
+) -> List[int]:
+    """DBSCAN expansion over a precomputed CSR neighbor graph."""
+    n = int(indptr.shape[0]) - 1
+    min_samples = max(1, int(min_samples))
+    is_core = (1 + np.diff(indptr) >= min_samples).tolist()
+    # Python lists are much faster than numpy scalars in the BFS loop below
+    ptr = indptr.tolist()
+    nbr = indices.tolist()
 
     labels = [-1] * n
     visited = [False] * n
@@ -294,7 +839,7 @@ def dbscan_windowed_cosine(
             qh += 1
             if not is_core[p]:
                 continue
-            for q in neighbors[p]:
+            for q in nbr[ptr[p]:ptr[p + 1]]:
                 if not visited[q]:
                     visited[q] = True
                     if is_core[q]:
@@ -308,6 +853,34 @@ def dbscan_windowed_cosine(
     return labels
 
 
+def dbscan_windowed_cosine(
+    embs: np.ndarray,
+    eps: float,
+    min_samples: int,
+    neighbor_window: int,
+    time_secs: Optional[float] = None,
+    timestamps: Optional[np.ndarray] = None,
+    progress_callback: Optional[Callable[[str, int, int], None]] = None,
+    neighbor_mode: str = "index",
+    readable: Optional[np.ndarray] = None,
+) -> List[int]:
+    n = int(embs.shape[0])
+    if n == 0:
+        return []
+
+    indptr, indices = windowed_neighbors(
+        embs,
+        sim_threshold=1.0 - float(eps),
+        neighbor_window=neighbor_window,
+        time_secs=float(time_secs) if time_secs is not None else None,
+        timestamps=timestamps,
+        progress_callback=progress_callback,
+        neighbor_mode=neighbor_mode,
+        readable=readable,
+    )
+    return dbscan_from_neighbors(indptr, indices, min_samples, progress_callback=progress_callback)
+
+
 @dataclass
 class GroupItem:
     filename: str
@@ -390,6 +963,7 @@ def write_groups_json(
     topk: int,
     groups: List[GroupInfo],
     noise: List[GroupItem],
+    neighbor_mode: str = "index",
 ) -> None:
     payload = {
         "input_dir": input_dir,
@@ -398,6 +972,7 @@ def write_groups_json(
         "eps": float(eps),
         "min_samples": int(min_samples),
         "neighbor_window": int(neighbor_window),
+        "neighbor_mode": str(neighbor_mode),
         "time_window_secs": float(time_window_secs),
         "time_source": str(time_source),
         "topk": int(topk),
@@ -432,10 +1007,26 @@ def run_grouping(
     workers: int,
     batch_size: int,
     progress_callback: Optional[Callable[[Dict], None]] = None,
+    thumb_source: str = "decode",
+    cache: Optional[EmbeddingStore] = None,
+    neighbor_mode: str = "index",
+    executor: Optional[concurrent.futures.Executor] = None,
+    incremental: bool = True,
 ) -> Tuple[List[MetricsResult], str]:
+    """
+    workers / executor parallelize thumbnail decoding and preprocessing for
+    embeddings that are not cached yet (see compute_embeddings).
+
+    With incremental, the neighbor graph and labels of the previous run in
+    output_dir (group_state.*) are reused when the parameters match: only
+    photos whose candidate window changed are searched again, and unchanged
+    groups keep their ids (see group_state.regroup).
+    """
+    from photo_selector.similarity.group_state import GroupState, regroup
+
     os.makedirs(output_dir, exist_ok=True)
-    cache_path = os.path.join(output_dir, "embedding_cache.db")
-    cache = EmbeddingCacheSQLite(cache_path)
+    if cache is None:
+        cache = embedding_store_for(output_dir)
 
     time_source_norm = (time_source or "auto").strip().lower()
     if time_source_norm not in ("auto", "exif", "mtime"):
@@ -470,18 +1061,29 @@ def run_grouping(
     abs_paths = [x[1] for x in photo_paths]
     timestamps = np.array([x[2] for x in photo_paths], dtype=np.float64)
 
-    def on_embed_progress(done: int, total: int, cache_hits: int):
-        if progress_callback:
-            progress_callback(
-                {
-                    "type": "group",
-                    "stage": "embedding",
-                    "done": int(done),
-                    "total": int(total),
-                    "cache_hit": int(cache_hits),
-                }
-            )
+    thumb_source_norm = normalize_thumb_source(thumb_source)
+    key_model = embedding_key_model(embed_model, thumb_source_norm)
+    keys = embedding_cache_keys(abs_paths, thumb_long_edge, embed_model, thumb_source_norm)
 
+    def on_embed_progress(done: int, total: int, cache_hits: int, thumb_stats: Dict):
+        if progress_callback:
+            evt = {
+                "type": "group",
+                "stage": "embedding",
+                "done": int(done),
+                "total": int(total),
+                "cache_hit": int(cache_hits),
+            }
+            if thumb_source_norm == "embedded":
+                attempts = int(thumb_stats.get("embedded_total", 0))
+                hits = int(thumb_stats.get("embedded_hit", 0))
+                evt["embedded_hit"] = hits
+                evt["embedded_total"] = attempts
+                evt["embedded_hit_rate"] = float(hits / attempts) if attempts else 0.0
+            progress_callback(evt)
+
+    decode_factors: Dict[int, int] = {}
+    readable = np.zeros(len(abs_paths), dtype=bool)
     embs, cache_hits = compute_embeddings(
         abs_paths,
         embed_model=embed_model,
@@ -490,6 +1092,12 @@ def run_grouping(
         batch_size=batch_size,
         device="cpu",
         progress_callback=on_embed_progress,
+        thumb_source=thumb_source_norm,
+        workers=workers,
+        executor=executor,
+        keys=keys,
+        decode_factors=decode_factors,
+        readable=readable,
     )
 
     def on_cluster_progress(phase: str, done: int, total: int):
@@ -504,15 +1112,37 @@ def run_grouping(
                 }
             )
 
-    labels = dbscan_windowed_cosine(
-        embs=embs,
+    # Time-bounded windows need the capture-time sort above
+    neighbor_mode_norm = normalize_neighbor_mode(neighbor_mode)
+    if neighbor_mode_norm == "time" and time_window_secs_f <= 0:
+        neighbor_mode_norm = "index"
+
+    params = {
+        "model_key": key_model,
+        "thumb_long_edge": int(thumb_long_edge),
+        "eps": float(eps),
+        "min_samples": int(min_samples),
+        "neighbor_window": int(neighbor_window),
+        "neighbor_mode": neighbor_mode_norm,
+        "time_window_secs": time_window_secs_f,
+        "time_source": time_source_norm,
+    }
+    labels, state, regroup_stats = regroup(
+        embs,
+        filenames,
+        keys,
+        timestamps,
+        params,
         eps=eps,
         min_samples=min_samples,
         neighbor_window=neighbor_window,
         time_secs=time_window_secs_f if time_window_secs_f > 0 else None,
-        timestamps=timestamps if time_window_secs_f > 0 else None,
+        neighbor_mode=neighbor_mode_norm,
+        previous=GroupState.load(output_dir) if incremental else None,
         progress_callback=on_cluster_progress,
+        readable=readable,
     )
+    state.save(output_dir)
     labels_by_filename = {fn: int(labels[i]) for i, fn in enumerate(filenames)}
 
     _, groups, noise = apply_grouping_to_results(results, labels_by_filename, topk=topk)
@@ -531,6 +1161,7 @@ def run_grouping(
         topk=topk,
         groups=groups,
         noise=noise,
+        neighbor_mode=neighbor_mode_norm,
     )
 
     if progress_callback:
@@ -541,6 +1172,8 @@ def run_grouping(
                 "done": 1,
                 "total": 1,
                 "groups_file": groups_path,
+                "regroup": regroup_stats,
+                "decode_factors": {str(k): int(v) for k, v in sorted(decode_factors.items())},
             }
         )
 
@@ -0,0 +1,209 @@
+import json
+import logging
+import os
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from photo_selector.config import default_config
+from photo_selector.io.content_key import metrics_cache_path
+
+logger = logging.getLogger(__name__)
+
+# "fp32": stock float32 model
+# "channels_last": float32 with NHWC memory format (faster oneDNN convolutions)
+# "bf16": channels_last + bfloat16 autocast (CPUs with AVX512-BF16 / AMX)
+# "int8": torchvision's statically quantized weights (fbgemm / x86 engine)
+INFERENCE_BACKENDS = ("fp32", "channels_last", "bf16", "int8")
+
+# Backends whose vectors differ measurably from fp32 get their own cache keys
+_KEYED_BACKENDS = ("bf16", "int8")
+
+# torchvision.models.quantization builder and weights enum per model name
+QUANTIZED_MODELS = {
+    "mobilenet_v3_large": ("mobilenet_v3_large", "MobileNet_V3_Large_QuantizedWeights"),
+    "mbv3_large": ("mobilenet_v3_large", "MobileNet_V3_Large_QuantizedWeights"),
+    "resnet50": ("resnet50", "ResNet50_QuantizedWeights"),
+    "resnet_50": ("resnet50", "ResNet50_QuantizedWeights"),
+}
+
+TUNING_FILENAME = "inference_tuning.json"
+_BATCH_CANDIDATES = (8, 16, 32, 64)
+# Minimum timed duration per (batch size, threads) trial
+_TRIAL_SECS = 0.3
+
+_TUNED: Dict[str, Dict] = {}
+
+
+def normalize_inference_backend(backend: Optional[str] = None) -> str:
+    """backend, or INFERENCE_BACKEND from config when None; unknown names fall back to fp32."""
+    if backend is None:
+        backend = default_config.INFERENCE_BACKEND
+    backend = (backend or "fp32").strip().lower()
+    return backend if backend in INFERENCE_BACKENDS else "fp32"
+
+
+def backend_key_suffix(backend: Optional[str] = None) -> str:
+    """Suffix for the model part of embedding cache keys ("" for fp32-equivalent backends)."""
+    backend = normalize_inference_backend(backend)
+    return f"+{backend}" if backend in _KEYED_BACKENDS else ""
+
+
+def build_quantized_model(torch, torchvision, embed_model: str):
+    """(model, preprocess, forward_features, feature_dim) from torchvision's pre-quantized weights."""
+    entry = QUANTIZED_MODELS.get(embed_model)
+    if entry is None:
+        supported = ", ".join(sorted(QUANTIZED_MODELS))
+        raise ValueError(f"int8 inference needs a model with quantized weights ({supported}), got {embed_model}")
+    builder, weights_name = entry
+    engines = torch.backends.quantized.supported_engines
+    torch.backends.quantized.engine = "x86" if "x86" in engines else "fbgemm"
+    weights = getattr(torchvision.models.quantization, weights_name).DEFAULT
+    model = getattr(torchvision.models.quantization, builder)(weights=weights, quantize=True)
+    model.eval()
+
+    if builder == "resnet50":
+        feature_dim = model.fc.in_features
+        model.fc = torch.nn.Identity()
+
+        def forward_features(x):
+            return model(x)
+    else:
+        feature_dim = model.classifier[0].in_features
+
+        def forward_features(x):
+            x = model.quant(x)
+            x = model.features(x)
+            x = model.avgpool(x)
+            x = torch.flatten(x, 1)
+            return model.dequant(x)
+
+    return model, weights.transforms(), forward_features, feature_dim
+
+
+def quantized_transforms(embed_model: str):
+    """Preprocessing of the quantized weights (may differ from the float weights' resize)."""
+    import torchvision
+
+    _, weights_name = QUANTIZED_MODELS[embed_model]
+    return getattr(torchvision.models.quantization, weights_name).DEFAULT.transforms()
+
+
+def apply_backend(torch, model, forward_features: Callable, backend: str) -> Callable:
+    """Converts a float model for channels_last / bf16 and wraps its forward accordingly."""
+    if backend not in ("channels_last", "bf16"):
+        return forward_features
+    model.to(memory_format=torch.channels_last)
+
+    if backend == "bf16":
+        check = getattr(torch.ops.mkldnn, "_is_mkldnn_bf16_supported", None)
+        if check is not None and not check():
+            logger.warning("This CPU has no native bfloat16 support; bf16 inference will be slow")
+
+        def forward_bf16(x):
+            with torch.autocast("cpu", dtype=torch.bfloat16):
+                return forward_features(x.contiguous(memory_format=torch.channels_last)).float()
+
+        return forward_bf16
+
+    def forward_channels_last(x):
+        return forward_features(x.contiguous(memory_format=torch.channels_last))
+
+    return forward_channels_last
+
+
+def _tuning_path() -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(metrics_cache_path())), TUNING_FILENAME)
+
+
+def _tuning_key(torch, embed_model: str, backend: str, device: str) -> str:
+    return f"{embed_model}|{backend}|{device}|cpus={os.cpu_count() or 1}|torch={torch.__version__}"
+
+
+def autotune(
+    torch,
+    forward_features: Callable,
+    item_shape: Tuple[int, ...],
+    batch_sizes: Tuple[int, ...] = _BATCH_CANDIDATES,
+    thread_counts: Optional[Tuple[int, ...]] = None,
+    device: str = "cpu",
+) -> Dict:
+    """
+    Measures images/s for every thread count and batch size and returns the
+    fastest {"batch_size", "threads", "images_per_sec"}. Larger batches are
+    skipped once throughput stops improving for a thread count.
+    """
+    cpus = os.cpu_count() or 1
+    if not thread_counts:
+        thread_counts = tuple(sorted({cpus, max(1, cpus // 2), max(1, cpus // 4)}, reverse=True))
+    prev_threads = torch.get_num_threads()
+    best: Optional[Dict] = None
+    try:
+        for threads in thread_counts:
+            torch.set_num_threads(int(threads))
+            last_rate = 0.0
+            for bs in batch_sizes:
+                x = torch.rand((int(bs),) + tuple(item_shape)).to(device)
+                with torch.inference_mode():
+                    forward_features(x)  # warm-up: oneDNN primitive creation
+                    runs, start = 0, time.perf_counter()
+                    while True:
+                        forward_features(x)
+                        runs += 1
+                        elapsed = time.perf_counter() - start
+                        if elapsed >= _TRIAL_SECS:
+                            break
+                rate = runs * bs / elapsed
+                logger.debug(f"autotune threads={threads} batch={bs}: {rate:.1f} img/s")
+                # Prefer the smaller batch / fewer threads unless clearly faster
+                if best is None or rate > best["images_per_sec"] * 1.02:
+                    best = {"batch_size": int(bs), "threads": int(threads), "images_per_sec": round(rate, 1)}
+                if rate < last_rate * 1.02:
+                    break
+                last_rate = rate
+    finally:
+        torch.set_num_threads(prev_threads)
+    return best
+
+
+def tuned_settings(
+    torch,
+    embed_model: str,
+    backend: str,
+    forward_features: Callable,
+    item_shape: Tuple[int, ...],
+    device: str = "cpu",
+) -> Dict:
+    """
+    Autotuned batch size / thread count for this model, backend and host.
+    Tuned once, then read back from inference_tuning.json next to the
+    metrics cache.
+    """
+    key = _tuning_key(torch, embed_model, backend, device)
+    if key in _TUNED:
+        return _TUNED[key]
+
+    path = _tuning_path()
+    table: Dict[str, Dict] = {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            table = json.load(f)
+    except (OSError, ValueError):
+        table = {}
+    settings = table.get(key)
+    if not isinstance(settings, dict) or "batch_size" not in settings or "threads" not in settings:
+        logger.info(f"Autotuning {embed_model} ({backend}) inference, this runs once per machine")
+        settings = autotune(torch, forward_features, item_shape, device=device)
+        table[key] = settings
+        tmp = path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(table, f, indent=2, sort_keys=True)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Could not save inference tuning to {path}: {e}")
+        logger.info(
+            f"Tuned {embed_model} ({backend}): batch {settings['batch_size']}, "
+            f"{settings['threads']} threads, {settings['images_per_sec']} img/s"
+        )
+    _TUNED[key] = settings
+    return settings
@@ -0,0 +1,67 @@
+from typing import Dict, Tuple
+
+import numpy as np
+
+# Model name -> (algorithm, side); the hash has side * side bits
+HASH_MODELS: Dict[str, Tuple[str, int]] = {
+    "phash": ("phash", 8),
+    "phash256": ("phash", 16),
+    "dhash": ("dhash", 8),
+    "dhash256": ("dhash", 16),
+}
+
+_POPCOUNT_LUT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def is_hash_model(embed_model: str) -> bool:
+    return (embed_model or "").strip().lower() in HASH_MODELS
+
+
+def hash_bits(embed_model: str) -> int:
+    _, side = HASH_MODELS[(embed_model or "").strip().lower()]
+    return side * side
+
+
+def perceptual_hash(img_bgr: np.ndarray, embed_model: str) -> np.ndarray:
+    """
+    Packed hash bits (uint8, hash_bits / 8 bytes) of a BGR image.
+
+    dhash: sign of the horizontal gradient on a (side + 1) x side grayscale thumbnail.
+    phash: low-frequency side x side DCT coefficients of a 4*side square
+    thumbnail, thresholded at their median.
+    """
+    import cv2
+
+    algo, side = HASH_MODELS[(embed_model or "").strip().lower()]
+    gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY) if img_bgr.ndim == 3 else img_bgr
+    if algo == "dhash":
+        small = cv2.resize(gray, (side + 1, side), interpolation=cv2.INTER_AREA).astype(np.int16)
+        bits = small[:, 1:] > small[:, :-1]
+    else:
+        small = cv2.resize(gray, (4 * side, 4 * side), interpolation=cv2.INTER_AREA).astype(np.float32)
+        low = cv2.dct(small)[:side, :side]
+        bits = low > np.median(low)
+    return np.packbits(bits.reshape(-1))
+
+
+def hash_words(hashes: np.ndarray) -> np.ndarray:
+    """(n, bytes) uint8 packed hashes -> (n, words) uint64, zero-padded to whole words."""
+    n, nbytes = hashes.shape
+    nwords = (nbytes + 7) // 8
+    padded = np.zeros((n, nwords * 8), dtype=np.uint8)
+    padded[:, :nbytes] = hashes
+    return padded.view(np.uint64)
+
+
+def _popcount(x: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x)
+    return _POPCOUNT_LUT[x.view(np.uint8)].reshape(x.shape + (x.itemsize,)).sum(axis=-1, dtype=np.uint8)
+
+
+def hamming_distances(a_words: np.ndarray, b_words: np.ndarray) -> np.ndarray:
+    """All pairwise Hamming distances between two (n, words) uint64 sets, as (len(a), len(b)) uint16."""
+    dist = np.zeros((a_words.shape[0], b_words.shape[0]), dtype=np.uint16)
+    for w in range(a_words.shape[1]):
+        dist += _popcount(a_words[:, w, None] ^ b_words[None, :, w])
+    return dist
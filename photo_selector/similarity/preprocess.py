@@ -0,0 +1,157 @@
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Fixed-point precision of Pillow's 8-bit resampling (libImaging/Resample.c)
+_PRECISION_BITS = 32 - 8 - 2
+
+
+def _bilinear_taps(in_size: int, out_size: int, start: int, count: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pillow's antialiased bilinear coefficients for output pixels
+    [start, start + count) of an in_size -> out_size resize, as
+    (first input index, fixed-point weights) with shapes (count,) / (count, taps).
+    """
+    scale = in_size / out_size
+    filterscale = max(scale, 1.0)
+    support = 1.0 * filterscale
+    taps = int(math.ceil(support)) * 2 + 1
+    first = np.zeros(count, dtype=np.int64)
+    weights = np.zeros((count, taps), dtype=np.int64)
+    for j in range(count):
+        center = (start + j + 0.5) * scale
+        xmin = max(int(center - support + 0.5), 0)
+        xmax = min(int(center + support + 0.5), in_size)
+        w = [max(0.0, 1.0 - abs((x - center + 0.5) / filterscale)) for x in range(xmin, xmax)]
+        total = sum(w)
+        first[j] = xmin
+        for k, wk in enumerate(w):
+            if total != 0.0:
+                wk /= total
+            weights[j, k] = int(wk * (1 << _PRECISION_BITS) + (0.5 if wk >= 0 else -0.5))
+    return first, weights
+
+
+def _resample_axis(img: np.ndarray, first: np.ndarray, weights: np.ndarray, axis: int) -> np.ndarray:
+    """One separable pass over a uint8 batch along axis, rounded and clipped like Pillow."""
+    in_size = img.shape[axis]
+    shape = [1] * img.ndim
+    shape[axis] = first.size
+    # 255 * 2**22 per tap and weights summing to ~2**22 keep the sums inside int32
+    acc = np.full([first.size if a == axis else d for a, d in enumerate(img.shape)],
+                  1 << (_PRECISION_BITS - 1), dtype=np.int32)
+    for k in range(weights.shape[1]):
+        w = weights[:, k]
+        if not w.any():
+            continue
+        idx = np.minimum(first + k, in_size - 1)
+        acc += np.take(img, idx, axis=axis) * w.astype(np.int32).reshape(shape)
+    acc >>= _PRECISION_BITS
+    return np.clip(acc, 0, 255).astype(np.uint8)
+
+
+class BatchPreprocessor:
+    """
+    NumPy / OpenCV version of torchvision's ImageClassification preset
+    (resize the short side with antialiased bilinear, center-crop, scale to
+    [0, 1], normalize) for BGR uint8 thumbnails, writing straight into a
+    caller-provided (N, 3, crop, crop) float32 buffer.
+
+    Thumbnails are normally upscaled here (long edge 256 -> short side
+    256), where Pillow's bilinear filter is plain bilinear interpolation:
+    cv2.resize computes the same samples and differs from Pillow by at most
+    one 8-bit level through rounding. Axes that shrink need Pillow's
+    antialiasing, so those thumbnails go through an exact NumPy port of its
+    fixed-point resampler instead. Scaling and normalization are one
+    per-channel lookup table computed with torchvision's float32 operations.
+    """
+
+    def __init__(
+        self,
+        resize_size: int,
+        crop_size: int,
+        mean: Sequence[float],
+        std: Sequence[float],
+    ):
+        self.resize_size = int(resize_size)
+        self.crop_size = int(crop_size)
+        mean32 = np.asarray(mean, dtype=np.float32).reshape(3, 1)
+        std32 = np.asarray(std, dtype=np.float32).reshape(3, 1)
+        levels = np.arange(256, dtype=np.float32).reshape(1, 256)
+        # RGB channel c, 8-bit level v -> (v / 255 - mean[c]) / std[c]
+        self._lut = (levels / np.float32(255.0) - mean32) / std32
+        self._plans: Dict[Tuple[int, int], tuple] = {}
+
+    @classmethod
+    def from_transform(cls, transform) -> "BatchPreprocessor":
+        """From a torchvision weights' transforms() (ImageClassification)."""
+        interpolation = str(getattr(transform, "interpolation", "bilinear")).lower()
+        if "bilinear" not in interpolation or getattr(transform, "antialias", True) is False:
+            raise ValueError(f"Unsupported preprocessing for batched path: {transform}")
+        return cls(transform.resize_size[0], transform.crop_size[0], transform.mean, transform.std)
+
+    @property
+    def item_shape(self) -> Tuple[int, int, int]:
+        return (3, self.crop_size, self.crop_size)
+
+    def _plan(self, h: int, w: int) -> tuple:
+        plan = self._plans.get((h, w))
+        if plan is None:
+            # torchvision: short side -> resize_size, long side truncated
+            short, long = (w, h) if w <= h else (h, w)
+            new_long = int(self.resize_size * long / short)
+            new_w, new_h = (self.resize_size, new_long) if w <= h else (new_long, self.resize_size)
+            if new_w < self.crop_size or new_h < self.crop_size:
+                raise ValueError(f"Resized {new_w}x{new_h} is smaller than the {self.crop_size}px crop")
+            top = int(round((new_h - self.crop_size) / 2.0))
+            left = int(round((new_w - self.crop_size) / 2.0))
+            if new_w >= w and new_h >= h:
+                plan = ("cv2", new_w, new_h, top, left)
+            else:
+                rows = _bilinear_taps(h, new_h, top, self.crop_size)
+                cols = _bilinear_taps(w, new_w, left, self.crop_size)
+                # Input rows the vertical pass reads; the horizontal pass skips the rest
+                lo = int(rows[0].min())
+                hi = int(min(h, rows[0].max() + rows[1].shape[1]))
+                plan = ("taps", rows[0] - lo, rows[1], cols[0], cols[1], lo, hi)
+            self._plans[(h, w)] = plan
+        return plan
+
+    def _normalize_into(self, crops_bgr: np.ndarray, out: np.ndarray) -> None:
+        """(n, crop, crop, 3) uint8 BGR -> (n, 3, crop, crop) normalized RGB."""
+        for c in range(3):
+            np.take(self._lut[c], crops_bgr[..., 2 - c], out=out[:, c])
+
+    def __call__(self, images_bgr: List[np.ndarray], out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Preprocesses images into out[:len(images_bgr)] (allocated when None) and returns that slice."""
+        import cv2
+
+        n = len(images_bgr)
+        if out is None:
+            out = np.empty((n,) + self.item_shape, dtype=np.float32)
+        crop = self.crop_size
+        shrinking: Dict[Tuple[int, int], List[int]] = {}
+        for i, img in enumerate(images_bgr):
+            plan = self._plan(*img.shape[:2])
+            if plan[0] == "taps":
+                shrinking.setdefault(img.shape[:2], []).append(i)
+                continue
+            _, new_w, new_h, top, left = plan
+            if (new_w, new_h) != (img.shape[1], img.shape[0]):
+                img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+            self._normalize_into(img[None, top:top + crop, left:left + crop], out[i:i + 1])
+
+        for shape, idxs in shrinking.items():
+            _, row_first, row_w, col_first, col_w, lo, hi = self._plan(*shape)
+            # (n, h, w, 3); Pillow also runs the horizontal pass first
+            batch = np.stack([images_bgr[i][lo:hi] for i in idxs])
+            tmp = _resample_axis(batch, col_first, col_w, axis=2)
+            crops = _resample_axis(tmp, row_first, row_w, axis=1)
+            if idxs == list(range(idxs[0], idxs[-1] + 1)):
+                self._normalize_into(crops, out[idxs[0]:idxs[-1] + 1])
+            else:
+                normalized = np.empty((len(idxs),) + self.item_shape, dtype=np.float32)
+                self._normalize_into(crops, normalized)
+                out[idxs] = normalized
+        return out[:n]
@@ -0,0 +1,73 @@
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from photo_selector.io.embedding_store import EmbeddingStore  # noqa: E402
+from photo_selector.similarity.ann_index import IvfIndex, run_library_dedup  # noqa: E402
+from photo_selector.similarity.grouping import make_embedding_key  # noqa: E402
+
+
+def _fill_cache(store_dir: str, n: int = 2000, dim: int = 32):
+    rng = np.random.default_rng(0)
+    vecs = rng.normal(size=(n, dim)).astype(np.float32)
+    # Every 100th photo has a near-duplicate copy in another folder
+    dups = {i: i + 1 for i in range(0, n, 100)}
+    for i, j in dups.items():
+        vecs[j] = vecs[i] + rng.normal(scale=0.01, size=dim).astype(np.float32)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+
+    store = EmbeddingStore(store_dir)
+    store.set_many(
+        (make_embedding_key(f"/lib/{'b' if i in dups.values() else 'a'}/{i:05d}.jpg", 1000, 1.0, 256, "cv2_hist"),
+         dim, vecs[i].tobytes())
+        for i in range(n)
+    )
+    # Another model must not leak into the index
+    store.set(make_embedding_key("/lib/a/other.jpg", 1000, 1.0, 256, "resnet18"), dim, vecs[0].tobytes())
+    store.close()
+    return vecs, dups
+
+
+def test_search_and_library_dedup():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_path = os.path.join(tmp, "embedding_store")
+        vecs, dups = _fill_cache(cache_path)
+        index = IvfIndex.build(
+            [cache_path], os.path.join(tmp, "ann_index"), "cv2_hist", 256, check_files=False
+        )
+        assert index.size == vecs.shape[0]
+
+        index = IvfIndex.load(os.path.join(tmp, "ann_index"))
+        assert index.is_current([cache_path])
+        hits = index.search(vecs[300], k=2, nprobe=4)
+        assert hits[0][0] == "/lib/a/00300.jpg"
+        assert hits[1][0] == "/lib/b/00301.jpg"
+
+        out = os.path.join(tmp, "duplicates.json")
+        # The copy in b scores higher, so it is the best photo of its group
+        run_library_dedup(index, out, eps=0.01, nprobe=4, scores={"/lib/b/00301.jpg": 80.0})
+        with open(out, "r", encoding="utf-8") as f:
+            groups = json.load(f)["groups"]
+        found = {tuple(sorted(it["filename"] for it in g["items"])) for g in groups}
+        expected = {(f"/lib/a/{i:05d}.jpg", f"/lib/b/{j:05d}.jpg") for i, j in dups.items()}
+        assert found == expected
+        group = next(g for g in groups if "/lib/b/00301.jpg" in [it["filename"] for it in g["items"]])
+        assert group["best"] == ["/lib/b/00301.jpg"]
+
+        # New embeddings in the cache make the index stale
+        store = EmbeddingStore(cache_path)
+        store.set(make_embedding_key("/lib/c/new.jpg", 1000, 1.0, 256, "cv2_hist"), 32, vecs[0].tobytes())
+        store.close()
+        assert not index.is_current([cache_path])
+
+
+if __name__ == "__main__":
+    test_search_and_library_dedup()
+    print("ok")
@@ -0,0 +1,67 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from photo_selector.similarity.group_state import GroupState, regroup  # noqa: E402
+
+
+def _bursts(rng: np.random.Generator, n_bursts: int, size: int, dim: int = 16):
+    """Unit vectors in bursts of near-duplicates, bursts one minute apart."""
+    centers = rng.normal(size=(n_bursts, dim))
+    embs = np.repeat(centers, size, axis=0) + rng.normal(scale=0.05, size=(n_bursts * size, dim))
+    embs /= np.linalg.norm(embs, axis=1, keepdims=True)
+    ts = np.repeat(np.arange(n_bursts) * 60.0, size) + np.tile(np.arange(size, dtype=np.float64), n_bursts)
+    names = [f"img_{i:04d}.jpg" for i in range(len(ts))]
+    return embs.astype(np.float32), ts, names
+
+
+def _partition(labels, names):
+    groups = {}
+    for lab, name in zip(labels, names):
+        if lab >= 0:
+            groups.setdefault(lab, set()).add(name)
+    return sorted(sorted(g) for g in groups.values())
+
+
+def test_incremental_matches_full_run_and_keeps_ids():
+    rng = np.random.default_rng(0)
+    embs, ts, names = _bursts(rng, 30, 4)
+    keys = [f"k|{n}" for n in names]
+    params = {"model_key": "test", "eps": 0.1}
+    kwargs = dict(eps=0.1, min_samples=2, neighbor_window=6, time_secs=10.0, neighbor_mode="time")
+
+    # First run sees every burst but one
+    keep = np.ones(len(names), dtype=bool)
+    keep[40:44] = False
+    first, state, stats = regroup(
+        embs[keep], [n for n, k in zip(names, keep) if k], [k for k, m in zip(keys, keep) if m], ts[keep], params, **kwargs
+    )
+    assert not stats["incremental"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        state.save(tmp)
+        previous = GroupState.load(tmp)
+    labels, _, stats = regroup(embs, names, keys, ts, params, previous=previous, **kwargs)
+    assert stats["incremental"]
+    assert stats["rows_searched"] < len(names) // 4
+
+    full, _, _ = regroup(embs, names, keys, ts, params, **kwargs)
+    assert _partition(labels, names) == _partition(full, names)
+
+    old = dict(zip(previous.filenames, previous.labels.tolist()))
+    for name, lab in zip(names, labels):
+        if name in old and old[name] >= 0:
+            assert lab == old[name]
+    assert len({labels[i] for i in range(40, 44)}) == 1
+    assert labels[40] not in old.values()
+
+
+if __name__ == "__main__":
+    test_incremental_matches_full_run_and_keeps_ids()
+    print("ok")
@@ -0,0 +1,109 @@
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import types
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from photo_selector.config import default_config  # noqa: E402
+from photo_selector.similarity import inference  # noqa: E402
+from photo_selector.similarity.grouping import embedding_key_model  # noqa: E402
+from photo_selector.similarity.inference import (  # noqa: E402
+    TUNING_FILENAME,
+    backend_key_suffix,
+    normalize_inference_backend,
+    tuned_settings,
+)
+
+
+class _Tensor:
+    def __init__(self, shape):
+        self.shape = shape
+
+    def to(self, device):
+        return self
+
+
+def _fake_torch():
+    """Just the parts of torch that autotune touches; the model is the stub forward below."""
+    state = {"threads": 4}
+    return types.SimpleNamespace(
+        __version__="0.0-test",
+        get_num_threads=lambda: state["threads"],
+        set_num_threads=lambda n: state.update(threads=n),
+        rand=_Tensor,
+        inference_mode=contextlib.nullcontext,
+        state=state,
+    )
+
+
+def test_backend_names_and_cache_keys():
+    backend = default_config.INFERENCE_BACKEND
+    try:
+        assert normalize_inference_backend(" BF16 ") == "bf16"
+        assert normalize_inference_backend("tensorrt") == "fp32"
+        assert normalize_inference_backend("") == "fp32"
+        default_config.INFERENCE_BACKEND = "int8"
+        assert normalize_inference_backend() == "int8"
+
+        # Only backends whose vectors differ from fp32 get their own cache keys
+        assert backend_key_suffix("fp32") == backend_key_suffix("channels_last") == ""
+        assert backend_key_suffix("bf16") == "+bf16"
+        assert backend_key_suffix() == "+int8"
+        assert embedding_key_model("resnet18") == "resnet18+int8"
+        assert embedding_key_model("resnet18", backend="channels_last") == "resnet18"
+        assert embedding_key_model("cv2_hist") == "cv2_hist"
+    finally:
+        default_config.INFERENCE_BACKEND = backend
+
+
+def test_autotune_picks_fastest_and_persists():
+    torch = _fake_torch()
+    clock = {"now": 0.0}
+    calls = []
+
+    def forward(x):
+        # Simulated cost: throughput scales with threads and with batch size up to 16
+        bs, threads = x.shape[0], torch.state["threads"]
+        calls.append((bs, threads))
+        clock["now"] += bs / (threads * min(bs, 16) * 100.0)
+
+    real_time = inference.time
+    cache_dir = default_config.CACHE_DIR
+    inference.time = types.SimpleNamespace(perf_counter=lambda: clock["now"])
+    inference._TUNED.clear()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            default_config.CACHE_DIR = tmp
+            cpus = os.cpu_count() or 1
+            settings = tuned_settings(torch, "resnet18", "fp32", forward, (3, 8, 8))
+            assert settings == {"batch_size": 16, "threads": cpus, "images_per_sec": cpus * 1600.0}
+            # 32 is no faster than 16, so 64 is never tried
+            assert max(bs for bs, _ in calls) == 32
+            assert torch.state["threads"] == 4  # restored after tuning
+
+            with open(os.path.join(tmp, TUNING_FILENAME), "r", encoding="utf-8") as f:
+                assert list(json.load(f).values()) == [settings]
+
+            # A new process (empty memo) reads the file back without timing anything
+            inference._TUNED.clear()
+            calls.clear()
+            assert tuned_settings(torch, "resnet18", "fp32", forward, (3, 8, 8)) == settings
+            assert calls == []
+            # Another backend is tuned separately
+            tuned_settings(torch, "resnet18", "bf16", forward, (3, 8, 8))
+            assert calls
+    finally:
+        inference.time = real_time
+        default_config.CACHE_DIR = cache_dir
+        inference._TUNED.clear()
+
+
+if __name__ == "__main__":
+    test_backend_names_and_cache_keys()
+    test_autotune_picks_fastest_and_persists()
+    print("ok")
@@ -0,0 +1,51 @@
+import os
+import sys
+import tempfile
+
+import cv2
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from photo_selector.io.embedding_store import EmbeddingStore  # noqa: E402
+from photo_selector.similarity.grouping import compute_embeddings  # noqa: E402
+
+
+def test_parallel_decode_matches_serial():
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i in range(7):
+            img = rng.integers(0, 256, size=(48, 64, 3), dtype=np.uint8)
+            path = os.path.join(tmp, f"{i:02d}.jpg")
+            cv2.imwrite(path, img)
+            paths.append(path)
+        broken = os.path.join(tmp, "broken.jpg")
+        with open(broken, "wb") as f:
+            f.write(b"not a jpeg")
+        paths.insert(3, broken)
+
+        serial, _ = compute_embeddings(paths, "cv2_hist", 32, EmbeddingStore(os.path.join(tmp, "a")))
+        factors = {}
+        parallel, hits = compute_embeddings(
+            paths, "cv2_hist", 32, EmbeddingStore(os.path.join(tmp, "b")), batch_size=3, workers=2,
+            decode_factors=factors,
+        )
+        assert hits == 0
+        # Decodes happen in the pool processes; their counts come back with the chunks
+        assert factors == {2: 7, 0: 1}
+        np.testing.assert_array_equal(serial, parallel)
+        assert not parallel[3].any()
+
+        cached, hits = compute_embeddings(
+            paths, "cv2_hist", 32, EmbeddingStore(os.path.join(tmp, "b")), batch_size=3, workers=2
+        )
+        assert hits == len(paths) - 1
+        np.testing.assert_array_equal(serial, cached)
+
+
+if __name__ == "__main__":
+    test_parallel_decode_matches_serial()
+    print("ok")
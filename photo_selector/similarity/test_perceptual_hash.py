@@ -0,0 +1,100 @@
+import os
+import sys
+import tempfile
+
+import cv2
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from photo_selector.io.embedding_store import EmbeddingStore  # noqa: E402
+from photo_selector.similarity.grouping import (  # noqa: E402
+    compute_embeddings,
+    dbscan_windowed_cosine,
+    windowed_neighbors,
+)
+from photo_selector.similarity.perceptual_hash import (  # noqa: E402
+    hamming_distances,
+    hash_words,
+    perceptual_hash,
+)
+
+
+def _scene(rng: np.random.Generator) -> np.ndarray:
+    small = rng.integers(0, 256, size=(12, 18, 3), dtype=np.uint8)
+    return cv2.resize(small, (384, 256), interpolation=cv2.INTER_CUBIC)
+
+
+def test_hashes_survive_resize_and_exposure():
+    rng = np.random.default_rng(0)
+    scenes = [_scene(rng) for _ in range(4)]
+    for model, bits in (("phash", 64), ("dhash", 64), ("phash256", 256), ("dhash256", 256)):
+        hashes = []
+        for img in scenes:
+            variant = cv2.convertScaleAbs(cv2.resize(img, (300, 200), interpolation=cv2.INTER_AREA), alpha=1.1, beta=8)
+            hashes.extend([perceptual_hash(img, model), perceptual_hash(variant, model)])
+        packed = np.stack(hashes)
+        assert packed.shape == (8, bits // 8)
+        dist = hamming_distances(hash_words(packed), hash_words(packed))
+        same = [dist[i, i + 1] for i in range(0, 8, 2)]
+        other = [dist[i, j] for i in range(0, 8, 2) for j in range(0, 8, 2) if i != j]
+        assert max(same) <= bits * 0.1, (model, same)
+        assert min(other) > bits * 0.2, (model, other)
+
+
+def test_hamming_neighbors_match_pairwise():
+    rng = np.random.default_rng(1)
+    base = rng.integers(0, 256, size=(40, 32), dtype=np.uint8)
+    # Bursts: each hash repeated with a few flipped bits
+    hashes = np.repeat(base, 5, axis=0)
+    flips = rng.integers(0, 256, size=hashes.shape, dtype=np.uint8) & (rng.random(hashes.shape) < 0.05)
+    hashes ^= flips.astype(np.uint8)
+
+    eps, window = 0.08, 7
+    indptr, indices = windowed_neighbors(hashes, 1.0 - eps, window)
+    bits = np.unpackbits(hashes, axis=1).astype(np.int64)
+    dist = (bits[:, None, :] != bits[None, :, :]).sum(axis=2)
+    for i in range(hashes.shape[0]):
+        expected = [
+            j for j in range(max(0, i - window), min(hashes.shape[0], i + window + 1))
+            if j != i and dist[i, j] <= int(eps * 256)
+        ]
+        assert indices[indptr[i]:indptr[i + 1]].tolist() == expected
+
+    labels = dbscan_windowed_cosine(hashes, eps=eps, min_samples=2, neighbor_window=window)
+    assert len(set(labels) - {-1}) == 40
+
+
+def test_unreadable_files_never_group():
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i in range(3):
+            paths.append(os.path.join(tmp, f"bad{i}.jpg"))
+            with open(paths[-1], "wb") as f:
+                f.write(b"not a jpeg " * (i + 1))
+        # Flat frames hash to (nearly) zero, like the rows of unreadable files, and must still group
+        for i in range(2):
+            paths.append(os.path.join(tmp, f"flat{i}.jpg"))
+            cv2.imwrite(paths[-1], np.full((120, 160, 3), 128, dtype=np.uint8))
+
+        for model in ("phash", "dhash"):
+            store = EmbeddingStore(os.path.join(tmp, model))
+            for attempt in range(2):
+                readable = np.zeros(len(paths), dtype=bool)
+                hashes, hits = compute_embeddings(paths, model, 64, store, readable=readable)
+                # The second run reads the flat frames from the cache
+                assert hits == 2 * attempt
+                assert readable.tolist() == [False, False, False, True, True]
+                assert not hashes[:3].any()
+
+                labels = dbscan_windowed_cosine(hashes, eps=0.1, min_samples=2, neighbor_window=10, readable=readable)
+                assert labels == [-1, -1, -1, 0, 0], (model, labels)
+
+
+if __name__ == "__main__":
+    test_hashes_survive_resize_and_exposure()
+    test_hamming_neighbors_match_pairwise()
+    test_unreadable_files_never_group()
+    print("ok")
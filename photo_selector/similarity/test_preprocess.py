@@ -0,0 +1,56 @@
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from photo_selector.similarity.preprocess import BatchPreprocessor  # noqa: E402
+
+MEAN = [0.485, 0.456, 0.406]
+STD = [0.229, 0.224, 0.225]
+
+
+def _pil_reference(img_bgr: np.ndarray, resize_size: int, crop_size: int) -> np.ndarray:
+    """What torchvision's ImageClassification preset does to a PIL image."""
+    pil = Image.fromarray(np.ascontiguousarray(img_bgr[:, :, ::-1]))
+    w, h = pil.size
+    short, long = (w, h) if w <= h else (h, w)
+    new_long = int(resize_size * long / short)
+    new_w, new_h = (resize_size, new_long) if w <= h else (new_long, resize_size)
+    pil = pil.resize((new_w, new_h), Image.BILINEAR)
+    top = int(round((new_h - crop_size) / 2.0))
+    left = int(round((new_w - crop_size) / 2.0))
+    x = np.asarray(pil)[top:top + crop_size, left:left + crop_size].transpose(2, 0, 1).astype(np.float32)
+    x /= np.float32(255.0)
+    x -= np.asarray(MEAN, dtype=np.float32).reshape(3, 1, 1)
+    x /= np.asarray(STD, dtype=np.float32).reshape(3, 1, 1)
+    return x
+
+
+def test_matches_torchvision_preprocessing():
+    rng = np.random.default_rng(0)
+    pre = BatchPreprocessor(256, 224, MEAN, STD)
+    # Upscaled thumbnails (landscape, portrait, square) and a shrinking one
+    shapes = [(170, 256), (256, 170), (170, 256), (256, 256), (600, 900)]
+    images = [rng.integers(0, 256, size=s + (3,), dtype=np.uint8) for s in shapes]
+    out = np.full((8,) + pre.item_shape, np.nan, dtype=np.float32)
+    batch = pre(images, out=out)
+    assert batch.shape == (len(images),) + pre.item_shape
+    assert np.isnan(out[len(images):]).all()
+
+    levels = np.asarray(STD, dtype=np.float32).reshape(3, 1, 1) * 255.0
+    for img, got in zip(images, batch):
+        diff = np.abs(got - _pil_reference(img, 256, 224)) * levels
+        if img.shape[0] < 256 or img.shape[1] < 256:
+            assert diff.max() <= 1.0 + 1e-3
+        else:
+            assert diff.max() == 0.0
+
+
+if __name__ == "__main__":
+    test_matches_torchvision_preprocessing()
+    print("ok")
@@ -6,7 +6,7 @@ PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
-from photo_selector.similarity.grouping import dbscan_windowed_cosine
+from photo_selector.similarity.grouping import candidate_ranges, dbscan_windowed_cosine, windowed_neighbors
 
 
 def test_time_window_splits_clusters():
@@ -47,6 +47,50 @@ def test_time_window_splits_clusters():
     assert labels_time[0] != labels_time[2]
 
 
+def test_blocked_neighbors_match_pairwise_scan():
+    rng = np.random.default_rng(0)
+    n = 1300  # spans several row blocks
+    embs = rng.normal(size=(n, 8)).astype(np.float32)
+    embs /= np.linalg.norm(embs, axis=1, keepdims=True)
+    ts = np.cumsum(rng.exponential(1.0, n))
+
+    indptr, indices = windowed_neighbors(embs, 0.5, 40, time_secs=5.0, timestamps=ts)
+    for i in range(n):
+        expected = [
+            j
+            for j in range(max(0, i - 40), min(n, i + 41))
+            if j != i and abs(ts[i] - ts[j]) <= 5.0 and float(np.dot(embs[i], embs[j])) >= 0.5
+        ]
+        assert indices[indptr[i]:indptr[i + 1]].tolist() == expected
+
+
+def test_time_mode_follows_burst_density():
+    # 20 fps burst of 100 frames, then sparse shots a minute apart
+    ts = np.concatenate([np.arange(100) * 0.05, 100.0 + np.arange(5) * 60.0])
+    embs = np.tile(np.array([[1.0, 0.0]], dtype=np.float32), (ts.shape[0], 1))
+
+    lo, hi = candidate_ranges(ts.shape[0], 0, "time", time_secs=6.0, timestamps=ts)
+    assert (lo[:100] == 0).all() and (hi[:100] == 100).all()
+    assert (hi[100:] - lo[100:] == 1).all()
+
+    labels = dbscan_windowed_cosine(
+        embs, eps=0.01, min_samples=90, neighbor_window=0, time_secs=6.0, timestamps=ts, neighbor_mode="time"
+    )
+    assert set(labels[:100]) == {0}
+    assert set(labels[100:]) == {-1}
+    # An index window of 30 cannot see 90 neighbors
+    labels_index = dbscan_windowed_cosine(
+        embs, eps=0.01, min_samples=90, neighbor_window=30, time_secs=6.0, timestamps=ts
+    )
+    assert set(labels_index) == {-1}
+
+    # The cap still bounds the range
+    indptr, _ = windowed_neighbors(embs, 0.99, 10, time_secs=6.0, timestamps=ts, neighbor_mode="time")
+    assert int(np.diff(indptr).max()) == 20
+
+
 if __name__ == "__main__":
     test_time_window_splits_clusters()
+    test_blocked_neighbors_match_pairwise_scan()
+    test_time_mode_follows_burst_density()
     print("ok")
@@ -0,0 +1,89 @@
+"""
+Import-time breakdown for `cli.py --startup-timing`.
+
+Only uses the standard library so it can be installed before any other
+photo_selector import. The hook wraps builtins.__import__ and records, for
+every module loaded for the first time, its own (exclusive) and cumulative
+import time.
+"""
+import builtins
+import sys
+import time
+from typing import Dict, List, Optional
+
+_T0 = time.perf_counter()
+
+
+class ImportTimer:
+    def __init__(self):
+        self.records: List[Dict] = []
+        self._stack: List[float] = []
+        self._orig_import = builtins.__import__
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return self._orig_import(name, globals, locals, fromlist, level)
+        start = time.perf_counter()
+        self._stack.append(0.0)
+        try:
+            return self._orig_import(name, globals, locals, fromlist, level)
+        finally:
+            children = self._stack.pop()
+            elapsed = time.perf_counter() - start
+            if self._stack:
+                self._stack[-1] += elapsed
+            self.records.append(
+                {
+                    "module": name,
+                    "self_ms": round((elapsed - children) * 1000.0, 3),
+                    "cumulative_ms": round(elapsed * 1000.0, 3),
+                    "depth": len(self._stack),
+                }
+            )
+
+    def install(self) -> "ImportTimer":
+        builtins.__import__ = self._import
+        return self
+
+    def uninstall(self) -> None:
+        builtins.__import__ = self._orig_import
+
+    def elapsed_ms(self) -> float:
+        """Milliseconds since this module was first imported."""
+        return round((time.perf_counter() - _T0) * 1000.0, 3)
+
+    def report(self, top: int = 15) -> Dict:
+        """Summary event: totals, the slowest modules and time per top-level package."""
+        total = sum(r["cumulative_ms"] for r in self.records if r["depth"] == 0)
+        by_package: Dict[str, float] = {}
+        for r in self.records:
+            pkg = r["module"].split(".")[0]
+            by_package[pkg] = by_package.get(pkg, 0.0) + r["self_ms"]
+        slowest = sorted(self.records, key=lambda r: -r["self_ms"])[:top]
+        return {
+            "type": "startup_timing",
+            "total_ms": self.elapsed_ms(),
+            "imports_ms": round(total, 3),
+            "modules_loaded": len(self.records),
+            "by_package": {
+                k: round(v, 3) for k, v in sorted(by_package.items(), key=lambda kv: -kv[1])[:top]
+            },
+            "slowest": [
+                {"module": r["module"], "self_ms": r["self_ms"], "cumulative_ms": r["cumulative_ms"]}
+                for r in slowest
+            ],
+        }
+
+
+_timer: Optional[ImportTimer] = None
+
+
+def install_if_requested(argv: List[str]) -> Optional[ImportTimer]:
+    global _timer
+    if "--startup-timing" in argv and _timer is None:
+        _timer = ImportTimer().install()
+    return _timer
+
+
+def active_timer() -> Optional[ImportTimer]:
+    return _timer
@@ -0,0 +1,150 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import cv2
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+
+def _env():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = PROJECT_ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    return env
+
+
+def _write_photos(folder: str, count: int):
+    rng = np.random.default_rng(0)
+    for i in range(count):
+        img = cv2.GaussianBlur(rng.integers(0, 256, size=(120, 160, 3), dtype=np.uint8), (0, 0), 1.0 + i)
+        cv2.imwrite(os.path.join(folder, f"{i:02d}.jpg"), img)
+
+
+def _run_cli(cwd: str, *args: str):
+    proc = subprocess.run(
+        [sys.executable, "-m", "photo_selector.cli", *args],
+        capture_output=True,
+        text=True,
+        cwd=cwd,
+        env=_env(),
+        timeout=120,
+    )
+    assert proc.returncode == 0, proc.stderr
+    return [json.loads(line) for line in proc.stdout.splitlines()]
+
+
+def test_serve_job_round_trip():
+    with tempfile.TemporaryDirectory() as tmp:
+        photos = os.path.join(tmp, "photos")
+        os.makedirs(photos)
+        _write_photos(photos, 3)
+        jobs = [
+            {"id": "1", "command": "compute", "args": {"input_dir": photos, "cache_dir": tmp, "workers": 1}},
+            {"id": "2", "command": "query", "args": {"input_dir": photos, "sort": "technical_score", "limit": 2}},
+            {"id": "3", "command": "query", "args": ["--help"]},
+            {"id": "4", "command": "compute", "args": {"workers": 1}},
+            {"id": "5", "command": "ping"},
+            {"command": "shutdown"},
+        ]
+        proc = subprocess.run(
+            [sys.executable, "-m", "photo_selector.cli", "serve"],
+            input="".join(json.dumps(j) + "\n" for j in jobs),
+            capture_output=True,
+            text=True,
+            cwd=tmp,
+            env=_env(),
+            timeout=120,
+        )
+        assert proc.returncode == 0, proc.stderr
+        # stdout carries JSON lines only, argparse output included
+        events = [json.loads(line) for line in proc.stdout.splitlines()]
+        assert events[0]["type"] == "ready"
+        by_job = {}
+        for evt in events[1:]:
+            by_job.setdefault(evt.get("job_id"), []).append(evt)
+
+        assert [e["type"] for e in by_job["1"][-2:]] == ["complete", "job_done"]
+        assert os.path.exists(by_job["1"][-2]["results_db"])
+        complete = by_job["2"][0]
+        assert (complete["type"], complete["total"], len(complete["items"])) == ("complete", 3, 2)
+        assert by_job["3"][0]["type"] == "usage" and "--min-score" in by_job["3"][0]["text"]
+        assert by_job["4"][0]["type"] == "error"
+        assert by_job["4"][0]["msg"].startswith("Invalid arguments for compute")
+        assert [e["type"] for e in by_job["5"]] == ["pong"]
+        # Every job but ping and shutdown ends with job_done
+        assert [e["job_id"] for e in events if e["type"] == "job_done"] == ["1", "2", "3", "4"]
+
+
+def test_write_xmp_does_not_load_opencv():
+    with tempfile.TemporaryDirectory() as tmp:
+        names = ["a.jpg", "b.jpg"]
+        for name in names:
+            with open(os.path.join(tmp, name), "wb") as f:
+                f.write(b"\xff\xd8\xff\xd9")
+        with open(os.path.join(tmp, "results.json"), "w", encoding="utf-8") as f:
+            json.dump([{"filename": os.path.join(tmp, n), "technical_score": 80.0} for n in names], f)
+
+        script = (
+            "import sys\n"
+            f"sys.argv = ['cli', 'write-xmp', '--input-dir', {tmp!r}]\n"
+            "from photo_selector import cli\n"
+            "cli.main()\n"
+            "print(sorted(m for m in ('cv2', 'numpy', 'PIL') if m in sys.modules))\n"
+        )
+        proc = subprocess.run(
+            [sys.executable, "-c", script], capture_output=True, text=True, cwd=tmp, env=_env(), timeout=120
+        )
+        assert proc.returncode == 0, proc.stderr
+        lines = proc.stdout.splitlines()
+        assert json.loads(lines[-2])["type"] == "complete"
+        assert lines[-1] == "[]"
+        assert all(os.path.exists(os.path.join(tmp, n[:-4] + ".xmp")) for n in names)
+
+
+def test_rerun_on_unchanged_photos_keeps_reading_the_store():
+    from photo_selector.cli import _newer_results_files
+
+    with tempfile.TemporaryDirectory() as tmp:
+        photos = os.path.join(tmp, "photos")
+        os.makedirs(photos)
+        _write_photos(photos, 4)
+        compute = ["compute", "--input-dir", photos, "--cache-dir", tmp, "--workers", "1"]
+        group = ["group", "--input-dir", photos, "--cache-dir", tmp, "--embed-model", "cv2_hist", "--workers", "0"]
+        json_path = os.path.join(photos, "results.json")
+
+        # The second compute writes no row, yet the store still matches the files it rewrote
+        for _ in range(2):
+            assert _run_cli(tmp, *compute)[-1]["type"] == "complete"
+            assert _newer_results_files(photos) == []
+
+        # Same size and mtime, unreadable content: group must read the store, not the file
+        st = os.stat(json_path)
+        with open(json_path, "w", encoding="utf-8") as f:
+            f.write("x" * st.st_size)
+        os.utime(json_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        for _ in range(2):
+            assert _run_cli(tmp, *group)[-1]["type"] == "complete"
+            assert _newer_results_files(photos) == []
+            with open(json_path, "r", encoding="utf-8") as f:
+                assert len(json.load(f)) == 4
+
+        # A rewrite from elsewhere (main.py) is still picked up
+        with open(json_path, "r", encoding="utf-8") as f:
+            rows = json.load(f)
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(rows[:3], f)
+        assert _newer_results_files(photos) == [json_path]
+        complete = _run_cli(tmp, "query", "--input-dir", photos)[-1]
+        assert complete["total"] == 3
+
+
+if __name__ == "__main__":
+    test_serve_job_round_trip()
+    test_write_xmp_does_not_load_opencv()
+    test_rerun_on_unchanged_photos_keeps_reading_the_store()
+    print("ok")